@@ -5,6 +5,7 @@
 -- ============================================
 
 -- Get user profile with basic stats
+-- Today's totals come from the daily_activity rollup (see backend/agent/activity_rollup.py)
 SELECT 
   u.id,
   u.name,
@@ -15,24 +16,24 @@ SELECT
   u.goals,
   u.experience,
   (SELECT COUNT(*) FROM friends WHERE user_id = u.id AND status = 'accepted') as friend_count,
-  (SELECT COUNT(*) FROM water_logs WHERE user_id = u.id AND DATE(logged_at) = CURRENT_DATE) as water_logs_today,
-  (SELECT SUM(steps) FROM steps_logs WHERE user_id = u.id AND DATE(logged_at) = CURRENT_DATE) as steps_today,
-  (SELECT SUM(calories) FROM calories_logs WHERE user_id = u.id AND DATE(logged_at) = CURRENT_DATE) as calories_today
+  COALESCE(a.water_logs, 0) as water_logs_today,
+  COALESCE(a.steps, 0) as steps_today,
+  COALESCE(a.calories, 0) as calories_today
 FROM users u
+LEFT JOIN daily_activity a ON a.user_id = u.id AND a.activity_date = CURRENT_DATE
 WHERE u.deleted_at IS NULL AND u.id = $1;
 
--- Get user's daily summary
+-- Get user's daily summary (last 30 days with activity)
 SELECT 
   u.name,
-  DATE(w.logged_at) as date,
-  COALESCE(SUM(CASE WHEN w.logged_at IS NOT NULL THEN w.amount ELSE 0 END), 0) as total_water_ml,
-  COALESCE((SELECT SUM(steps) FROM steps_logs s WHERE s.user_id = u.id AND DATE(s.logged_at) = DATE(w.logged_at)), 0) as total_steps,
-  COALESCE((SELECT SUM(calories) FROM calories_logs c WHERE c.user_id = u.id AND DATE(c.logged_at) = DATE(w.logged_at)), 0) as total_calories
+  a.activity_date as date,
+  a.water_ml as total_water_ml,
+  a.steps as total_steps,
+  a.calories as total_calories
 FROM users u
-LEFT JOIN water_logs w ON u.id = w.user_id
+JOIN daily_activity a ON a.user_id = u.id
 WHERE u.id = $1
-GROUP BY u.name, DATE(w.logged_at)
-ORDER BY date DESC
+ORDER BY a.activity_date DESC
 LIMIT 30;
 
 -- ============================================
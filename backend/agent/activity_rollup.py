@@ -0,0 +1,255 @@
+"""
+Daily Activity Rollups
+Per-user, per-day totals of the water, steps and calories logs
+
+The stats and trend reads used to SUM the raw logs per user and day on every
+request, grouping by DATE(logged_at), which the logged_at indexes can't
+serve. daily_activity (migration 006) keeps those totals keyed by
+(user_id, activity_date), so a dashboard reads one row per day instead.
+
+Two ways the table stays current:
+- statement triggers on the log tables (migration 006) apply every insert,
+  update and delete in the writer's transaction, whether the JS backend or
+  log_ingest.py wrote it; the migration backfills the existing logs
+- ActivityReconciler recomputes the last ACTIVITY_RECONCILE_DAYS days from the
+  raw logs every ACTIVITY_RECONCILE_INTERVAL seconds, correcting anything the
+  triggers can't see (TRUNCATE) and any drift. Only one process reconciles
+  at a time (advisory lock).
+
+Rebuild older history with: python backend/agent/activity_rollup.py --days 365
+
+Configure with environment variables:
+- ACTIVITY_RECONCILE_INTERVAL - seconds between reconciliations (default 300, 0 disables)
+- ACTIVITY_RECONCILE_DAYS - days back each reconciliation covers (default 2)
+"""
+
+from datetime import date, datetime, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+import argparse
+import threading
+import time
+import os
+
+from database import get_db_connection
+
+load_dotenv()
+
+FIELDS = (
+    "water_ml", "water_logs", "steps", "steps_logs", "calories",
+    "protein", "carbs", "fat", "fiber", "sugar", "food_items",
+)
+NUTRIENTS = ("protein", "carbs", "fat", "fiber", "sugar")
+
+
+def log_delta(log_type: str, log: dict) -> dict:
+    """
+    What one log row adds to its day's rollup.
+
+    `log` is a water_logs, steps_logs or calories_logs row (user_id, logged_at
+    and the amounts); log_type is 'water', 'steps' or 'calories'.
+    """
+    logged_at = log["logged_at"]
+    delta = {
+        "user_id": log["user_id"],
+        "activity_date": logged_at.date() if isinstance(logged_at, datetime) else logged_at,
+    }
+    if log_type == "water":
+        delta.update(water_ml=float(log["amount"]), water_logs=1)
+    elif log_type == "steps":
+        delta.update(steps=int(log["steps"]), steps_logs=1)
+    elif log_type == "calories":
+        delta.update(calories=int(log["calories"]), food_items=1)
+        delta.update({nutrient: float(log.get(nutrient) or 0) for nutrient in NUTRIENTS})
+    else:
+        raise ValueError(f"Unknown log type: {log_type}")
+    return delta
+
+
+RECONCILE_SQL = f"""
+    WITH activity AS (
+        SELECT user_id, logged_at::date AS activity_date,
+               SUM(amount) AS water_ml, COUNT(*) AS water_logs,
+               0 AS steps, 0 AS steps_logs, 0 AS calories,
+               0 AS protein, 0 AS carbs, 0 AS fat, 0 AS fiber, 0 AS sugar, 0 AS food_items
+        FROM water_logs
+        WHERE logged_at >= %(since)s
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT user_id, logged_at::date, 0, 0, SUM(steps), COUNT(*), 0, 0, 0, 0, 0, 0, 0
+        FROM steps_logs
+        WHERE logged_at >= %(since)s
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT user_id, logged_at::date, 0, 0, 0, 0, SUM(calories),
+               COALESCE(SUM(protein), 0), COALESCE(SUM(carbs), 0), COALESCE(SUM(fat), 0),
+               COALESCE(SUM(fiber), 0), COALESCE(SUM(sugar), 0), COUNT(*)
+        FROM calories_logs
+        WHERE logged_at >= %(since)s
+        GROUP BY 1, 2
+    ),
+    totals AS (
+        SELECT user_id, activity_date, {", ".join(f"SUM({field}) AS {field}" for field in FIELDS)}
+        FROM activity
+        GROUP BY user_id, activity_date
+    ),
+    corrected AS (
+        INSERT INTO daily_activity (user_id, activity_date, {", ".join(FIELDS)}, updated_at)
+        SELECT *, NOW() FROM totals
+        ON CONFLICT (user_id, activity_date) DO UPDATE SET
+            {", ".join(f"{field} = EXCLUDED.{field}" for field in FIELDS)},
+            updated_at = NOW()
+        WHERE ({", ".join(f"daily_activity.{field}" for field in FIELDS)})
+              IS DISTINCT FROM ({", ".join(f"EXCLUDED.{field}" for field in FIELDS)})
+        RETURNING 1
+    ),
+    emptied AS (
+        DELETE FROM daily_activity d
+        WHERE d.activity_date >= %(since)s
+          AND NOT EXISTS (
+              SELECT 1 FROM totals t
+              WHERE t.user_id = d.user_id AND t.activity_date = d.activity_date
+          )
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM corrected), (SELECT COUNT(*) FROM emptied)
+"""
+
+
+def reconcile(days: int = 2) -> Optional[dict]:
+    """
+    Recompute the last `days` days (today included) from the raw logs.
+
+    Rows that already match are left alone; returns how many were corrected
+    or deleted, or None when another process is reconciling right now. A log
+    recorded while this runs can be missed until the next run. Months whose
+    logs were archived (log_partitions.py) are never recomputed, since their
+    totals can't be rebuilt from Postgres any more.
+    """
+    since = date.today() - timedelta(days=max(days, 1) - 1)
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext('daily_activity_reconcile'))")
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                return None
+            cursor.execute("SELECT (MAX(month) + INTERVAL '1 month')::date FROM log_archives")
+            live_since = cursor.fetchone()[0]
+            if live_since and since < live_since:
+                since = live_since
+            cursor.execute(RECONCILE_SQL, {"since": since})
+            corrected, deleted = cursor.fetchone()
+        conn.commit()
+    return {"since": since.isoformat(), "corrected": corrected, "deleted": deleted}
+
+
+class ActivityReconciler:
+    """Background thread that runs reconcile() on an interval."""
+
+    def __init__(self, interval: float = 300.0, days: int = 2):
+        self.interval = interval
+        self.days = days
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "skipped": 0, "corrected": 0, "deleted": 0, "errors": 0}
+        self._last_run = None
+
+    def start(self):
+        if self._thread or self.interval <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="activity-reconciler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def run_once(self, raise_errors: bool = False) -> Optional[dict]:
+        """Reconcile now; None if another process holds the lock (or on error, unless raise_errors)."""
+        started = time.perf_counter()
+        try:
+            result = reconcile(self.days)
+        except Exception as e:
+            print(f"Daily activity reconciliation error: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+            if raise_errors:
+                raise
+            return None
+        with self._lock:
+            if result is None:
+                self._stats["skipped"] += 1
+            else:
+                self._stats["runs"] += 1
+                self._stats["corrected"] += result["corrected"]
+                self._stats["deleted"] += result["deleted"]
+                self._last_run = {
+                    **result,
+                    "finished_at": datetime.now().isoformat(),
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                }
+        return result
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.run_once()
+            self._stopping.wait(self.interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "days": self.days,
+                "running": self._thread is not None,
+                **self._stats,
+                "last_run": self._last_run,
+            }
+
+
+# ===== Reads =====
+
+def _empty_day(activity_date: date) -> dict:
+    return {"activity_date": activity_date, **dict.fromkeys(FIELDS, 0)}
+
+
+async def activity_for_days(conn, user_id: int, start: date, end: date) -> list:
+    """One rollup dict per day from start to end (inclusive), zeros for days without logs."""
+    rows = await conn.fetch(f"""
+        SELECT activity_date, {", ".join(FIELDS)}
+        FROM daily_activity
+        WHERE user_id = $1 AND activity_date BETWEEN $2 AND $3
+    """, user_id, start, end)
+    by_date = {row["activity_date"]: dict(row) for row in rows}
+    return [
+        by_date.get(start + timedelta(days=offset)) or _empty_day(start + timedelta(days=offset))
+        for offset in range((end - start).days + 1)
+    ]
+
+
+activity_reconciler = ActivityReconciler(
+    interval=float(os.getenv("ACTIVITY_RECONCILE_INTERVAL", "300")),
+    days=int(os.getenv("ACTIVITY_RECONCILE_DAYS", "2")),
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild daily_activity from the raw logs")
+    parser.add_argument("--days", type=int, default=int(os.getenv("ACTIVITY_RECONCILE_DAYS", "2")),
+                        help="days back to recompute, today included")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    result = reconcile(args.days)
+    if result is None:
+        print("Another reconciliation is running; try again later")
+        return
+    print(f"Reconciled daily_activity since {result['since']}: {result['corrected']} rows updated, "
+          f"{result['deleted']} removed in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
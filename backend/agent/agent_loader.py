@@ -0,0 +1,92 @@
+"""
+Agent Loader
+Lazy access to the LangChain schedule agent (workout_agent.py)
+
+Importing workout_agent pulls in LangChain and the Anthropic SDK, which
+takes seconds, so api.py and batch.py only import it on first use: the first
+/ai/schedule request (or batch run) pays for it, while GET / and the
+database-only endpoints never do. The chat model and agent are built on
+first use too (workout_agent.build_agent()).
+
+With AGENT_WARMUP=true, warm_up() runs in a background thread at startup,
+so the first schedule request doesn't wait and the process still starts
+serving right away.
+
+Check the import cost with: python backend/agent/bench_import.py
+
+Configure with environment variables:
+- AGENT_WARMUP - 'true' to load and build the agent in the background at startup (default false)
+"""
+
+from typing import Optional
+from dotenv import load_dotenv
+import importlib
+import threading
+import time
+import os
+
+load_dotenv()
+
+_module = None
+_lock = threading.Lock()
+_timings = {"import_ms": None, "build_ms": None}
+_warm_up_thread = None
+
+
+def load_agent():
+    """The workout_agent module, imported on first call."""
+    global _module
+    if _module is None:
+        with _lock:
+            if _module is None:
+                started = time.perf_counter()
+                module = importlib.import_module("workout_agent")
+                _timings["import_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                _module = module
+    return _module
+
+
+def warm_up():
+    """Import workout_agent and build its model and agent now instead of on the first request."""
+    agent = load_agent()
+    started = time.perf_counter()
+    agent.build_agent()
+    if _timings["build_ms"] is None:
+        _timings["build_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    except Exception as e:
+        # The first request will try again (and report the error)
+        print(f"Agent warm-up error: {e}")
+
+
+def start_warm_up() -> Optional[threading.Thread]:
+    """Run warm_up() in a background thread if AGENT_WARMUP=true."""
+    global _warm_up_thread
+    if os.getenv("AGENT_WARMUP", "false").lower() != "true" or _warm_up_thread is not None:
+        return None
+    _warm_up_thread = threading.Thread(target=_warm_up_in_background, name="agent-warm-up", daemon=True)
+    _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def generate_weekly_schedule(*args, **kwargs) -> dict:
+    """workout_agent.generate_weekly_schedule, importing the agent on first use."""
+    return load_agent().generate_weekly_schedule(*args, **kwargs)
+
+
+def stream_weekly_schedule(*args, **kwargs):
+    """workout_agent.stream_weekly_schedule, importing the agent on first use."""
+    return load_agent().stream_weekly_schedule(*args, **kwargs)
+
+
+def agent_status() -> dict:
+    return {
+        "loaded": _module is not None,
+        "built": _module is not None and _module.model is not None,
+        "warm_up": _warm_up_thread is not None,
+        **_timings,
+    }
@@ -5,27 +5,108 @@ Run with: uvicorn backend.agent.api:app --reload --port 8000
 
 Endpoints:
 - POST /ai/schedule - Generate schedule using LLM agent (calls Claude)
-- GET /schedule/{user_id} - Fetch user's schedule (direct database)
+- POST /ai/schedule/stream - Same, streaming progress as Server-Sent Events
+- GET /ai/schedule/jobs/stats - Background job queue depth and counters
+- GET /ai/schedule/jobs/{job_id} - Poll a background schedule job
+- GET /ai/schedule/stats - Structured output parse-failure and repair rates
+- GET /ai/plan-cache/stats - LLM plan cache hit rate
+- GET /ai/agent/status - Whether the agent is loaded yet, and its import/build time
+- GET /ai/governor/stats - LLM rate budget, lanes and circuit breaker state
+- GET /ai/schedule/patch/stats - Schedule days regenerated after profile updates
+- POST /ai/schedule/batch - Generate a week's schedules for all active users
+- GET /ai/schedule/batch/{run_id} - Batch run progress and throughput
+- GET /schedule/{user_id} - Fetch user's schedule (direct database, cached with ETag, ?fields=&days= projection)
 - POST /schedule - Save schedule (direct database)
+- POST /schedules/bulk - Save many schedules in one statement
+- GET /schedules?user_ids=1,2,3 - Fetch several users' schedules in one query
+- POST /logs/batch - Ingest water, steps and calories logs in bulk (routes/logs.py)
+- GET /logs/stats - Log ingestion throughput and batching
+- GET /logs/{user_id}?type=steps&start=&end= - Raw logs, archived months read from Parquet
+- GET /logs/partitions/stats - Monthly log partition and archive maintenance (log_partitions.py)
+- GET /activity/{user_id}/summary - One day's water, steps and calories totals
+- GET /activity/{user_id}/trend - Daily totals for the last N days
+- POST /activity/reconcile - Recompute recent daily totals from the raw logs
+- GET /activity/reconcile/stats - Daily activity reconciliation counters
+- GET /friends/{user_id}/leaderboard - The user and their friends ranked by weekly steps (routes/friends.py)
+- GET /friends/{user_id}/mutual/{other_id} - Mutual friends from the in-memory friends graph
+- GET /friends/stats - Friends graph size and freshness
+- GET /calories/search?q=chicken - Food typeahead from the local nutrition index
+- GET /calories/stats - Food index size and search latency
+- GET /db/pool - Connection pool size and wait metrics
+- GET /catalog/stats - Workout catalog cache hit/miss counters
+- GET /metrics - Prometheus metrics (per-stage latency histograms, tokens)
+- GET /schedule-cache/stats - Schedule response cache hit/miss counters
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
-from datetime import datetime, timedelta
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Dict, Any, List, Literal
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from uuid import UUID
 from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import asyncpg
 import json
-import os
+import time
+import sys
 
 # Import the agent's main function
-from workout_agent import generate_weekly_schedule
+# The LangChain agent is imported on first use (agent_loader.py), not here
+from agent_loader import generate_weekly_schedule, stream_weekly_schedule, start_warm_up, agent_status
+from database import get_async_connection, close_pools, pool_stats
+from jobs import create_job_queue, QueueFullError
+from batch import BatchScheduleRun, get_batch_run, start_batch_in_background, batch_options_from_env
+from catalog import workout_catalog, catalog_listener, start_catalog_listener
+from schedule_cache import schedule_cache, make_etag, etag_matches
+from schedule_json import encode_response, parse_projection, plan_data_sql
+from schedule_schema import plan_output_stats, next_week_start
+from plan_cache import plan_cache
+from llm_governor import llm_governor
+from schedule_patch import schedule_patcher
+from telemetry import configure_tracing, render_metrics, HTTP_REQUEST_SECONDS
+from activity_rollup import activity_reconciler, activity_for_days
+from log_ingest import log_ingest
+from log_partitions import log_partitions
+from food_search import food_search
+from friends_graph import friends_graph, start_friends_graph
+
+# backend/routes sits next to backend/agent; make it importable when running from here
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from routes.user import router as user_router
+from routes.logs import router as logs_router
+from routes.friends import router as friends_router
 
 load_dotenv()
 
-app = FastAPI(title="Workout Schedule Generator API", version="1.0.0")
+# Background workers for POST /ai/schedule with "background": true
+schedule_jobs = create_job_queue(generate_weekly_schedule)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configure_tracing()
+    start_warm_up()
+    start_catalog_listener()
+    schedule_jobs.start()
+    activity_reconciler.start()
+    start_friends_graph()
+    log_partitions.start()
+    yield
+    await log_ingest.close()
+    log_partitions.stop(timeout=5)
+    schedule_patcher.stop()
+    friends_graph.stop(timeout=5)
+    activity_reconciler.stop(timeout=5)
+    schedule_jobs.stop(timeout=5)
+    catalog_listener.stop(timeout=5)
+    await close_pools()
+
+
+app = FastAPI(title="Workout Schedule Generator API", version="1.0.0", lifespan=lifespan)
 
 # Enable CORS so the JavaScript backend can call this API
 app.add_middleware(
@@ -36,23 +117,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database connection helper
-def get_db_connection():
-    """Create PostgreSQL database connection"""
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        port=int(os.getenv("DB_PORT")),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
-    )
+app.include_router(user_router)
+app.include_router(logs_router)
+app.include_router(friends_router)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Request duration per route template (e.g. /schedule/{user_id}), for GET /metrics."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status,
+        )
 
 
 # ===== Request/Response Models =====
 
+MAX_BULK_SCHEDULES = 1000  # rows per POST /schedules/bulk and user ids per GET /schedules
+
+
 class GenerateScheduleRequest(BaseModel):
     user_id: int
     week_start_date: Optional[str] = None  # If not provided, uses next Monday
+    background: bool = False  # If true, queue a job and return its id immediately ("llm" mode only)
+    mode: Literal["llm", "fast"] = "llm"  # "fast" uses the rule-based scheduler, no LLM call
+
+
+class BatchScheduleRequest(BaseModel):
+    week_start_date: Optional[str] = None  # If not provided, uses next Monday
+    mode: Literal["llm", "fast"] = "llm"
+    resume_run_id: Optional[UUID] = None  # Continue an interrupted run instead
+    concurrency: Optional[int] = None  # Defaults to BATCH_CONCURRENCY
+    chunk_size: Optional[int] = None  # Defaults to BATCH_CHUNK_SIZE
 
 
 class SaveScheduleRequest(BaseModel):
@@ -61,6 +167,10 @@ class SaveScheduleRequest(BaseModel):
     plan_data: Dict[str, Any]  # Schedule JSON structure
 
 
+class BulkSaveScheduleRequest(BaseModel):
+    schedules: List[SaveScheduleRequest] = Field(min_length=1, max_length=MAX_BULK_SCHEDULES)
+
+
 # ===== API Endpoints =====
 
 @app.get("/")
@@ -82,22 +192,38 @@ def generate_schedule(request: GenerateScheduleRequest):
     POST http://localhost:8000/ai/schedule
     {
         "user_id": 1,
-        "week_start_date": "2025-12-02"  // optional
+        "week_start_date": "2025-12-02",  // optional
+        "background": true,               // optional, "llm" mode only
+        "mode": "fast"                    // optional, "llm" (default) or "fast"
     }
+    
+    "mode": "fast" builds the schedule with the rule-based scheduler in
+    milliseconds. In "llm" mode, if the model times out or is rate-limited,
+    the rule-based schedule is returned instead and "fallback_reason" says why.
+    
+    With "background": true the schedule is generated by a worker and the
+    response is 202 with a job_id; poll GET /ai/schedule/jobs/{job_id} for
+    the result. A second request for the same user and week while a job is
+    pending returns the existing job instead of starting another one.
+    "background" is ignored with "mode": "fast", which takes milliseconds:
+    the response is the usual 200 with the schedule, not a 202 with a job.
     """
+    # Calculate week start date if not provided
+    if request.week_start_date:
+        week_start = request.week_start_date
+    else:
+        today = datetime.now()
+        days_ahead = 0 - today.weekday()
+        if days_ahead <= 0:
+            days_ahead += 7
+        week_start = (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
+    
+    if request.background and request.mode == "llm":
+        return submit_schedule_job(request.user_id, week_start)
+    
     try:
-        # Calculate week start date if not provided
-        if request.week_start_date:
-            week_start = request.week_start_date
-        else:
-            today = datetime.now()
-            days_ahead = 0 - today.weekday()
-            if days_ahead <= 0:
-                days_ahead += 7
-            week_start = (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
-        
         # Call the agent to generate schedule
-        result = generate_weekly_schedule(request.user_id, week_start)
+        result = generate_weekly_schedule(request.user_id, week_start, mode=request.mode)
         
         if not result.get("success"):
             raise HTTPException(
@@ -110,6 +236,12 @@ def generate_schedule(request: GenerateScheduleRequest):
             "user_id": request.user_id,
             "week_start_date": week_start,
             "schedule": result.get("schedule"),
+            "plan_data": result.get("plan_data"),
+            "mode": result.get("mode", request.mode),
+            "fallback_reason": result.get("fallback_reason"),
+            "plan_cache": result.get("plan_cache"),
+            "agent_usage": result.get("agent_usage"),
+            "timings": result.get("timings"),
             "message": "Schedule generated and saved successfully"
         }
         
@@ -120,31 +252,253 @@ def generate_schedule(request: GenerateScheduleRequest):
         )
 
 
+@app.post("/ai/schedule/stream")
+def stream_schedule(request: GenerateScheduleRequest):
+    """
+    Generate a schedule like POST /ai/schedule, streaming progress as Server-Sent Events.
+    
+    The first event is sent right away, so clients see bytes within a second
+    instead of waiting for the whole generation. Events, in order:
+    
+        event: progress      data: {"stage": "loading_context" | "planning" | "plan_cache_hit" | "saving"}
+        event: tool_start    data: {"tool": ..., "args": ...}   (tool mode only)
+        event: tool_end      data: {"tool": ..., "status": ...}
+        event: plan_day      data: one entry of plan_data["workouts"], as soon as it is generated
+        event: plan_reset    data: {"reason": ...}  (the plan is being repaired; drop the days so far)
+        event: fallback      data: {"reason": ...}  (switching to the rule-based scheduler)
+        event: schedule      data: same body as POST /ai/schedule's result (always last on success)
+        event: error         data: {"success": false, "error": ...}
+    
+    "background" is ignored here.
+    """
+    week_start = request.week_start_date or next_week_start()
+    events = stream_weekly_schedule(request.user_id, week_start, mode=request.mode)
+    return StreamingResponse(
+        _server_sent_events(events),
+        media_type="text/event-stream",
+        # Stop proxies (nginx) from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _server_sent_events(events):
+    """Format (event, data) pairs as SSE messages."""
+    for event, data in events:
+        yield f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+def submit_schedule_job(user_id: int, week_start: str) -> JSONResponse:
+    """Queue a background generation job and describe it for the client."""
+    try:
+        job, created = schedule_jobs.submit(user_id, week_start)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error queueing schedule job: {str(e)}"
+        )
+    
+    return JSONResponse(status_code=202, content=jsonable_encoder({
+        "success": True,
+        "job_id": job["id"],
+        "status": job["status"],
+        "user_id": user_id,
+        "week_start_date": week_start,
+        "status_url": f"/ai/schedule/jobs/{job['id']}",
+        "message": "Schedule job queued" if created else "Schedule job already pending"
+    }))
+
+
+# Declared before /ai/schedule/jobs/{job_id}, which would otherwise match "stats"
+@app.get("/ai/schedule/jobs/stats")
+def get_schedule_job_stats():
+    """
+    Background schedule jobs (jobs.py): queued and running jobs across all
+    workers, plus what this process submitted, deduplicated, rejected and ran.
+    """
+    try:
+        return schedule_jobs.stats()
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching schedule job stats: {str(e)}"
+        )
+
+
+@app.get("/ai/schedule/jobs/{job_id}")
+def get_schedule_job(job_id: UUID):
+    """
+    Poll a background schedule job.
+    
+    status is one of queued, running, succeeded or failed. When succeeded,
+    "schedule" holds the same value POST /ai/schedule returns synchronously.
+    """
+    try:
+        job = schedule_jobs.get(str(job_id))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching schedule job: {str(e)}"
+        )
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Schedule job not found")
+    
+    result = job.pop("result") or {}
+    return {
+        "success": True,
+        **job,
+        "schedule": result.get("schedule"),
+        "plan_data": result.get("plan_data"),
+    }
+
+
+@app.get("/ai/schedule/stats")
+def get_schedule_output_stats():
+    """
+    Structured output metrics for generated schedules.
+    
+    parse_failure_rate is the share of model answers that were invalid on the
+    first try; retry_rate the share that needed the repair pass, and
+    repair_success_rate how often that pass fixed them.
+    """
+    return plan_output_stats.stats()
+
+
+@app.get("/ai/plan-cache/stats")
+def get_plan_cache_stats():
+    """LLM plan cache metrics (memory/database hits, misses, hit_rate)."""
+    return plan_cache.stats()
+
+
+@app.get("/ai/agent/status")
+def get_agent_status():
+    """
+    Whether the LangChain agent has been imported and built, and how long that took.
+
+    It is loaded on the first schedule request, or at startup in the
+    background with AGENT_WARMUP=true (agent_loader.py).
+    """
+    return agent_status()
+
+
+@app.get("/ai/governor/stats")
+def get_governor_stats():
+    """
+    LLM governor state for this process (llm_governor.py): active and queued
+    calls per lane, waits, timeouts and the circuit breaker.
+    """
+    return llm_governor.stats()
+
+
+@app.get("/ai/schedule/patch/stats")
+def get_schedule_patch_stats():
+    """
+    Schedules patched after profile updates (schedule_patch.py): days
+    changed, model re-plans and rule fallbacks, and writes skipped because
+    the schedule changed meanwhile.
+    """
+    return schedule_patcher.stats()
+
+
+@app.post("/ai/schedule/batch", status_code=202)
+def start_schedule_batch(request: BatchScheduleRequest):
+    """
+    Start generating a week's schedules for every active user.
+    
+    Runs in the background; poll GET /ai/schedule/batch/{run_id}. Pass
+    resume_run_id to continue a run that was interrupted.
+    """
+    options = batch_options_from_env()
+    if request.concurrency:
+        options["concurrency"] = request.concurrency
+    if request.chunk_size:
+        options["chunk_size"] = request.chunk_size
+    
+    try:
+        if request.resume_run_id:
+            batch = BatchScheduleRun.resume(str(request.resume_run_id), **options)
+        else:
+            week_start = request.week_start_date or next_week_start()
+            batch = BatchScheduleRun.create(week_start, request.mode, **options)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error starting batch: {str(e)}"
+        )
+    
+    start_batch_in_background(batch)
+    return {
+        "success": True,
+        "run_id": batch.run_id,
+        "week_start_date": batch.week_start_date,
+        "mode": batch.mode,
+        "status_url": f"/ai/schedule/batch/{batch.run_id}"
+    }
+
+
+@app.get("/ai/schedule/batch/{run_id}")
+def get_schedule_batch(run_id: UUID):
+    """Batch run progress: last user processed, counts and schedules/min."""
+    try:
+        run = get_batch_run(str(run_id))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching batch run: {str(e)}"
+        )
+    
+    if not run:
+        raise HTTPException(status_code=404, detail="Batch run not found")
+    return {"success": True, **run}
+
+
 @app.get("/schedule/{user_id}")
-def get_user_schedule(user_id: int, limit: int = 1):
+async def get_user_schedule(user_id: int, limit: int = 1,
+                            fields: Optional[str] = None, days: Optional[str] = None,
+                            if_none_match: Optional[str] = Header(default=None)):
     """
     Fetch user's schedule from database (direct database access, no agent).
     
     The JavaScript backend calls this like:
     GET http://localhost:8000/schedule/1?limit=1
+    GET http://localhost:8000/schedule/1?fields=workouts&days=Monday,Tuesday
     
-    Returns the most recent schedule(s) for the user.
+    Returns the most recent schedule(s) for the user. fields keeps only those
+    plan_data keys and days only those days' workouts. Responses carry an
+    ETag; send it back as If-None-Match to get 304 Not Modified while the
+    schedules are unchanged. Served from the schedule cache when possible.
     """
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        cursor.execute("""
-            SELECT id, week_start_date, plan_data, created_at, updated_at
-            FROM schedules
-            WHERE user_id = %s
-            ORDER BY week_start_date DESC
-            LIMIT %s
-        """, (user_id, limit))
-        
-        results = cursor.fetchall()
+        field_names, weekdays = parse_projection(fields, days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    variant = ":".join([str(limit), ",".join(field_names), ",".join(weekdays)])
+    cached = schedule_cache.get(user_id, variant)
+    if cached:
+        body, etag = cached
+    else:
+        # Taken before the query: a write landing in between keeps this body out of the cache
+        generation = schedule_cache.generation(user_id)
+        plan_data, plan_args = plan_data_sql(field_names, weekdays, next_param=3)
+        try:
+            async with get_async_connection() as conn:
+                results = await conn.fetch(f"""
+                    SELECT id, week_start_date, {plan_data}, created_at, updated_at
+                    FROM schedules
+                    WHERE user_id = $1
+                    ORDER BY week_start_date DESC
+                    LIMIT $2
+                """, user_id, limit, *plan_args)
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error fetching schedule: {str(e)}"
+            )
         
         if not results:
             raise HTTPException(
@@ -152,32 +506,21 @@ def get_user_schedule(user_id: int, limit: int = 1):
                 detail="No schedules found for this user"
             )
         
-        # Convert to list of dicts
-        schedules = [dict(row) for row in results]
-        
-        return {
-            "success": True,
-            "user_id": user_id,
-            "count": len(schedules),
-            "schedules": schedules
-        }
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Error fetching schedule: {str(e)}"
-        )
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        # plan_data arrives as JSON text and goes into the body undecoded;
+        # cache hits and 304s skip this and the query
+        body = encode_response({"success": True, "user_id": user_id, "count": len(results)}, results)
+        etag = make_etag(body)
+        schedule_cache.set(user_id, variant, body, etag, generation)
+    
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        schedule_cache.record_not_modified()
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.post("/schedule")
-def save_schedule(request: SaveScheduleRequest):
+async def save_schedule(request: SaveScheduleRequest):
     """
     Save a workout schedule to database (direct database access, no agent).
     
@@ -205,27 +548,20 @@ def save_schedule(request: SaveScheduleRequest):
         }
     }
     """
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Convert plan_data dict to JSON string
-        plan_json = json.dumps(request.plan_data)
+        # asyncpg binds DATE columns from date objects, not strings
+        week_start = date.fromisoformat(request.week_start_date)
         
-        # Insert or update schedule
-        cursor.execute("""
-            INSERT INTO schedules (user_id, week_start_date, plan_data, created_at, updated_at)
-            VALUES (%s, %s, %s, NOW(), NOW())
-            ON CONFLICT (user_id, week_start_date)
-            DO UPDATE SET plan_data = EXCLUDED.plan_data, updated_at = NOW()
-            RETURNING id
-        """, (request.user_id, request.week_start_date, plan_json))
-        
-        result = cursor.fetchone()
-        schedule_id = result[0] if result else None
-        conn.commit()
+        # Insert or update schedule (plan_data is JSON-encoded by the pool's jsonb codec)
+        async with get_async_connection() as conn:
+            schedule_id = await conn.fetchval("""
+                INSERT INTO schedules (user_id, week_start_date, plan_data, created_at, updated_at)
+                VALUES ($1, $2, $3, NOW(), NOW())
+                ON CONFLICT (user_id, week_start_date)
+                DO UPDATE SET plan_data = EXCLUDED.plan_data, updated_at = NOW()
+                RETURNING id
+            """, request.user_id, week_start, request.plan_data)
+        schedule_cache.invalidate(request.user_id)
         
         return {
             "success": True,
@@ -236,17 +572,277 @@ def save_schedule(request: SaveScheduleRequest):
         }
         
     except Exception as e:
-        if conn:
-            conn.rollback()
         raise HTTPException(
             status_code=500,
             detail=f"Error saving schedule: {str(e)}"
         )
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+
+
+@app.post("/schedules/bulk")
+async def save_schedules_bulk(request: BulkSaveScheduleRequest):
+    """
+    Save many schedules in one round-trip (direct database access, no agent).
+
+    The JavaScript backend calls this like:
+    POST http://localhost:8000/schedules/bulk
+    {
+        "schedules": [
+            {"user_id": 1, "week_start_date": "2025-12-02", "plan_data": {...}},
+            {"user_id": 2, "week_start_date": "2025-12-02", "plan_data": {...}}
+        ]
+    }
+
+    All rows are upserted by a single INSERT ... ON CONFLICT statement, so
+    either every schedule is saved or none is. If the same user and week
+    appear more than once, the last one wins.
+    """
+    rows = {}
+    for schedule in request.schedules:
+        try:
+            week_start = date.fromisoformat(schedule.week_start_date)
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid week_start_date: {schedule.week_start_date}"
+            )
+        # ON CONFLICT can't update the same row twice in one statement
+        rows[(schedule.user_id, week_start)] = json.dumps(schedule.plan_data)
+
+    user_ids = [user_id for user_id, _ in rows]
+    weeks = [week_start for _, week_start in rows]
+
+    try:
+        # plan_data goes over as text[]; the pool's jsonb codec only covers scalar values
+        async with get_async_connection() as conn:
+            results = await conn.fetch("""
+                INSERT INTO schedules (user_id, week_start_date, plan_data, created_at, updated_at)
+                SELECT user_id, week_start_date, plan_data::jsonb, NOW(), NOW()
+                FROM unnest($1::int[], $2::date[], $3::text[]) AS rows (user_id, week_start_date, plan_data)
+                ON CONFLICT (user_id, week_start_date)
+                DO UPDATE SET plan_data = EXCLUDED.plan_data, updated_at = NOW()
+                RETURNING id, user_id, week_start_date
+            """, user_ids, weeks, list(rows.values()))
+    except asyncpg.ForeignKeyViolationError:
+        raise HTTPException(
+            status_code=404,
+            detail="One or more user_ids do not exist; no schedules were saved"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error saving schedules: {str(e)}"
+        )
+    schedule_cache.invalidate(*set(user_ids))
+
+    return {
+        "success": True,
+        "message": "Schedules saved successfully",
+        "count": len(results),
+        "schedules": [
+            {
+                "schedule_id": row["id"],
+                "user_id": row["user_id"],
+                "week_start_date": row["week_start_date"].isoformat()
+            }
+            for row in results
+        ]
+    }
+
+
+@app.get("/schedules")
+async def get_schedules(user_ids: str = Query(..., description="Comma-separated user ids, e.g. 1,2,3"),
+                        week: Optional[str] = None,
+                        fields: Optional[str] = None, days: Optional[str] = None):
+    """
+    Fetch several users' schedules in one query (direct database access, no agent).
+
+    The JavaScript backend calls this like:
+    GET http://localhost:8000/schedules?user_ids=1,2,3&week=2025-12-02
+
+    With week, returns each user's schedule for that week; without it, each
+    user's most recent schedule. Users without one are listed in
+    missing_user_ids. Both lookups use the (user_id, week_start_date) index.
+    fields and days project plan_data as in GET /schedule/{user_id}.
+    """
+    try:
+        ids = list(dict.fromkeys(int(user_id) for user_id in user_ids.split(",") if user_id.strip()))
+        week_start = date.fromisoformat(week) if week else None
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="user_ids must be comma-separated integers and week a YYYY-MM-DD date"
+        )
+    try:
+        field_names, weekdays = parse_projection(fields, days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not ids:
+        raise HTTPException(status_code=400, detail="user_ids is required")
+    if len(ids) > MAX_BULK_SCHEDULES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_BULK_SCHEDULES} user_ids per request"
+        )
+
+    try:
+        async with get_async_connection() as conn:
+            if week_start:
+                plan_data, plan_args = plan_data_sql(field_names, weekdays, next_param=3)
+                results = await conn.fetch(f"""
+                    SELECT id, user_id, week_start_date, {plan_data}, created_at, updated_at
+                    FROM schedules
+                    WHERE user_id = ANY($1::int[]) AND week_start_date = $2
+                """, ids, week_start, *plan_args)
+            else:
+                plan_data, plan_args = plan_data_sql(field_names, weekdays, next_param=2)
+                results = await conn.fetch(f"""
+                    SELECT DISTINCT ON (user_id)
+                        id, user_id, week_start_date, {plan_data}, created_at, updated_at
+                    FROM schedules
+                    WHERE user_id = ANY($1::int[])
+                    ORDER BY user_id, week_start_date DESC
+                """, ids, *plan_args)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching schedules: {str(e)}"
+        )
+
+    found = {row["user_id"] for row in results}
+    return Response(
+        content=encode_response(
+            {"success": True, "week_start_date": week, "count": len(results)},
+            results,
+            {"missing_user_ids": [user_id for user_id in ids if user_id not in found]}
+        ),
+        media_type="application/json"
+    )
+
+
+@app.get("/activity/{user_id}/summary")
+async def get_activity_summary(user_id: int, day: Optional[date] = Query(default=None, alias="date")):
+    """
+    One day's water, steps and calories totals (default today).
+
+    The JavaScript backend calls this like:
+    GET http://localhost:8000/activity/1/summary?date=2025-12-02
+
+    Read from the daily_activity rollup (activity_rollup.py), not the raw logs.
+    """
+    day = day or date.today()
+    try:
+        async with get_async_connection() as conn:
+            (summary,) = await activity_for_days(conn, user_id, day, day)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching activity: {str(e)}"
+        )
+    return {"success": True, "user_id": user_id, "summary": summary}
+
+
+@app.get("/activity/{user_id}/trend")
+async def get_activity_trend(user_id: int, days: int = Query(default=7, ge=1, le=366)):
+    """
+    Daily totals for the last `days` days, newest first (zeros for days without logs).
+
+    The JavaScript backend calls this like:
+    GET http://localhost:8000/activity/1/trend?days=7
+    """
+    end = date.today()
+    try:
+        async with get_async_connection() as conn:
+            trend = await activity_for_days(conn, user_id, end - timedelta(days=days - 1), end)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error fetching activity: {str(e)}"
+        )
+    return {"success": True, "user_id": user_id, "days": days, "trend": trend[::-1]}
+
+
+@app.post("/activity/reconcile")
+def reconcile_activity():
+    """
+    Recompute the recent daily totals from the raw logs now.
+
+    Runs the same pass as the background reconciler (ACTIVITY_RECONCILE_DAYS
+    back); 409 if another process is reconciling at the moment.
+    """
+    try:
+        result = activity_reconciler.run_once(raise_errors=True)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error reconciling activity: {str(e)}"
+        )
+    if result is None:
+        raise HTTPException(status_code=409, detail="Another reconciliation is running")
+    return {"success": True, **result}
+
+
+@app.get("/activity/reconcile/stats")
+def get_activity_reconcile_stats():
+    """Daily activity reconciliation counters (runs, corrected and deleted rows, last run)."""
+    return activity_reconciler.stats()
+
+
+@app.get("/calories/search")
+def search_calories(q: Optional[str] = None, limit: int = Query(default=10, ge=1, le=20)):
+    """
+    Food typeahead, same response as the JavaScript backend's /calories/search.
+
+    The JavaScript backend calls this like:
+    GET http://localhost:8000/calories/search?q=chicken%20br
+
+    Served from the in-memory food index (food_search.py); CalorieNinjas is
+    only asked when nothing matches locally. `source` says which answered.
+    """
+    if not q or not q.strip():
+        raise HTTPException(status_code=400, detail='Query parameter "q" is required')
+    results, source = food_search.search(q, limit)
+    return {"results": results, "source": source}
+
+
+@app.get("/calories/stats")
+def get_calorie_search_stats():
+    """Food index size, search latency (µs) and external lookup counters."""
+    return food_search.stats()
+
+
+@app.get("/db/pool")
+def get_pool_stats():
+    """
+    Connection pool metrics (open/idle/in-use connections, checkout waits).
+    
+    Use wait_time_ms_avg / waits / timeouts to size DB_POOL_MIN and DB_POOL_MAX.
+    """
+    return pool_stats()
+
+
+@app.get("/catalog/stats")
+def get_catalog_stats():
+    """Workout catalog cache metrics (version, hits, misses, reloads, invalidations)."""
+    return workout_catalog.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus scrape endpoint.
+    
+    Histograms: http_request_seconds, schedule_generation_seconds,
+    agent_stage_seconds, agent_tool_seconds, agent_model_call_seconds,
+    agent_turns and db_pool_checkout_seconds; agent_model_tokens_total counts
+    input/output tokens. Values are per API process.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/schedule-cache/stats")
+def get_schedule_cache_stats():
+    """Schedule response cache metrics (backend, hits, misses, 304s, invalidations)."""
+    return schedule_cache.stats()
 
 
 # Run with: uvicorn backend.agent.api:app --reload --port 8000
@@ -0,0 +1,394 @@
+"""
+Weekly Batch Schedule Generation
+Generate next week's schedule for every active user ahead of Monday
+
+Run with: python backend/agent/batch.py --week 2025-12-08 --concurrency 4
+Resume:   python backend/agent/batch.py --resume <run_id>
+
+Users are read from `users` in keyset-paginated chunks (WHERE id > last id).
+Each chunk is planned with bounded concurrency, written with one multi-row
+INSERT ... ON CONFLICT into `schedules`, and then checkpointed in
+schedule_batch_runs (migration 004). A crashed run resumes after the last
+checkpointed user.
+
+Only one process works on a run: the process holding it (lease_owner,
+migration 011) refreshes updated_at every BATCH_LEASE_TIMEOUT / 3 seconds,
+and a resume of a 'running' run is refused until that heartbeat is older
+than BATCH_LEASE_TIMEOUT. A process that finds its lease taken over stops
+after the current chunk without touching the run's progress.
+
+Rate limits: model calls run in the LLM governor's 'batch' lane
+(llm_governor.py), so they share the API's rate budget without taking its
+interactive reserve. A RateLimitError (or overload) still pauses every worker
+until the provider's retry-after has passed (exponential backoff with jitter
+when no header is sent). A user whose retries run out, or whose schedule is still
+invalid after the repair pass, gets the rule-based plan when AGENT_FALLBACK
+is on, otherwise counts as failed.
+
+Configure with environment variables:
+- BATCH_CONCURRENCY - users planned at once (default 4)
+- BATCH_CHUNK_SIZE - users per keyset page / upsert (default 100)
+- BATCH_MAX_RETRIES - attempts per user on rate limits (default 5)
+- BATCH_LEASE_TIMEOUT - seconds without a heartbeat before a running run can be resumed (default 300)
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import RealDictCursor, execute_values
+from typing import Optional
+from dotenv import load_dotenv
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+import os
+
+from database import get_db_connection
+from agent_loader import load_agent
+from llm_governor import llm_lane
+from schedule_schema import InvalidPlanError, next_week_start
+from schedule_cache import schedule_cache
+
+load_dotenv()
+
+
+class BatchLeaseLostError(Exception):
+    """Raised when another process has taken over the run (its lease went stale)."""
+
+
+class RateLimitGate:
+    """Shared pause so one rate-limited worker slows every worker down."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+
+def _retry_after(error: Exception, attempt: int) -> float:
+    """Seconds to back off: the provider's retry-after header, else 2^attempt with jitter."""
+    response = getattr(error, "response", None)
+    header = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(header)
+    except (TypeError, ValueError):
+        return min(2 ** attempt, 60) * (0.5 + random.random())
+
+
+class BatchScheduleRun:
+    """One resumable batch run over all active users for a week."""
+
+    def __init__(self, run_id: str, week_start_date: str, mode: str = "llm",
+                 concurrency: int = 4, chunk_size: int = 100, max_retries: int = 5,
+                 fallback: bool = True, lease_timeout: float = 300.0, lease_owner: Optional[str] = None):
+        self.run_id = run_id
+        self.week_start_date = week_start_date
+        self.mode = mode
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.fallback = fallback
+        self.lease_timeout = lease_timeout
+        self.lease_owner = lease_owner or str(uuid.uuid4())
+        self.gate = RateLimitGate()
+        self.errors = []
+        self._lease_lost = threading.Event()
+
+    # ===== Run state =====
+
+    @classmethod
+    def create(cls, week_start_date: str, mode: str = "llm", **options) -> "BatchScheduleRun":
+        batch = cls(str(uuid.uuid4()), week_start_date, mode, **options)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO schedule_batch_runs
+                        (id, week_start_date, mode, status, lease_owner, started_at, updated_at)
+                    VALUES (%s, %s, %s, 'running', %s, NOW(), NOW())
+                """, (batch.run_id, week_start_date, mode, batch.lease_owner))
+            conn.commit()
+        return batch
+
+    @classmethod
+    def resume(cls, run_id: str, **options) -> "BatchScheduleRun":
+        """
+        Take over an interrupted run.
+
+        A 'running' run is only taken over once its heartbeat is older than
+        lease_timeout, so two processes never work on the same run.
+        """
+        run = get_batch_run(run_id)
+        if run is None:
+            raise ValueError(f"Batch run {run_id} not found")
+        if run["status"] == "completed":
+            raise ValueError(f"Batch run {run_id} already completed")
+        batch = cls(run_id, run["week_start_date"].isoformat(), run["mode"], **options)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE schedule_batch_runs
+                    SET status = 'running', error = NULL, lease_owner = %s, updated_at = NOW()
+                    WHERE id = %s
+                      AND status <> 'completed'
+                      AND (status <> 'running' OR updated_at < NOW() - make_interval(secs => %s))
+                """, (batch.lease_owner, run_id, batch.lease_timeout))
+                taken = cursor.rowcount == 1
+            conn.commit()
+        if not taken:
+            raise ValueError(
+                f"Batch run {run_id} is still running in another process "
+                f"(last heartbeat {run['updated_at']}); resume it once that stops"
+            )
+        return batch
+
+    def _heartbeat(self) -> bool:
+        """Refresh the lease; False if another process has taken the run over."""
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE schedule_batch_runs
+                    SET updated_at = NOW()
+                    WHERE id = %s AND lease_owner = %s AND status = 'running'
+                """, (self.run_id, self.lease_owner))
+                held = cursor.rowcount == 1
+            conn.commit()
+        return held
+
+    def _heartbeat_loop(self, stopping: threading.Event):
+        while not stopping.wait(self.lease_timeout / 3):
+            try:
+                if not self._heartbeat():
+                    self._lease_lost.set()
+                    return
+            except Exception as e:
+                # A missed beat or two is fine; the lease only expires after lease_timeout
+                print(f"Batch {self.run_id} heartbeat error: {e}")
+
+    def _checkpoint(self, last_user_id: int, succeeded: int, failed: int):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE schedule_batch_runs
+                    SET last_user_id = %s,
+                        processed = processed + %s,
+                        succeeded = succeeded + %s,
+                        failed = failed + %s,
+                        updated_at = NOW()
+                    WHERE id = %s AND lease_owner = %s
+                """, (last_user_id, succeeded + failed, succeeded, failed, self.run_id, self.lease_owner))
+                held = cursor.rowcount == 1
+            conn.commit()
+        if not held:
+            self._lease_lost.set()
+
+    def _finish(self, status: str, error: Optional[str] = None):
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE schedule_batch_runs
+                    SET status = %s, error = %s, finished_at = NOW(), updated_at = NOW()
+                    WHERE id = %s AND lease_owner = %s
+                """, (status, error, self.run_id, self.lease_owner))
+            conn.commit()
+
+    # ===== Work =====
+
+    def _next_user_ids(self, after_id: int) -> list:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT id FROM users
+                    WHERE deleted_at IS NULL AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                """, (after_id, self.chunk_size))
+                return [row[0] for row in cursor.fetchall()]
+
+    def _plan_one(self, user_id: int):
+        """Returns plan_data, None for a vanished user; raises once retries are exhausted."""
+        agent = load_agent()
+        last_error = None
+        for attempt in range(self.max_retries):
+            self.gate.wait()
+            try:
+                # Behind interactive requests in the LLM governor
+                with llm_lane("batch"):
+                    return agent.plan_schedule(user_id, self.week_start_date, self.mode)
+            except agent.RATE_LIMIT_ERRORS as e:
+                last_error = e
+                self.gate.pause(_retry_after(e, attempt))
+            except agent.LLM_UNAVAILABLE_ERRORS as e:
+                # Timeouts and dropped connections only back off this worker
+                last_error = e
+                time.sleep(_retry_after(e, attempt))
+            except InvalidPlanError as e:
+                # Already had its repair pass; another attempt is a full regeneration
+                last_error = e
+                break
+
+        if self.fallback:
+            return agent.plan_schedule(user_id, self.week_start_date, "fast")
+        raise last_error
+
+    def _upsert(self, plans: list):
+        """Write (user_id, plan_data) pairs with a single multi-row upsert."""
+        if not plans:
+            return
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                execute_values(cursor, """
+                    INSERT INTO schedules (user_id, week_start_date, plan_data, created_at, updated_at)
+                    VALUES %s
+                    ON CONFLICT (user_id, week_start_date)
+                    DO UPDATE SET plan_data = EXCLUDED.plan_data, updated_at = NOW()
+                """, [
+                    (user_id, self.week_start_date, json.dumps(plan_data))
+                    for user_id, plan_data in plans
+                ], template="(%s, %s, %s, NOW(), NOW())", page_size=len(plans))
+            conn.commit()
+        schedule_cache.invalidate(*(user_id for user_id, _ in plans))
+
+    def run(self, after_id: Optional[int] = None) -> dict:
+        """Process every remaining user; returns throughput figures for this session."""
+        if after_id is None:
+            after_id = get_batch_run(self.run_id)["last_user_id"]
+        started = time.monotonic()
+        succeeded = failed = 0
+        stopping = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat_loop, args=(stopping,), name=f"batch-heartbeat-{self.run_id}", daemon=True
+        )
+        heartbeat.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while True:
+                    if self._lease_lost.is_set():
+                        raise BatchLeaseLostError(f"Batch run {self.run_id} was taken over by another process")
+                    user_ids = self._next_user_ids(after_id)
+                    if not user_ids:
+                        break
+
+                    futures = {user_id: executor.submit(self._plan_one, user_id) for user_id in user_ids}
+                    plans, chunk_failed = [], 0
+                    for user_id, future in futures.items():
+                        try:
+                            plan_data = future.result()
+                        except Exception as e:
+                            chunk_failed += 1
+                            self.errors.append({"user_id": user_id, "error": str(e)})
+                            continue
+                        if plan_data is not None:
+                            plans.append((user_id, plan_data))
+
+                    self._upsert(plans)
+                    after_id = user_ids[-1]
+                    self._checkpoint(after_id, len(plans), chunk_failed)
+                    succeeded += len(plans)
+                    failed += chunk_failed
+                    print(f"Batch {self.run_id}: up to user {after_id}, "
+                          f"{succeeded} saved, {failed} failed")
+        except BatchLeaseLostError:
+            raise  # the run belongs to the other process now
+        except Exception as e:
+            self._finish("failed", str(e))
+            raise
+        finally:
+            stopping.set()
+
+        self._finish("completed")
+        elapsed = time.monotonic() - started
+        return {
+            "run_id": self.run_id,
+            "week_start_date": self.week_start_date,
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 1),
+            "schedules_per_min": round(succeeded / elapsed * 60, 1) if elapsed else 0.0,
+            "errors": self.errors[:20],
+        }
+
+
+def get_batch_run(run_id: str) -> Optional[dict]:
+    """Run progress from schedule_batch_runs, with overall throughput."""
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT id, week_start_date, mode, status, last_user_id, processed,
+                       succeeded, failed, error, started_at, updated_at, finished_at,
+                       EXTRACT(EPOCH FROM (COALESCE(finished_at, updated_at) - started_at)) AS elapsed_seconds
+                FROM schedule_batch_runs
+                WHERE id = %s
+            """, (run_id,))
+            run = cursor.fetchone()
+    if not run:
+        return None
+    run = dict(run)
+    elapsed = float(run.pop("elapsed_seconds") or 0)
+    run["schedules_per_min"] = round(run["succeeded"] / elapsed * 60, 1) if elapsed else 0.0
+    return run
+
+
+def start_batch_in_background(batch: BatchScheduleRun) -> threading.Thread:
+    """Run a batch on a daemon thread (used by the API); progress is in schedule_batch_runs."""
+    def target():
+        try:
+            report = batch.run()
+            print(f"Batch run {batch.run_id} finished: {report['schedules_per_min']} schedules/min")
+        except Exception as e:
+            print(f"Batch run {batch.run_id} failed: {e}")
+
+    thread = threading.Thread(target=target, name=f"schedule-batch-{batch.run_id}", daemon=True)
+    thread.start()
+    return thread
+
+
+def batch_options_from_env() -> dict:
+    return {
+        "concurrency": int(os.getenv("BATCH_CONCURRENCY", "4")),
+        "chunk_size": int(os.getenv("BATCH_CHUNK_SIZE", "100")),
+        "max_retries": int(os.getenv("BATCH_MAX_RETRIES", "5")),
+        "fallback": os.getenv("AGENT_FALLBACK", "true").lower() != "false",
+        "lease_timeout": float(os.getenv("BATCH_LEASE_TIMEOUT", "300")),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--week", help="week start date (default: next Monday)")
+    parser.add_argument("--mode", choices=["llm", "fast"], default="llm")
+    parser.add_argument("--resume", metavar="RUN_ID", help="continue an interrupted run")
+    parser.add_argument("--concurrency", type=int)
+    parser.add_argument("--chunk-size", type=int)
+    args = parser.parse_args()
+
+    options = batch_options_from_env()
+    if args.concurrency:
+        options["concurrency"] = args.concurrency
+    if args.chunk_size:
+        options["chunk_size"] = args.chunk_size
+
+    if args.resume:
+        batch = BatchScheduleRun.resume(args.resume, **options)
+    else:
+        batch = BatchScheduleRun.create(args.week or next_week_start(), args.mode, **options)
+    print(f"Batch run {batch.run_id} for week {batch.week_start_date} ({batch.mode})")
+
+    report = batch.run()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+Offline load test for the Python API with a fake model and a throwaway database
+Run with: python backend/agent/bench_api.py --users 1000 --concurrency 1,10,50 --requests 200
+
+Starts api.app in-process (httpx ASGI transport, lifespan included) against
+a fresh database, with ChatAnthropic swapped for FakeChatModel
+(fake_chat_model.py) so no API key or network is needed. The fake answers
+after --model-latency seconds (± --model-jitter), which stands in for the
+model's response time.
+
+The database is created for the run and dropped afterwards (--keep to
+leave it):
+- by default a database named o_positive_bench_<timestamp> on the server in
+  backend/.env (DB_HOST, DB_USER, ...); the configured DB_NAME is never touched
+- with --initdb, a temporary Postgres cluster (initdb/pg_ctl from PATH or
+  /usr/lib/postgresql/*/bin) on a free local port
+
+It is migrated by running the SQL in backend/migrations/*.js (templated
+statements, such as migration 010's per-table partitions, are expanded by
+MIGRATION_EXPANSIONS), seeded with
+backend/seeds/workouts.js, --users deterministic users and one rule-based
+schedule each. The users table also gets the profile columns routes/user.py
+writes (goal, experience_level, ...), which no migration creates yet.
+
+Each endpoint is run at every --concurrency level; the JSON report has
+throughput and latency percentiles per endpoint and level.
+"""
+
+from contextlib import ExitStack, contextmanager
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import glob
+import httpx
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+load_dotenv()
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+ENDPOINTS = ("ai_schedule", "get_schedule", "save_schedule", "create_user", "get_user")
+
+# Columns routes/user.py reads and writes; not in the migrations (yet)
+PROFILE_COLUMNS_SQL = """
+    ALTER TABLE users
+        ADD COLUMN IF NOT EXISTS goal VARCHAR(50),
+        ADD COLUMN IF NOT EXISTS experience_level VARCHAR(50),
+        ADD COLUMN IF NOT EXISTS days_per_week INTEGER,
+        ADD COLUMN IF NOT EXISTS workout_location VARCHAR(20),
+        ADD COLUMN IF NOT EXISTS diet_preference VARCHAR(50),
+        ALTER COLUMN email DROP NOT NULL,
+        ALTER COLUMN password_hash DROP NOT NULL;
+"""
+
+GOALS = {
+    "lose_fat": "Lose fat and get leaner",
+    "gain_muscle": "Build muscle and strength",
+    "maintain": "Stay fit and healthy",
+}
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _expand_partition_migration(source: str, templates: list) -> list:
+    """
+    Migration 010 builds its SQL per log table and per month with template
+    literals; expand them as up() would on an empty database (partitions from
+    this month through MONTHS_AHEAD, taken with LOG_TABLES from the file).
+    """
+    tables = {
+        name: (re.findall(r"'(\w+)'", columns), definition)
+        for name, columns, definition in re.findall(
+            r"(\w+): \{\s*columns: \[(.*?)\],\s*definition: `(.*?)`", source, re.DOTALL
+        )
+    }
+    months_ahead = int(re.search(r"const MONTHS_AHEAD = (\d+)", source).group(1))
+    today = datetime.now(timezone.utc).date()
+    months = [_add_months(date(today.year, today.month, 1), count) for count in range(months_ahead + 1)]
+
+    per_table = [sql for sql in templates if "${table}" in sql and "first_month" not in sql]
+    statements = []
+    for table, (columns, definition) in tables.items():
+        for sql in per_table:
+            sql = (sql.replace("${table}", table).replace("${definition}", definition)
+                   .replace("${columns.join(', ')}", ", ".join(columns)))
+            if "${monthName(start)}" not in sql:
+                statements.append(sql)
+                continue
+            for month in months:
+                statements.append(
+                    sql.replace("${monthName(start)}", f"{month.year}_{month.month:02d}")
+                    .replace("${isoDate(start)}", month.isoformat())
+                    .replace("${isoDate(addMonths(start, 1))}", _add_months(month, 1).isoformat())
+                )
+    statements.extend(sql for sql in templates if "${" not in sql)
+    return statements
+
+
+# Migrations whose up() builds SQL at run time: file name -> expansion of its query templates
+MIGRATION_EXPANSIONS = {
+    "010_partition_activity_logs.js": _expand_partition_migration,
+}
+
+
+def migration_statements() -> list:
+    """The SQL each migration's up() runs, in file order."""
+    statements = []
+    for path in sorted(MIGRATIONS_DIR.glob("[0-9]*.js")):
+        source = path.read_text()
+        up = source.split("async function down")[0]
+        templates = [sql.strip() for sql in re.findall(r"client\.query\(`(.*?)`", up, re.DOTALL)]
+        if path.name in MIGRATION_EXPANSIONS:
+            templates = MIGRATION_EXPANSIONS[path.name](source, templates)
+        unexpanded = [sql for sql in templates if "${" in sql]
+        if unexpanded:
+            sys.exit(f"{path.name} builds its SQL at run time; add it to MIGRATION_EXPANSIONS")
+        statements.extend(templates)
+    return statements
+
+
+# ===== Disposable database =====
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _postgres_binary(name: str) -> str:
+    found = shutil.which(name)
+    if found:
+        return found
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+    if not candidates:
+        sys.exit(f"{name} not found; install Postgres or run without --initdb")
+    return candidates[-1]
+
+
+@contextmanager
+def temporary_cluster():
+    """initdb a cluster in a temp dir, start it, yield DB_* settings; removed afterwards."""
+    data_dir = tempfile.mkdtemp(prefix="o_positive_bench_")
+    port = _free_port()
+    subprocess.run([_postgres_binary("initdb"), "-D", data_dir, "-U", "postgres", "--auth=trust"],
+                   check=True, stdout=subprocess.DEVNULL)
+    pg_ctl = _postgres_binary("pg_ctl")
+    subprocess.run([pg_ctl, "-D", data_dir, "-w", "-l", os.path.join(data_dir, "server.log"),
+                    "-o", f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1 -c max_connections=300",
+                    "start"], check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield {"DB_HOST": "127.0.0.1", "DB_PORT": str(port), "DB_USER": "postgres",
+               "DB_PASSWORD": "", "DB_NAME": "postgres"}
+    finally:
+        subprocess.run([pg_ctl, "-D", data_dir, "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def _admin_connection(settings: dict):
+    import psycopg2
+    conn = psycopg2.connect(
+        host=settings["DB_HOST"], port=int(settings["DB_PORT"]), user=settings["DB_USER"],
+        password=settings["DB_PASSWORD"], database=settings["DB_NAME"],
+    )
+    conn.autocommit = True
+    return conn
+
+
+@contextmanager
+def bench_database(settings: dict, keep: bool = False):
+    """CREATE a uniquely named database next to settings' one; DROP it afterwards unless keep."""
+    name = f"o_positive_bench_{datetime.now():%Y%m%d%H%M%S}"
+    admin = _admin_connection(settings)
+    with admin.cursor() as cursor:
+        cursor.execute(f'CREATE DATABASE "{name}"')
+    try:
+        yield {**settings, "DB_NAME": name}
+    finally:
+        if keep:
+            print(f"Kept database {name}")
+        else:
+            with admin.cursor() as cursor:
+                cursor.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+        admin.close()
+
+
+def prepare_database(settings: dict, users: int, seed: int) -> dict:
+    """Migrate and seed; returns the seeded user ids and the week their schedules are for."""
+    from psycopg2.extras import execute_values
+    from bench_catalog_tokens import load_seed_workouts
+    from rule_scheduler import generate_rule_based_plan
+
+    rng = random.Random(seed)
+    conn = _admin_connection(settings)
+    try:
+        with conn.cursor() as cursor:
+            for statement in migration_statements():
+                cursor.execute(statement)
+            cursor.execute(PROFILE_COLUMNS_SQL)
+
+            workouts = load_seed_workouts()
+            execute_values(cursor, """
+                INSERT INTO workouts (name, type, equipment, muscles, instructions) VALUES %s
+            """, [(w["name"], w["type"], w["equipment"], w["muscles"], w["instructions"]) for w in workouts])
+            cursor.execute("SELECT id, name, type, equipment, muscles FROM workouts ORDER BY id")
+            workouts = [dict(zip(("id", "name", "type", "equipment", "muscles"), row)) for row in cursor.fetchall()]
+
+            profiles = []
+            for index in range(users):
+                goal = rng.choice(list(GOALS))
+                profiles.append({
+                    "name": f"Bench User {index + 1}",
+                    "email": f"bench{index + 1}@example.com",
+                    "age": rng.randint(18, 65),
+                    "height": rng.randint(150, 200),
+                    "weight": rng.randint(50, 110),
+                    "goal": goal,
+                    "goals": GOALS[goal],
+                    "experience_level": rng.choice(("beginner", "intermediate", "advanced")),
+                    "days_per_week": rng.randint(2, 6),
+                    "workout_location": rng.choice(("home", "gym", "both")),
+                })
+            user_ids = [row[0] for row in execute_values(cursor, """
+                INSERT INTO users (name, email, password_hash, age, height, weight, goals, experience,
+                                   preferences, goal, experience_level, days_per_week, workout_location)
+                VALUES %s
+                RETURNING id
+            """, [
+                (p["name"], p["email"], "x", p["age"], p["height"], p["weight"], p["goals"],
+                 p["experience_level"],
+                 json.dumps({"days_per_week": p["days_per_week"], "workout_location": p["workout_location"]}),
+                 p["goal"], p["experience_level"], p["days_per_week"], p["workout_location"])
+                for p in profiles
+            ], page_size=1000, fetch=True)]
+
+            today = date.today()
+            week = today - timedelta(days=today.weekday())
+            execute_values(cursor, """
+                INSERT INTO schedules (user_id, week_start_date, plan_data) VALUES %s
+            """, [
+                (user_id, week, json.dumps(generate_rule_based_plan(profile, workouts)))
+                for user_id, profile in zip(user_ids, profiles)
+            ], page_size=1000)
+    finally:
+        conn.close()
+    return {"user_ids": user_ids, "week": week.isoformat(), "workout_ids": [w["id"] for w in workouts]}
+
+
+# ===== Load =====
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_load(client: httpx.AsyncClient, make_request, clients: int, total: int) -> dict:
+    """Send `total` requests from `clients` concurrent workers; make_request(i) -> (method, url, json)."""
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for index in remaining:
+            method, url, body = make_request(index)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, json=body)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+    }
+
+
+def request_factories(seeded: dict, seed: int) -> dict:
+    """One make_request(i) per endpoint, spreading requests over the seeded users."""
+    user_ids = seeded["user_ids"]
+    workout_ids = seeded["workout_ids"]
+    next_week = (date.fromisoformat(seeded["week"]) + timedelta(days=7)).isoformat()
+
+    def user(index: int) -> int:
+        return user_ids[index % len(user_ids)]
+
+    def plan(index: int) -> dict:
+        ids = random.Random(seed + index).sample(workout_ids, 3)
+        return {
+            "workouts": [{"day": "Monday", "workout_ids": ids, "duration_minutes": 45,
+                          "intensity": "moderate", "notes": ""}],
+            "rest_days": ["Sunday"],
+            "weekly_summary": {"total_workouts": 1, "total_duration_minutes": 45,
+                               "primary_focus": "general_fitness"},
+        }
+
+    return {
+        "ai_schedule": lambda i: ("POST", "/ai/schedule", {"user_id": user(i), "week_start_date": next_week}),
+        "get_schedule": lambda i: ("GET", f"/schedule/{user(i)}", None),
+        "save_schedule": lambda i: ("POST", "/schedule", {
+            "user_id": user(i), "week_start_date": seeded["week"], "plan_data": plan(i),
+        }),
+        "create_user": lambda i: ("POST", "/api/users", {
+            "name": f"Load User {i}", "age": 30, "height": 175, "weight": 70, "goal": "maintain",
+            "experienceLevel": "beginner", "daysPerWeek": 3, "workout_location": "both",
+        }),
+        "get_user": lambda i: ("GET", f"/api/users/{user(i)}", None),
+    }
+
+
+async def bench(endpoints: list, levels: list, total: int, seeded: dict, seed: int) -> dict:
+    from api import app
+
+    factories = request_factories(seeded, seed)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    limits = httpx.Limits(max_connections=max(levels))
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits,
+                                     timeout=300) as client:
+            for endpoint in endpoints:
+                await run_load(client, factories[endpoint], min(levels), min(total, 10))  # warm up pools
+                results[endpoint] = {}
+                for clients in levels:
+                    print(f"{endpoint}: {total} requests at {clients} concurrent clients...")
+                    results[endpoint][str(clients)] = await run_load(client, factories[endpoint], clients, total)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="users to seed")
+    parser.add_argument("--concurrency", default="1,10,50", help="comma-separated concurrent client counts")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and level")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"subset of {','.join(ENDPOINTS)}")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="fake model seconds per call")
+    parser.add_argument("--model-jitter", type=float, default=0.2, help="± fraction of the latency")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--plan-cache", action="store_true", help="leave the LLM plan cache on")
+    parser.add_argument("--initdb", action="store_true", help="run against a temporary Postgres cluster")
+    parser.add_argument("--keep", action="store_true", help="don't drop the benchmark database")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    endpoints = [name for name in args.endpoints.split(",") if name]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    # Settings read at import time by database.py, jobs.py, plan_cache.py and catalog.py
+    os.environ.setdefault("ANTHROPIC_API_KEY", "offline-benchmark")
+    os.environ["SCHEDULE_JOB_WORKERS"] = "0"
+    os.environ["CATALOG_LISTEN"] = "false"
+    os.environ["PLAN_CACHE"] = "true" if args.plan_cache else "false"
+    os.environ.setdefault("DB_POOL_MAX", str(max(10, min(max(levels), 50))))
+
+    with ExitStack() as stack:
+        if args.initdb:
+            settings = stack.enter_context(temporary_cluster())
+        else:
+            settings = {key: os.getenv(key, "") for key in ("DB_HOST", "DB_PORT", "DB_USER", "DB_PASSWORD", "DB_NAME")}
+            settings["DB_PORT"] = settings["DB_PORT"] or "5432"
+
+        with bench_database(settings, keep=args.keep) as db_settings:
+            os.environ.update(db_settings)
+            print(f"Seeding {args.users} users into {db_settings['DB_NAME']}...")
+            seeded = prepare_database(db_settings, args.users, args.seed)
+
+            from fake_chat_model import install_fake_model
+            install_fake_model(latency=args.model_latency, jitter=args.model_jitter, seed=args.seed)
+
+            results = asyncio.run(bench(endpoints, levels, args.requests, seeded, args.seed))
+
+    report = {
+        "config": {
+            "users": args.users,
+            "requests": args.requests,
+            "concurrency": levels,
+            "model_latency_s": args.model_latency,
+            "model_jitter": args.model_jitter,
+            "plan_cache": args.plan_cache,
+            "database": "initdb" if args.initdb else "server",
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
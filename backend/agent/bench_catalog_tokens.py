@@ -0,0 +1,96 @@
+"""
+Prompt-size benchmark for the workout catalog encoding
+Run with: python backend/agent/bench_catalog_tokens.py [--copies 10]
+
+Compares the catalog as it used to reach the model (json of every row with
+full instructions) against compact_catalog() of the shortlist picked by
+select_relevant_workouts() for home, gym and 'both' users. The catalog is
+read from backend/seeds/workouts.js; --copies repeats it to simulate a
+larger catalog.
+
+Token counts use Anthropic's count_tokens endpoint when ANTHROPIC_API_KEY
+is set, otherwise an offline estimate of ~4 characters per token.
+"""
+
+from pathlib import Path
+from dotenv import load_dotenv
+import argparse
+import json
+import os
+import re
+
+from catalog import compact_catalog, select_relevant_workouts
+
+load_dotenv()
+
+SEED_FILE = Path(__file__).resolve().parent.parent / "seeds" / "workouts.js"
+MODEL = "claude-sonnet-4-20250514"
+
+
+def load_seed_workouts(copies: int = 1) -> list:
+    """Parse the workout objects out of seeds/workouts.js, ids in insertion order."""
+    source = SEED_FILE.read_text()
+    fields = ("name", "type", "equipment", "muscles", "instructions")
+    pattern = re.compile(
+        r"\{\s*" + r",\s*".join(rf"{field}:\s*'((?:[^'\\]|\\.)*)'" for field in fields) + r"\s*\}"
+    )
+    seeds = [dict(zip(fields, match.groups())) for match in pattern.finditer(source)]
+
+    workouts = []
+    for copy in range(copies):
+        for seed in seeds:
+            name = seed["name"] if copy == 0 else f"{seed['name']} v{copy + 1}"
+            workouts.append({"id": len(workouts) + 1, **seed, "name": name})
+    return workouts
+
+
+def make_token_counter():
+    if not os.getenv("ANTHROPIC_API_KEY"):
+        return "estimate (chars/4)", lambda text: len(text) // 4
+
+    import anthropic
+    client = anthropic.Anthropic()
+
+    def count(text: str) -> int:
+        result = client.messages.count_tokens(
+            model=MODEL, messages=[{"role": "user", "content": text}]
+        )
+        return result.input_tokens
+
+    return f"count_tokens ({MODEL})", count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--copies", type=int, default=1, help="repeat the seeded catalog N times")
+    parser.add_argument("--limit", type=int, default=None, help="shortlist size (default CATALOG_PROMPT_LIMIT)")
+    args = parser.parse_args()
+
+    workouts = load_seed_workouts(args.copies)
+    method, count_tokens = make_token_counter()
+
+    full = json.dumps(workouts)
+    baseline = count_tokens(full)
+    report = {
+        "catalog_size": len(workouts),
+        "token_counter": method,
+        "full_json_tokens": baseline,
+        "compact_all_tokens": count_tokens(compact_catalog(workouts)),
+        "shortlists": {},
+    }
+
+    for location in ("home", "gym", "both"):
+        profile = {"goals": "build muscle, core strength", "preferences": {"workout_location": location}}
+        shortlist = select_relevant_workouts(workouts, profile, args.limit)
+        tokens = count_tokens(compact_catalog(shortlist))
+        report["shortlists"][location] = {
+            "workouts": len(shortlist),
+            "tokens": tokens,
+            "reduction": f"{(1 - tokens / baseline) * 100:.1f}%",
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
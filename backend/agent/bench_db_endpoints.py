@@ -0,0 +1,154 @@
+"""
+Latency benchmark for the database-only endpoints: blocking psycopg2 vs asyncpg
+Run with: python backend/agent/bench_db_endpoints.py --clients 200 --requests 2000
+
+"before" is an app serving the handlers the way they were written before the
+async data-access path: a fresh psycopg2 connection per request, executed
+directly inside `async def` (GET /api/users/{id}) or on the threadpool
+(GET /schedule/{id}). "after" is the real api.app backed by the asyncpg pool.
+
+Both apps are driven in-process through httpx's ASGI transport, so the only
+difference between the runs is the data-access path. Needs the database from
+backend/.env with at least one user (and ideally a schedule) for --user-id.
+"""
+
+from fastapi import FastAPI, HTTPException
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import psycopg2
+import statistics
+import time
+
+load_dotenv()
+
+
+def _legacy_connection():
+    return psycopg2.connect(
+        host=os.getenv("DB_HOST"),
+        port=int(os.getenv("DB_PORT", "5432")),
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        database=os.getenv("DB_NAME")
+    )
+
+
+def build_before_app() -> FastAPI:
+    legacy = FastAPI()
+
+    @legacy.get("/api/users/{user_id}")
+    async def get_user(user_id: int):
+        # Blocking driver call on the event loop, as routes/user.py used to do
+        conn = _legacy_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+                result = cursor.fetchone()
+            if not result:
+                raise HTTPException(status_code=404, detail="User not found")
+            return {"user": dict(result)}
+        finally:
+            conn.close()
+
+    @legacy.get("/schedule/{user_id}")
+    def get_user_schedule(user_id: int, limit: int = 1):
+        conn = _legacy_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, week_start_date, plan_data, created_at, updated_at
+                    FROM schedules
+                    WHERE user_id = %s
+                    ORDER BY week_start_date DESC
+                    LIMIT %s
+                """, (user_id, limit))
+                results = cursor.fetchall()
+            if not results:
+                raise HTTPException(status_code=404, detail="No schedules found for this user")
+            return {"success": True, "schedules": [dict(row) for row in results]}
+        finally:
+            conn.close()
+
+    return legacy
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_load(client: httpx.AsyncClient, path: str, clients: int, total: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                if response.status_code >= 500:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+    }
+
+
+async def bench_app(app, paths: list, clients: int, total: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    limits = httpx.Limits(max_connections=clients)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=120) as client:
+        for path in paths:
+            await run_load(client, path, min(clients, 10), min(total, 50))  # warm up pools
+            results[path] = await run_load(client, path, clients, total)
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per endpoint")
+    parser.add_argument("--user-id", type=int, default=1)
+    args = parser.parse_args()
+
+    from api import app as async_app
+    from database import close_pools
+
+    paths = [f"/api/users/{args.user_id}", f"/schedule/{args.user_id}"]
+    report = {"clients": args.clients}
+
+    print(f"Benchmarking {args.requests} requests per endpoint at {args.clients} concurrent clients...")
+    report["before"] = await bench_app(build_before_app(), paths, args.clients, args.requests)
+    report["after"] = await bench_app(async_app, paths, args.clients, args.requests)
+    await close_pools()
+
+    print(json.dumps(report, indent=2))
+    for path in paths:
+        before, after = report["before"][path], report["after"][path]
+        print(f"{path}: p99 {before['p99_ms']} ms -> {after['p99_ms']} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Import-time and cold-start benchmark for the API process
+Run with: python backend/agent/bench_import.py [--runs 5] [--max-import-ms 1500]
+
+Each measurement is a fresh interpreter, so nothing is cached between runs:
+- import api under `python -X importtime`; reports the median total and the
+  heaviest modules, and fails if LangChain or the Anthropic SDK were
+  imported (they belong behind agent_loader.py)
+- cold start: process start until GET / has been answered
+- agent first use: importing workout_agent and building the model, i.e.
+  what the first /ai/schedule request (or AGENT_WARMUP) pays
+
+Exits with status 1 when a check fails, so it can guard CI against
+import-time regressions.
+"""
+
+from pathlib import Path
+import statistics
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+AGENT_DIR = Path(__file__).resolve().parent
+AGENT_PACKAGES = ("langchain", "langchain_core", "langchain_anthropic", "langgraph", "anthropic")
+
+COLD_START = """
+from fastapi.testclient import TestClient
+import api
+assert TestClient(api.app).get("/").status_code == 200
+"""
+AGENT_FIRST_USE = """
+import agent_loader
+agent_loader.warm_up()
+"""
+
+
+def _run(args: list) -> subprocess.CompletedProcess:
+    env = {**os.environ, "ANTHROPIC_API_KEY": os.getenv("ANTHROPIC_API_KEY") or "bench-placeholder"}
+    return subprocess.run([sys.executable, *args], cwd=AGENT_DIR, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def import_profile(module: str) -> dict:
+    """One `-X importtime` run: total ms and cumulative ms per module."""
+    stderr = _run(["-X", "importtime", "-c", f"import {module}"]).stderr
+    modules, total_us = {}, 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules[name.strip()] = int(cumulative) / 1000
+        if not name.startswith("  "):  # top level: not nested under another import
+            total_us += int(cumulative)
+    return {"total_ms": total_us / 1000, "modules": modules}
+
+
+def wall_ms(code: str) -> float:
+    """Wall time of a fresh interpreter running `code`."""
+    timer = "import time as _t; _started = _t.perf_counter()\n"
+    report = "\nprint((_t.perf_counter() - _started) * 1000)"
+    return float(_run(["-c", timer + code + report]).stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--module", default="api", help="module to import (default api)")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="fail if the median import takes longer")
+    parser.add_argument("--top", type=int, default=10, help="heaviest modules to list")
+    parser.add_argument("--skip-agent", action="store_true", help="don't time the agent's first use")
+    args = parser.parse_args()
+
+    print(f"Importing {args.module} in {args.runs} fresh interpreters...")
+    profiles = [import_profile(args.module) for _ in range(args.runs)]
+    last = profiles[-1]["modules"]
+    heaviest = sorted(
+        ((name.strip(), ms) for name, ms in last.items() if name.strip() != args.module),
+        key=lambda item: -item[1],
+    )[:args.top]
+    agent_modules = sorted({
+        name.strip() for name in last if name.strip().split(".")[0] in AGENT_PACKAGES
+    })
+
+    report = {
+        "module": args.module,
+        "import_ms_median": round(statistics.median(p["total_ms"] for p in profiles), 1),
+        "import_ms_min": round(min(p["total_ms"] for p in profiles), 1),
+        "heaviest_modules_ms": {name: round(ms, 1) for name, ms in heaviest},
+        "agent_modules_imported": len(agent_modules),
+        "cold_start_ms_median": round(statistics.median(wall_ms(COLD_START) for _ in range(args.runs)), 1),
+    }
+    if not args.skip_agent:
+        report["agent_first_use_ms_median"] = round(
+            statistics.median(wall_ms(AGENT_FIRST_USE) for _ in range(args.runs)), 1
+        )
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if agent_modules:
+        failures.append(f"import {args.module} pulled in the agent stack: {', '.join(agent_modules[:5])}")
+    if args.max_import_ms is not None and report["import_ms_median"] > args.max_import_ms:
+        failures.append(f"median import {report['import_ms_median']} ms > {args.max_import_ms} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Offline prompt-cache check for the planner prompt
+Run with: python backend/agent/bench_prompt_cache.py [--users 8] [--copies 2]
+
+Plans a week for several made-up users (home, gym and 'both', different
+goals, experience and history) through the prefetched-context flow, with
+ChatAnthropic swapped for FakeChatModel (fake_chat_model.py) and the plan
+cache off, so every user makes a model call. No database, API key or
+network is needed; the catalog is read from backend/seeds/workouts.js.
+
+When the prefix (tool schema, SYSTEM_PROMPT, catalog snapshot) is within
+AGENT_PROMPT_CACHE_MIN_TOKENS..AGENT_PROMPT_CACHE_MAX_TOKENS, checks that:
+- every call has a cache breakpoint, and the prefix up to it is
+  byte-identical for every user
+- the first call writes the cache and every later call reads it
+- a catalog change gives a new prefix (the snapshot is versioned by digest)
+Otherwise it checks that no breakpoint is sent and the prompt is the same
+shortlist prompt as with AGENT_PROMPT_CACHE=false. The seeded catalog is
+under the minimum; --copies 2 to 6 lands in range.
+
+Then prints input tokens per request with and without AGENT_PROMPT_CACHE,
+weighting cache reads at 0.1x and cache writes at 1.25x as Anthropic bills
+them. Exits with status 1 if a check fails.
+"""
+
+import argparse
+import json
+import sys
+import os
+
+# Offline: no shared rate budget in Postgres, and every user goes to the model
+os.environ["LLM_REQUESTS_PER_MINUTE"] = "0"
+os.environ["PLAN_CACHE"] = "false"
+
+from bench_catalog_tokens import load_seed_workouts
+from fake_chat_model import install_fake_model
+from telemetry import RequestTrace
+import workout_agent
+
+WEEK = "2026-01-05"
+GOALS = ["build muscle", "lose weight", "improve endurance", "core strength", "general fitness"]
+EXPERIENCE = ["beginner", "intermediate", "advanced"]
+LOCATIONS = ["home", "gym", "both"]
+
+
+def make_context(user_id: int, workouts: list) -> dict:
+    """A made-up user; every field the prompt uses varies with user_id."""
+    location = LOCATIONS[user_id % len(LOCATIONS)]
+    profile = {
+        "id": user_id,
+        "name": f"User {user_id}",
+        "age": 20 + user_id,
+        "height": 160 + user_id,
+        "weight": 60 + user_id,
+        "goals": GOALS[user_id % len(GOALS)],
+        "experience": EXPERIENCE[user_id % len(EXPERIENCE)],
+        "preferences": {"workout_location": location, "days_per_week": 3 + user_id % 3},
+    }
+    history = [{
+        "week_start_date": "2025-12-29",
+        "plan_data": {"workouts": [{"day": "Monday", "workout_ids": [user_id % len(workouts) + 1]}]},
+        "created_at": "2025-12-28T10:00:00",
+    }] if user_id % 2 else []
+    return {"profile": profile, "workouts": workouts, "previous_schedules": history}
+
+
+def run_users(users: int, workouts: list, first_user: int = 1) -> list:
+    """agent_usage of one planning call per user."""
+    usages = []
+    for user_id in range(first_user, first_user + users):
+        context = make_context(user_id, workouts)
+        trace = RequestTrace("bench_prompt_cache", user_id=user_id)
+        _, agent_usage = workout_agent._drain(workout_agent._plan_for_context(user_id, WEEK, context, trace))
+        trace.finish("llm", "success")
+        usages.append(agent_usage)
+    return usages
+
+
+def billed_input(usages: list) -> float:
+    """Input tokens per request, with cache reads at 0.1x and cache writes at 1.25x."""
+    total = 0.0
+    for usage in usages:
+        read, written = usage["cache_read_tokens"], usage["cache_creation_tokens"]
+        total += usage["input_tokens"] - read - written + read * 0.1 + written * 1.25
+    return round(total / len(usages), 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=8, help="made-up users to plan for")
+    parser.add_argument("--copies", type=int, default=1, help="repeat the seeded catalog N times")
+    args = parser.parse_args()
+
+    workouts = load_seed_workouts(args.copies)
+    failures = []
+
+    workout_agent.PROMPT_CACHE = True
+    fake = install_fake_model()
+    cached = run_users(args.users, workouts)
+    prefixes = fake.cached_prefixes()
+    digest = workout_agent.catalog_digest(workouts)
+    cached_catalog = workout_agent.planner_system_message(workouts, digest) is not None
+
+    if cached_catalog:
+        if any(prefix is None for prefix in prefixes):
+            failures.append("a planning call had no cache breakpoint")
+        elif len(set(prefixes)) != 1:
+            first = prefixes[0]
+            differing = [index + 1 for index, prefix in enumerate(prefixes) if prefix != first]
+            failures.append(f"cached prefix differs between users (users {differing} vs user 1)")
+        if not cached[0]["cache_creation_tokens"]:
+            failures.append("the first call did not write the cache")
+        if any(not usage["cache_read_tokens"] for usage in cached[1:]):
+            failures.append("a later call did not read the cache")
+
+        # One more workout changes the digest, so the snapshot (and the cache entry) must change too
+        changed = workouts + [{**workouts[0], "id": len(workouts) + 1, "name": f"{workouts[0]['name']} (new)"}]
+        after_change = run_users(1, changed, first_user=args.users + 1)
+        if fake.cached_prefixes()[-1] in prefixes or not after_change[0]["cache_creation_tokens"]:
+            failures.append("a catalog change did not produce a new cached prefix")
+    elif any(prefix is not None for prefix in prefixes):
+        failures.append("a cache breakpoint was sent for a prefix outside the cacheable size")
+
+    workout_agent.PROMPT_CACHE = False
+    install_fake_model()
+    uncached = run_users(args.users, workouts)
+    if not cached_catalog and [u["input_tokens"] for u in cached] != [u["input_tokens"] for u in uncached]:
+        failures.append("an uncacheable catalog did not fall back to the shortlist prompt")
+
+    report = {
+        "catalog_size": len(workouts),
+        "users": args.users,
+        "cached_catalog": cached_catalog,
+        "prefix_chars": len(prefixes[0] or ""),
+        "prompt_cache": {
+            "input_tokens_per_request": round(sum(u["input_tokens"] for u in cached) / len(cached), 1),
+            "cache_read_tokens": sum(u["cache_read_tokens"] for u in cached),
+            "cache_creation_tokens": sum(u["cache_creation_tokens"] for u in cached),
+            "billed_input_per_request": billed_input(cached),
+        },
+        "no_prompt_cache": {
+            "input_tokens_per_request": round(sum(u["input_tokens"] for u in uncached) / len(uncached), 1),
+            "billed_input_per_request": billed_input(uncached),
+        },
+        "failures": failures,
+    }
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""
+Workout Catalog Cache
+Process-wide, in-memory copy of the workouts table for the agent
+
+The catalog is near-static, so it is loaded once and served from memory,
+indexed by type ('home'/'gym'), muscle group and equipment. It is reloaded
+when older than CATALOG_TTL seconds, or straight away when Postgres sends a
+NOTIFY on the 'workouts_changed' channel (trigger added in migration 003).
+
+For prompts, compact_catalog() encodes workouts as short coded rows and
+select_relevant_workouts() keeps only the top-N candidates for a user, so
+prompt size no longer grows with the whole catalog.
+
+Configure with environment variables:
+- CATALOG_TTL - seconds before the catalog is reloaded (default 3600)
+- CATALOG_LISTEN - set to 'false' to disable the LISTEN/NOTIFY invalidation thread
+- CATALOG_PROMPT_LIMIT - workouts sent to the model per request (default 15)
+"""
+
+from psycopg2.extras import RealDictCursor
+from typing import Optional
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extensions
+import hashlib
+import select
+import threading
+import time
+import re
+import os
+
+from database import get_db_connection, connection_settings
+
+load_dotenv()
+
+NOTIFY_CHANNEL = "workouts_changed"
+
+# Fixed dictionaries for the compact prompt encoding. Terms not listed here
+# are passed through as lower-case text, so new catalog entries still work.
+MUSCLE_CODES = {
+    "chest": "CH",
+    "shoulders": "SH",
+    "triceps": "TR",
+    "biceps": "BI",
+    "back": "BK",
+    "core": "CO",
+    "obliques": "OB",
+    "quadriceps": "QD",
+    "hamstrings": "HM",
+    "glutes": "GL",
+    "legs": "LG",
+    "full body": "FB",
+    "cardiovascular": "CV",
+}
+
+EQUIPMENT_CODES = {
+    "none": "-",
+    "dumbbells": "DB",
+    "barbell": "BB",
+    "weights": "WT",
+    "bench": "BN",
+    "chair": "CHR",
+    "machine": "MC",
+    "cable machine": "CBL",
+    "leg press machine": "LPM",
+    "leg curl machine": "LCM",
+    "lat pulldown machine": "LAT",
+    "pec deck machine": "PEC",
+    "stair climber machine": "STC",
+    "treadmill": "TM",
+    "pull-up bar": "PUB",
+    "squat rack": "SQR",
+}
+
+TYPE_CODES = {"home": "h", "gym": "g"}
+
+
+def split_terms(value: Optional[str]) -> list:
+    """'Dumbbells, Bench' / 'Chair or Bench' -> ['dumbbells', 'bench'] / ['chair', 'bench']"""
+    if not value:
+        return []
+    return [term.strip().lower() for term in re.split(r",|\bor\b", value) if term.strip()]
+
+
+def catalog_digest(workouts: list) -> str:
+    """Short hash of the fields the planner sees, in id order."""
+    rows = sorted(
+        (w["id"], w["name"], w["type"], w["equipment"] or "", w["muscles"] or "") for w in workouts
+    )
+    return hashlib.sha1(repr(rows).encode()).hexdigest()[:16]
+
+
+class WorkoutCatalog:
+    """Cached workouts with lookup indexes and hit/miss counters."""
+
+    def __init__(self, ttl: float = 3600.0):
+        self.ttl = ttl
+        self.version = 0
+        self.digest = None
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._workouts = []
+        self._by_id = {}
+        self._by_type = {}
+        self._by_muscle = {}
+        self._by_equipment = {}
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0, "invalidations": 0}
+
+    def _load(self):
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, name, type, equipment, muscles, instructions
+                    FROM workouts
+                    ORDER BY name
+                """)
+                workouts = [dict(row) for row in cursor.fetchall()]
+
+        by_type, by_muscle, by_equipment = {}, {}, {}
+        for workout in workouts:
+            by_type.setdefault(workout["type"], []).append(workout)
+            for muscle in split_terms(workout["muscles"]):
+                by_muscle.setdefault(muscle, []).append(workout)
+            for equipment in split_terms(workout["equipment"]):
+                by_equipment.setdefault(equipment, []).append(workout)
+
+        self._workouts = workouts
+        self._by_id = {workout["id"]: workout for workout in workouts}
+        self._by_type = by_type
+        self._by_muscle = by_muscle
+        self._by_equipment = by_equipment
+        self._loaded_at = time.monotonic()
+        self.version += 1
+        self.digest = catalog_digest(workouts)
+        self._stats["reloads"] += 1
+
+    def _ensure_fresh(self):
+        with self._lock:
+            stale = self._loaded_at is None or time.monotonic() - self._loaded_at >= self.ttl
+            if stale:
+                self._stats["misses"] += 1
+                self._load()
+            else:
+                self._stats["hits"] += 1
+
+    def current_digest(self) -> str:
+        """Content hash of the catalog, identical in every process (unlike version)."""
+        self._ensure_fresh()
+        return self.digest
+
+    def invalidate(self):
+        """Drop the cached catalog; the next read reloads it from Postgres."""
+        with self._lock:
+            self._loaded_at = None
+            self._stats["invalidations"] += 1
+
+    def all(self) -> list:
+        """Every workout, ordered by name (same rows as SELECT ... FROM workouts)."""
+        self._ensure_fresh()
+        return list(self._workouts)
+
+    def get(self, workout_id: int) -> Optional[dict]:
+        self._ensure_fresh()
+        return self._by_id.get(workout_id)
+
+    def filter(self, workout_type: str = "", muscle: str = "", equipment: str = "") -> list:
+        """
+        Workouts matching every given filter, ordered by name.
+
+        muscle and equipment match one term of the comma-separated column,
+        case-insensitively (e.g. muscle='glutes', equipment='none').
+        """
+        self._ensure_fresh()
+        candidates = self._workouts
+        if workout_type:
+            candidates = self._by_type.get(workout_type, [])
+        if muscle:
+            ids = {w["id"] for w in self._by_muscle.get(muscle.strip().lower(), [])}
+            candidates = [w for w in candidates if w["id"] in ids]
+        if equipment:
+            ids = {w["id"] for w in self._by_equipment.get(equipment.strip().lower(), [])}
+            candidates = [w for w in candidates if w["id"] in ids]
+        return list(candidates)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "version": self.version,
+                "digest": self.digest,
+                "workouts": len(self._workouts),
+                "age_seconds": (
+                    round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None
+                ),
+                **self._stats,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+class CatalogListener:
+    """
+    Background thread that LISTENs for workouts changes and invalidates the cache.
+
+    Uses its own connection (outside the pool), since a LISTEN session has to
+    stay open. Reconnects after connection errors.
+    """
+
+    def __init__(self, catalog: WorkoutCatalog, reconnect_delay: float = 5.0):
+        self.catalog = catalog
+        self.reconnect_delay = reconnect_delay
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="catalog-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**connection_settings())
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Changes made while we were not listening are unknown
+                self.catalog.invalidate()
+
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        self.catalog.invalidate()
+            except Exception as e:
+                print(f"Workout catalog listener error: {e}")
+                self._stopping.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+# ===== Compact prompt encoding =====
+
+def _encode_terms(value: Optional[str], codes: dict) -> str:
+    return ",".join(codes.get(term, term) for term in split_terms(value))
+
+
+def compact_catalog(workouts: list) -> str:
+    """
+    Encode workouts as one 'id|name|type|muscles|equipment' row each.
+
+    Drops instructions and replaces muscle/equipment names with the codes
+    in MUSCLE_CODES / EQUIPMENT_CODES; only codes that are used go in the legend.
+    """
+    rows = []
+    used_muscles, used_equipment = set(), set()
+    for workout in workouts:
+        used_muscles.update(split_terms(workout["muscles"]))
+        used_equipment.update(split_terms(workout["equipment"]))
+        rows.append("|".join([
+            str(workout["id"]),
+            workout["name"],
+            TYPE_CODES.get(workout["type"], workout["type"]),
+            _encode_terms(workout["muscles"], MUSCLE_CODES),
+            _encode_terms(workout["equipment"], EQUIPMENT_CODES),
+        ]))
+
+    muscle_legend = " ".join(
+        f"{MUSCLE_CODES[t]}={t}" for t in sorted(used_muscles) if t in MUSCLE_CODES
+    )
+    equipment_legend = " ".join(
+        f"{EQUIPMENT_CODES[t]}={t}" for t in sorted(used_equipment) if t in EQUIPMENT_CODES
+    )
+    header = [
+        "id|name|type(h=home,g=gym)|muscles|equipment",
+        f"muscles: {muscle_legend}",
+        f"equipment: {equipment_legend}",
+    ]
+    return "\n".join(header + rows)
+
+
+def _preference_terms(profile: dict) -> set:
+    """Lower-case words from the user's goals and preferences values."""
+    texts = [profile.get("goals") or ""]
+    preferences = profile.get("preferences") or {}
+    if isinstance(preferences, dict):
+        for value in preferences.values():
+            if isinstance(value, str):
+                texts.append(value)
+            elif isinstance(value, list):
+                texts.extend(str(item) for item in value)
+    terms = set()
+    for text in texts:
+        words = re.findall(r"[a-z\-]+", text.lower())
+        terms.update(words)
+        terms.update(f"{a} {b}" for a, b in zip(words, words[1:]))  # e.g. "full body"
+    return terms
+
+
+def workout_location(profile: dict) -> str:
+    """'home', 'gym' or 'both', from the profile column or preferences JSON."""
+    preferences = profile.get("preferences") or {}
+    location = profile.get("workout_location")
+    if not location and isinstance(preferences, dict):
+        location = preferences.get("workout_location") or preferences.get("location")
+    return location if location in ("home", "gym", "both") else "both"
+
+
+def select_relevant_workouts(workouts: list, profile: dict, limit: Optional[int] = None) -> list:
+    """
+    Pick the top-N workouts for a user.
+
+    Home users only get home workouts. Workouts score one point per muscle or
+    equipment term mentioned in the user's goals/preferences, and selection is
+    greedy with a penalty for muscle groups already covered, so the shortlist
+    stays varied. Result is ordered by id for a stable prompt.
+    """
+    if limit is None:
+        limit = int(os.getenv("CATALOG_PROMPT_LIMIT", "15"))
+
+    location = workout_location(profile)
+    if location == "home":
+        workouts = [w for w in workouts if w["type"] == "home"]
+    if len(workouts) <= limit:
+        return sorted(workouts, key=lambda w: w["id"])
+
+    wanted = _preference_terms(profile)
+    remaining = []
+    for workout in workouts:
+        muscles = split_terms(workout["muscles"])
+        terms = set(muscles) | set(split_terms(workout["equipment"]))
+        score = len(terms & wanted)
+        if location == "gym" and workout["type"] == "gym":
+            score += 1
+        remaining.append((workout, muscles, score))
+
+    selected, covered = [], {}
+    while remaining and len(selected) < limit:
+        best = max(
+            remaining,
+            key=lambda item: (
+                item[2] - sum(covered.get(m, 0) for m in item[1]) / max(len(item[1]), 1),
+                -item[0]["id"],
+            ),
+        )
+        remaining.remove(best)
+        selected.append(best[0])
+        for muscle in best[1]:
+            covered[muscle] = covered.get(muscle, 0) + 1
+
+    return sorted(selected, key=lambda w: w["id"])
+
+
+workout_catalog = WorkoutCatalog(ttl=float(os.getenv("CATALOG_TTL", "3600")))
+catalog_listener = CatalogListener(workout_catalog)
+
+
+def start_catalog_listener():
+    """Start LISTEN/NOTIFY invalidation unless CATALOG_LISTEN=false."""
+    if os.getenv("CATALOG_LISTEN", "true").lower() != "false":
+        catalog_listener.start()
@@ -0,0 +1,347 @@
+"""
+Shared PostgreSQL Connection Pool
+One pool per process, used by api.py, workout_agent.py and routes/user.py
+
+Two pools share the same settings:
+- get_db_connection() - blocking psycopg2 pool, for the agent tools and sync code
+- get_async_connection() - asyncpg pool, for async FastAPI endpoints
+
+Configure with environment variables:
+- DB_POOL_MIN - connections kept open even when idle (default 1)
+- DB_POOL_MAX - hard cap on open connections (default 10)
+- DB_POOL_TIMEOUT - seconds to wait for a free connection (default 30)
+- DB_POOL_MAX_IDLE - seconds before an idle connection is recycled (default 300)
+- DB_POOL_CHECK_AFTER - idle seconds after which checkout runs SELECT 1 (default 30)
+"""
+
+from contextlib import contextmanager, asynccontextmanager
+from collections import deque
+from dotenv import load_dotenv
+import asyncio
+import asyncpg
+import psycopg2
+import psycopg2.extensions
+import threading
+import json
+import time
+import os
+
+from telemetry import DB_CHECKOUT_SECONDS
+
+load_dotenv()
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes free within the pool timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool.
+
+    Unlike psycopg2.pool.ThreadedConnectionPool, callers block (up to
+    `timeout` seconds) when every connection is checked out instead of
+    failing straight away, and the time spent waiting is recorded.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, timeout: float = 30.0,
+                 max_idle: float = 300.0, check_after: float = 30.0, **conn_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._conn_kwargs = conn_kwargs
+        self._idle = deque()  # (connection, returned_at), most recent on the right
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_ms_total": 0.0,
+            "wait_time_ms_max": 0.0,
+            "timeouts": 0,
+            "connections_opened": 0,
+            "connections_recycled": 0,
+            "health_check_failures": 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._open += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._conn_kwargs)
+        self._stats["connections_opened"] += 1
+        return conn
+
+    def _is_healthy(self, conn, idle_for: float) -> bool:
+        if conn.closed:
+            return False
+        if idle_for < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _recycle_idle(self):
+        """Close connections idle longer than max_idle, keeping at least minconn open."""
+        now = time.monotonic()
+        while self._idle and self._open > self.minconn:
+            conn, returned_at = self._idle[0]
+            if now - returned_at < self.max_idle:
+                break
+            self._idle.popleft()
+            self._open -= 1
+            self._stats["connections_recycled"] += 1
+            conn.close()
+
+    def getconn(self):
+        """Check out a healthy connection, waiting for one if the pool is full."""
+        started = time.monotonic()
+        waited = False
+        with self._cond:
+            self._recycle_idle()
+            while not self._idle and self._open >= self.maxconn:
+                waited = True
+                remaining = self.timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(
+                        f"No database connection available after {self.timeout}s "
+                        f"(pool max {self.maxconn})"
+                    )
+                self._cond.wait(remaining)
+
+            if self._idle:
+                conn, returned_at = self._idle.pop()
+            else:
+                conn, returned_at = None, None
+                self._open += 1  # reserve the slot before connecting outside the lock
+
+            wait_ms = (time.monotonic() - started) * 1000
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_time_ms_total"] += wait_ms
+            self._stats["wait_time_ms_max"] = max(self._stats["wait_time_ms_max"], wait_ms)
+
+        if conn is not None and self._is_healthy(conn, time.monotonic() - returned_at):
+            return conn
+
+        if conn is not None:
+            self._stats["health_check_failures"] += 1
+            conn.close()
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, close: bool = False):
+        """Return a connection to the pool, rolling back any open transaction."""
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self._cond:
+            if close or conn.closed:
+                self._open -= 1
+                if not conn.closed:
+                    conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._open -= 1
+                conn.close()
+
+    def stats(self) -> dict:
+        """Pool size and wait metrics, for sizing DB_POOL_MIN / DB_POOL_MAX."""
+        with self._cond:
+            checkouts = self._stats["checkouts"]
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                **self._stats,
+                "wait_time_ms_avg": (
+                    self._stats["wait_time_ms_total"] / checkouts if checkouts else 0.0
+                ),
+            }
+
+
+def connection_settings() -> dict:
+    return {
+        "host": os.getenv("DB_HOST"),
+        "port": int(os.getenv("DB_PORT", "5432")),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "database": os.getenv("DB_NAME"),
+    }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    minconn=int(os.getenv("DB_POOL_MIN", "1")),
+                    maxconn=int(os.getenv("DB_POOL_MAX", "10")),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                    max_idle=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+                    check_after=float(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+                    **connection_settings(),
+                )
+    return _pool
+
+
+@contextmanager
+def get_db_connection():
+    """
+    Borrow a connection from the shared pool.
+
+    Usage:
+        with get_db_connection() as conn:
+            ...
+            conn.commit()
+
+    Uncommitted work is rolled back when the connection goes back to the pool.
+    """
+    pool = get_pool()
+    started = time.perf_counter()
+    conn = pool.getconn()
+    DB_CHECKOUT_SECONDS.observe(time.perf_counter() - started, pool="sync")
+    try:
+        yield conn
+    except BaseException:
+        broken = conn.closed != 0
+        pool.putconn(conn, close=broken)
+        raise
+    else:
+        pool.putconn(conn)
+
+
+# ===== Async pool (asyncpg) =====
+
+_async_pool = None
+_async_pool_lock = asyncio.Lock()
+_async_stats = {
+    "checkouts": 0,
+    "wait_time_ms_total": 0.0,
+    "wait_time_ms_max": 0.0,
+    "timeouts": 0,
+}
+
+
+async def _init_async_connection(conn):
+    # Decode JSON/JSONB to Python objects, matching psycopg2's default behaviour
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name, encoder=json.dumps, decoder=json.loads, schema="pg_catalog"
+        )
+
+
+async def get_async_pool() -> asyncpg.Pool:
+    """Return the process-wide asyncpg pool, creating it on first use."""
+    global _async_pool
+    if _async_pool is None:
+        async with _async_pool_lock:
+            if _async_pool is None:
+                _async_pool = await asyncpg.create_pool(
+                    min_size=int(os.getenv("DB_POOL_MIN", "1")),
+                    max_size=int(os.getenv("DB_POOL_MAX", "10")),
+                    max_inactive_connection_lifetime=float(os.getenv("DB_POOL_MAX_IDLE", "300")),
+                    init=_init_async_connection,
+                    **connection_settings(),
+                )
+    return _async_pool
+
+
+@asynccontextmanager
+async def get_async_connection():
+    """
+    Borrow an asyncpg connection from the shared async pool.
+
+    Usage:
+        async with get_async_connection() as conn:
+            row = await conn.fetchrow("SELECT ... WHERE id = $1", user_id)
+
+    asyncpg resets the connection (and rolls back open transactions) on release.
+    """
+    pool = await get_async_pool()
+    timeout = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    started = time.monotonic()
+    try:
+        conn = await pool.acquire(timeout=timeout)
+    except asyncio.TimeoutError:
+        _async_stats["timeouts"] += 1
+        raise PoolTimeoutError(
+            f"No database connection available after {timeout}s (pool max {pool.get_max_size()})"
+        )
+    wait_ms = (time.monotonic() - started) * 1000
+    DB_CHECKOUT_SECONDS.observe(wait_ms / 1000, pool="async")
+    _async_stats["checkouts"] += 1
+    _async_stats["wait_time_ms_total"] += wait_ms
+    _async_stats["wait_time_ms_max"] = max(_async_stats["wait_time_ms_max"], wait_ms)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+
+async def close_pools():
+    """Close both pools; called on application shutdown."""
+    global _pool, _async_pool
+    if _async_pool is not None:
+        await _async_pool.close()
+        _async_pool = None
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+def pool_stats() -> dict:
+    """Current metrics for both pools (empty summaries if nothing has connected yet)."""
+    if _pool is None:
+        sync_stats = {"open": 0, "idle": 0, "in_use": 0, "checkouts": 0}
+    else:
+        sync_stats = _pool.stats()
+
+    if _async_pool is None:
+        async_stats = {"open": 0, "idle": 0, "in_use": 0, "checkouts": 0}
+    else:
+        checkouts = _async_stats["checkouts"]
+        async_stats = {
+            "min": _async_pool.get_min_size(),
+            "max": _async_pool.get_max_size(),
+            "open": _async_pool.get_size(),
+            "idle": _async_pool.get_idle_size(),
+            "in_use": _async_pool.get_size() - _async_pool.get_idle_size(),
+            **_async_stats,
+            "wait_time_ms_avg": (
+                _async_stats["wait_time_ms_total"] / checkouts if checkouts else 0.0
+            ),
+        }
+
+    return {"sync": sync_stats, "async": async_stats}
@@ -0,0 +1,210 @@
+"""
+Fake Chat Model
+Deterministic stand-in for ChatAnthropic, for offline benchmarks and checks
+
+Answers every call with a WeeklyPlan tool call built from the prompt's
+"Suggested workout ids" line, or else the workout ids in its compact
+Workouts list (the "id|name|..." rows), after a configurable delay.
+Streaming splits the tool arguments into chunks, so the SSE path behaves
+like the real model. usage_metadata is estimated at ~4 characters per token.
+
+Prompt caching is simulated: the tool schema plus every content block up to
+the last cache_control breakpoint is the cached prefix, reported as a
+cache_creation the first time it is seen and a cache_read afterwards. Like
+the provider, prefixes under cache_min_tokens (~4 chars per token of tool
+schema and block text) are not cached at all.
+cached_prefixes() returns the prefix of each call, for checks that it stays
+byte-identical across users.
+
+Use install_fake_model() to swap it into workout_agent in-process.
+"""
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from typing import Any, Iterator, Optional
+import hashlib
+import random
+import json
+import time
+import re
+import threading
+
+PLAN_DAYS = ["Monday", "Wednesday", "Friday"]
+WORKOUT_ROW = re.compile(r"^(\d+)\|", re.MULTILINE)
+SUGGESTED_IDS = re.compile(r"^Suggested workout ids: ([\d, ]+)$", re.MULTILINE)
+
+
+def message_text(message: BaseMessage) -> str:
+    """Text of a message whether its content is a string or a list of content blocks."""
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in message.content
+    )
+
+
+class FakeChatModel(BaseChatModel):
+    """Replies with a deterministic WeeklyPlan tool call after `latency` seconds (± jitter)."""
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    seed: int = 0
+    chunks: int = 8
+    cache_min_tokens: int = 1024
+
+    _rng: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr()
+    _tool_name: str = PrivateAttr(default="WeeklyPlan")
+    _tool_schema: dict = PrivateAttr(default_factory=dict)
+    _seen_prefixes: set = PrivateAttr(default_factory=set)
+    _prefixes: list = PrivateAttr(default_factory=list)
+
+    def model_post_init(self, __context: Any):
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-workout-planner"
+
+    def bind_tools(self, tools: list, tool_choice: Any = None, **kwargs) -> "FakeChatModel":
+        """Every call already answers with a plan tool call, so binding only records the name."""
+        for tool in tools:
+            name = getattr(tool, "__name__", None) or getattr(tool, "name", None)
+            if name == "WeeklyPlan":
+                self._tool_name = name
+                self._tool_schema = tool.model_json_schema()
+        return self
+
+    def _cached_prefix(self, messages: list[BaseMessage]) -> tuple[Optional[str], int]:
+        """
+        (tool schema plus the content blocks up to the last cache_control
+        breakpoint, its estimated tokens), or (None, 0) without a breakpoint.
+        """
+        blocks, texts, cached = [], [], None
+        for message in messages:
+            content = message.content if isinstance(message.content, list) else [message.content]
+            for block in content:
+                blocks.append(json.dumps(block, sort_keys=True))
+                texts.append(block if isinstance(block, str) else block.get("text", ""))
+                if isinstance(block, dict) and block.get("cache_control"):
+                    cached = len(blocks)
+        if cached is None:
+            return None, 0
+        tool_schema = json.dumps(self._tool_schema, sort_keys=True)
+        tokens = (len(tool_schema) + sum(len(text) for text in texts[:cached])) // 4
+        return tool_schema + "\n" + "\n".join(blocks[:cached]), tokens
+
+    def cached_prefixes(self) -> list:
+        """The cached prefix of every call so far (None for calls without a breakpoint)."""
+        with self._lock:
+            return list(self._prefixes)
+
+    def _delay(self) -> float:
+        with self._lock:
+            spread = self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+        return max(self.latency * (1 + spread), 0.0)
+
+    def _plan_args(self, messages: list[BaseMessage]) -> dict:
+        prompt = "\n".join(message_text(message) for message in messages)
+        suggested = SUGGESTED_IDS.findall(prompt)
+        if suggested:
+            workout_ids = [int(i) for i in suggested[-1].replace(" ", "").split(",") if i]
+        else:
+            workout_ids = [int(match) for match in WORKOUT_ROW.findall(prompt)]
+        workout_ids = workout_ids or [1, 2, 3]
+        workouts = []
+        for index, day in enumerate(PLAN_DAYS):
+            ids = [workout_ids[(index * 3 + offset) % len(workout_ids)] for offset in range(3)]
+            workouts.append({
+                "day": day,
+                "workout_ids": list(dict.fromkeys(ids)),
+                "duration_minutes": 45,
+                "intensity": "moderate",
+                "notes": "Benchmark plan",
+            })
+        return {
+            "workouts": workouts,
+            "rest_days": ["Tuesday", "Thursday", "Saturday", "Sunday"],
+            "weekly_summary": {
+                "total_workouts": len(workouts),
+                "total_duration_minutes": 45 * len(workouts),
+                "primary_focus": "general_fitness",
+            },
+        }
+
+    def _usage(self, messages: list[BaseMessage], output: str) -> dict:
+        input_tokens = sum(len(message_text(message)) for message in messages) // 4
+        output_tokens = len(output) // 4
+        usage = {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+        prefix, prefix_tokens = self._cached_prefix(messages)
+        with self._lock:
+            self._prefixes.append(prefix)
+            if prefix is None or prefix_tokens < self.cache_min_tokens:
+                return usage
+            key = hashlib.sha1(prefix.encode()).hexdigest()
+            hit = key in self._seen_prefixes
+            self._seen_prefixes.add(key)
+        # Like Anthropic's usage, input_tokens counts the cached prefix too
+        prefix_tokens = min(prefix_tokens, input_tokens)
+        usage["input_token_details"] = {"cache_read": prefix_tokens} if hit else {"cache_creation": prefix_tokens}
+        return usage
+
+    def _generate(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs) -> ChatResult:
+        time.sleep(self._delay())
+        args = self._plan_args(messages)
+        message = AIMessage(
+            content="",
+            tool_calls=[{"name": self._tool_name, "args": args, "id": "fake_plan", "type": "tool_call"}],
+            usage_metadata=self._usage(messages, json.dumps(args)),
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: list[BaseMessage], stop: Optional[list[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        delay = self._delay()
+        text = json.dumps(self._plan_args(messages))
+        size = max(len(text) // self.chunks, 1)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+
+        # A fifth of the delay before the first token, the rest spread over the chunks
+        time.sleep(delay * 0.2)
+        for index, piece in enumerate(pieces):
+            if index:
+                time.sleep(delay * 0.8 / len(pieces))
+            chunk = AIMessageChunk(
+                content="",
+                tool_call_chunks=[{
+                    "name": self._tool_name if index == 0 else None,
+                    "args": piece,
+                    "id": "fake_plan" if index == 0 else None,
+                    "index": 0,
+                }],
+                usage_metadata=self._usage(messages, text) if index == len(pieces) - 1 else None,
+            )
+            yield ChatGenerationChunk(message=chunk)
+
+
+def install_fake_model(latency: float = 0.0, jitter: float = 0.0, seed: int = 0) -> FakeChatModel:
+    """Point workout_agent's model calls at a FakeChatModel (in this process only)."""
+    import workout_agent
+    from schedule_schema import WeeklyPlan
+
+    # Same provider minimum as the agent, so cache savings are not overstated
+    fake = FakeChatModel(latency=latency, jitter=jitter, seed=seed,
+                         cache_min_tokens=workout_agent.PROMPT_CACHE_MIN_TOKENS)
+    workout_agent.model = fake
+    workout_agent.plan_model = fake.bind_tools([WeeklyPlan])
+    workout_agent.structured_model = fake.with_structured_output(WeeklyPlan, include_raw=True)
+    workout_agent.Workout_Planner_agent = None  # rebuilt on the fake if the tool flow runs
+    workout_agent.days_model = None
+    return fake
@@ -0,0 +1,393 @@
+"""
+Food Search
+Local typeahead for GET /calories/search, without a network call per keystroke
+
+The JS backend's /calories/search asks api.calorieninjas.com for every query
+and falls back to a substring scan over 15 hardcoded foods. Here a nutrition
+dataset is loaded once into an in-memory index:
+- a prefix trie over full names and every word in them, each node holding
+  its best few matches, so typeahead is one walk down the trie
+- a word index, for queries whose words are in a different order
+- a trigram index over the words, for typos ("brocoli"), used only when
+  the above find nothing
+
+Results have the same shape as the JS backend's normalizedResults. When
+nothing matches locally and CALORIE_API_KEY is set, CalorieNinjas is asked
+once; its answers are kept in an LRU and added to the index.
+
+The dataset is a CSV with CalorieNinjas' field names (name, serving_size_g,
+calories, protein_g, carbohydrates_total_g, fat_total_g, fiber_g, sugar_g),
+e.g. an export of USDA FoodData Central. backend/seeds/foods.csv is used by
+default.
+
+Try it with: python backend/agent/food_search.py "chicken br"
+
+Configure with environment variables:
+- FOOD_DATASET - path of the nutrition CSV (default backend/seeds/foods.csv)
+- FOOD_EXTERNAL - set to 'false' to never call CalorieNinjas
+- FOOD_EXTERNAL_CACHE_SIZE - external answers kept (default 512)
+- FOOD_EXTERNAL_CACHE_TTL - seconds an external answer is kept (default 86400)
+- CALORIE_API_KEY - CalorieNinjas API key (shared with the JS backend)
+"""
+
+from collections import OrderedDict
+from array import array
+from bisect import insort
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+import unicodedata
+import heapq
+import urllib.parse
+import urllib.request
+import threading
+import argparse
+import json
+import time
+import csv
+import re
+import os
+
+load_dotenv()
+
+DEFAULT_DATASET = Path(__file__).resolve().parent.parent / "seeds" / "foods.csv"
+EXTERNAL_URL = "https://api.calorieninjas.com/v1/nutrition?query="
+MACROS = {
+    "protein": "protein_g",
+    "carbs": "carbohydrates_total_g",
+    "fat": "fat_total_g",
+    "fiber": "fiber_g",
+    "sugar": "sugar_g",
+}
+FUZZY_THRESHOLD = 0.45  # minimum trigram similarity (Dice) of a misspelled word
+
+
+def normalize(text: str) -> str:
+    """Lower-case ASCII words separated by single spaces ('Crème  Brûlée!' -> 'creme brulee')."""
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode()
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _number(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def to_result(food_id: int, item: dict) -> dict:
+    """A CalorieNinjas-style item in the JS backend's normalizedResults shape."""
+    return {
+        "id": f"food-{food_id}",
+        "name": item["name"],
+        "servingSize": f"{_number(item.get('serving_size_g')):g}g",
+        "calories": round(_number(item.get("calories"))),
+        "macros": {macro: round(_number(item.get(field)), 1) for macro, field in MACROS.items()},
+    }
+
+
+class FoodIndex:
+    """Prefix trie, word index and word trigram index over food names."""
+
+    def __init__(self, top_k: int = 20, trie_depth: int = 10):
+        self.top_k = top_k
+        self.trie_depth = trie_depth
+        self.foods = []  # id -> result dict
+        self._names = []  # id -> normalized name
+        self._ranks = []  # id -> sort key
+        self._ids_by_name = {}
+        # Node: [children by character, ids]. Above trie_depth a node keeps its
+        # top_k best ids; at trie_depth it keeps all of them, and longer
+        # prefixes are filtered from there (no long single-food tails).
+        self._trie = [{}, []]
+        self._trie_nodes = 1
+        self._words = {}  # word -> array of food ids
+        self._vocabulary = []  # word id -> word (words without digits)
+        self._word_trigrams = {}  # trigram -> array of word ids
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.foods)
+
+    def _insert(self, key: str, food_id: int):
+        rank = self._ranks[food_id]
+        node = self._trie
+        for depth, char in enumerate(key[:self.trie_depth], start=1):
+            child = node[0].get(char)
+            if child is None:
+                child = node[0][char] = [{}, array("I")] if depth == self.trie_depth else [{}, []]
+                self._trie_nodes += 1
+            node = child
+            ids = node[1]
+            if depth == self.trie_depth:
+                ids.append(food_id)
+            elif len(ids) < self.top_k or rank < self._ranks[ids[-1]]:
+                # Shorter names first: "rice" before "rice pudding with raisins"
+                if food_id not in ids:
+                    insort(ids, food_id, key=self._ranks.__getitem__)
+                    del ids[self.top_k:]
+
+    def _add_word(self, word: str, food_id: int):
+        posting = self._words.get(word)
+        if posting is None:
+            posting = self._words[word] = array("I")
+            if not any(char.isdigit() for char in word):
+                word_id = len(self._vocabulary)
+                self._vocabulary.append(word)
+                for gram in trigrams(word):
+                    self._word_trigrams.setdefault(gram, array("I")).append(word_id)
+        posting.append(food_id)
+
+    def add(self, items: list) -> int:
+        """Index CalorieNinjas-style items; names already indexed are skipped. Returns how many were added."""
+        named = sorted(
+            ((normalize(item.get("name") or ""), item) for item in items),
+            key=lambda pair: (len(pair[0]), pair[0]),
+        )
+        added = 0
+        with self._lock:
+            for name, item in named:
+                if not name or name in self._ids_by_name:
+                    continue
+                food_id = len(self.foods)
+                self.foods.append(to_result(food_id, item))
+                self._names.append(name)
+                self._ranks.append((len(name), name))
+                self._ids_by_name[name] = food_id
+
+                words = name.split()
+                self._insert(name, food_id)
+                for word in set(words[1:]):
+                    self._insert(word, food_id)
+                for word in set(words):
+                    self._add_word(word, food_id)
+                added += 1
+        return added
+
+    def _starts_with(self, food_id: int, prefix: str) -> bool:
+        name = self._names[food_id]
+        return name.startswith(prefix) or any(word.startswith(prefix) for word in name.split())
+
+    def _prefix(self, query: str) -> list:
+        node = self._trie
+        for char in query[:self.trie_depth]:
+            node = node[0].get(char)
+            if node is None:
+                return []
+        if len(query) < self.trie_depth:
+            return list(node[1])
+        matches = [food_id for food_id in node[1] if self._starts_with(food_id, query)]
+        return sorted(matches, key=self._ranks.__getitem__)[:self.top_k]
+
+    def _words_then_prefix(self, words: list) -> list:
+        """Foods containing every complete word, and a word starting with the last one."""
+        postings = [self._words.get(word) for word in words[:-1]]
+        if not all(postings):
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+        return [food_id for food_id in candidates if self._starts_with(food_id, words[-1])]
+
+    def _similar_words(self, word: str, limit: int = 5) -> list:
+        """(similarity, word) for the vocabulary words closest to a (misspelled) word."""
+        grams = trigrams(word)
+        counts = {}
+        for gram in grams:
+            for word_id in self._word_trigrams.get(gram, ()):
+                counts[word_id] = counts.get(word_id, 0) + 1
+        scored = []
+        for word_id, common in counts.items():
+            candidate = self._vocabulary[word_id]
+            # Dice coefficient over trigram sets
+            score = 2 * common / (len(grams) + len(candidate) + 1)
+            if score >= FUZZY_THRESHOLD:
+                scored.append((score, candidate))
+        return sorted(scored, reverse=True)[:limit]
+
+    def _fuzzy(self, query: str, limit: int) -> list:
+        """Foods whose words are close to the query's words, best total similarity first."""
+        scores = {}
+        for word in query.split():
+            best = {}
+            similar_words = [(1.0, word)] if word in self._words else self._similar_words(word)
+            for similarity, similar in similar_words:
+                for food_id in self._words[similar]:
+                    best[food_id] = max(best.get(food_id, 0), similarity)
+            for food_id, similarity in best.items():
+                scores[food_id] = scores.get(food_id, 0) + similarity
+        return heapq.nsmallest(limit, scores, key=lambda food_id: (-scores[food_id], self._ranks[food_id]))
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """Best matches: exact name, then name prefix, then word prefix; fuzzy if none of those."""
+        query = normalize(query)
+        if not query:
+            return []
+        with self._lock:
+            matches = self._prefix(query)
+            words = query.split()
+            if len(matches) < limit and len(words) > 1:
+                matches.extend(self._words_then_prefix(words))
+            matches = list(dict.fromkeys(matches))
+            matches.sort(key=lambda food_id: (
+                self._names[food_id] != query,
+                not self._names[food_id].startswith(query),
+                self._ranks[food_id],
+            ))
+            if not matches:
+                matches = self._fuzzy(query, limit)
+            return [self.foods[food_id] for food_id in matches[:limit]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "foods": len(self.foods),
+                "trie_nodes": self._trie_nodes,
+                "words": len(self._words),
+                "trigrams": len(self._word_trigrams),
+            }
+
+
+class FoodSearch:
+    """The food index (loaded on first use) plus an LRU of CalorieNinjas answers."""
+
+    def __init__(self, dataset: Path, api_key: Optional[str] = None, external: bool = True,
+                 cache_size: int = 512, cache_ttl: float = 86400.0, timeout: float = 3.0):
+        self.dataset = Path(dataset)
+        self.api_key = api_key
+        self.external = external and bool(api_key)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.index = None
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # normalized query -> (expires_at, items)
+        self._stats = {
+            "searches": 0, "local_hits": 0, "external_calls": 0, "external_errors": 0,
+            "cache_hits": 0, "search_us_total": 0.0, "search_us_max": 0.0, "load_ms": 0.0,
+        }
+
+    def _count(self, key: str, amount: float = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _ensure_index(self) -> FoodIndex:
+        if self.index is None:
+            with self._load_lock:
+                if self.index is None:
+                    started = time.perf_counter()
+                    index = FoodIndex()
+                    with open(self.dataset, newline="", encoding="utf-8") as handle:
+                        index.add(list(csv.DictReader(handle)))
+                    self._stats["load_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    self.index = index
+        return self.index
+
+    def _external(self, query: str) -> list:
+        """CalorieNinjas items for a query, through the LRU."""
+        key = normalize(query)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and time.monotonic() < entry[0]:
+                self._cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return entry[1]
+
+        self._count("external_calls")
+        request = urllib.request.Request(
+            EXTERNAL_URL + urllib.parse.quote(query), headers={"X-Api-Key": self.api_key}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                items = json.load(response).get("items", [])
+        except Exception as e:
+            print(f"Food search external lookup error: {e}")
+            self._count("external_errors")
+            return []
+
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, items)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return items
+
+    def search(self, query: str, limit: int = 10) -> tuple[list, str]:
+        """(results, source); source is 'local', 'external' or 'none'."""
+        index = self._ensure_index()
+        started = time.perf_counter()
+        results = index.search(query, limit)
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        with self._lock:
+            self._stats["searches"] += 1
+            self._stats["search_us_total"] += elapsed_us
+            self._stats["search_us_max"] = max(self._stats["search_us_max"], elapsed_us)
+        if results:
+            self._count("local_hits")
+            return results, "local"
+
+        if self.external:
+            items = self._external(query)
+            if items:
+                # Learned foods are found locally from now on
+                index.add(items)
+                return index.search(query, limit) or [
+                    to_result(-1, item) for item in items[:limit]
+                ], "external"
+        return [], "none"
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            cached = len(self._cache)
+        searches = stats.pop("searches")
+        total_us = stats.pop("search_us_total")
+        return {
+            "dataset": str(self.dataset),
+            "loaded": self.index is not None,
+            **(self.index.stats() if self.index is not None else {}),
+            "external": self.external,
+            "external_cached": cached,
+            "searches": searches,
+            **stats,
+            "search_us_avg": round(total_us / searches, 1) if searches else 0.0,
+            "search_us_max": round(stats["search_us_max"], 1),
+        }
+
+
+def create_food_search() -> FoodSearch:
+    """Build the service configured from FOOD_* environment variables."""
+    return FoodSearch(
+        dataset=Path(os.getenv("FOOD_DATASET") or DEFAULT_DATASET),
+        api_key=os.getenv("CALORIE_API_KEY"),
+        external=os.getenv("FOOD_EXTERNAL", "true").lower() != "false",
+        cache_size=int(os.getenv("FOOD_EXTERNAL_CACHE_SIZE", "512")),
+        cache_ttl=float(os.getenv("FOOD_EXTERNAL_CACHE_TTL", "86400")),
+    )
+
+
+food_search = create_food_search()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the local food index")
+    parser.add_argument("query")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    service = FoodSearch(dataset=Path(os.getenv("FOOD_DATASET") or DEFAULT_DATASET), external=False)
+    results, _ = service.search(args.query, args.limit)
+    stats = service.stats()
+    print(json.dumps(results, indent=2))
+    print(f"{stats['foods']} foods loaded in {stats['load_ms']} ms; search took {stats['search_us_max']} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Friends Graph
+In-memory friendships and weekly activity totals for the friends endpoints
+
+The friend count, mutual friends and leaderboard reads used to self-join
+friends per request, and a leaderboard would also have to sum steps_logs and
+calories_logs for every friend. Instead this process keeps:
+- the accepted friendships as one sorted array of friend ids per user. A
+  friendship counts for both users, whichever of them sent the request.
+  Rows changed by anyone (the JS backend included) arrive by NOTIFY on
+  'friends_changed' (trigger added in migration 008) and update just
+  that pair
+- each user's daily steps/calories for the last FRIENDS_LEADERBOARD_DAYS
+  days, refreshed from daily_activity every FRIENDS_ACTIVITY_REFRESH seconds
+  and bumped in between by logs ingested through POST /logs/batch
+
+so a leaderboard or mutual-friends lookup costs O(friends), with no query.
+
+Configure with environment variables:
+- FRIENDS_GRAPH_LISTEN - set to 'false' to disable the LISTEN/refresh thread
+- FRIENDS_ACTIVITY_REFRESH - seconds between daily_activity refreshes (default 60)
+- FRIENDS_LEADERBOARD_DAYS - days in the rolling leaderboard window (default 7)
+"""
+
+from array import array
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+from typing import Optional
+from dotenv import load_dotenv
+import psycopg2
+import psycopg2.extensions
+import threading
+import select
+import json
+import time
+import os
+
+from database import get_db_connection, connection_settings
+
+load_dotenv()
+
+NOTIFY_CHANNEL = "friends_changed"
+METRICS = ("steps", "calories", "active_days")
+
+
+def _contains(ids: array, user_id: int) -> bool:
+    position = bisect_left(ids, user_id)
+    return position < len(ids) and ids[position] == user_id
+
+
+class FriendsGraph:
+    """Adjacency index of accepted friendships plus rolling per-user activity totals."""
+
+    def __init__(self, window_days: int = 7, refresh_interval: float = 60.0,
+                 reconnect_delay: float = 5.0):
+        self.window_days = window_days
+        self.refresh_interval = refresh_interval
+        self.reconnect_delay = reconnect_delay
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._rows = set()  # accepted (user_id, friend_id) rows
+        self._friends = {}  # user_id -> sorted array of friend ids
+        self._days = {}  # user_id -> {activity_date: [steps, calories, logs]}
+        self._loaded_at = None
+        self._activity_at = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats = {
+            "loads": 0, "changes": 0, "activity_refreshes": 0, "activity_updates": 0,
+            "leaderboards": 0, "mutual_lookups": 0, "errors": 0,
+        }
+
+    # ===== Loading =====
+
+    def load(self):
+        """Rebuild the friendships from the friends table."""
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT user_id, friend_id FROM friends WHERE status = 'accepted'")
+                rows = set(cursor.fetchall())
+
+        neighbours = {}
+        for user_id, friend_id in rows:
+            neighbours.setdefault(user_id, set()).add(friend_id)
+            neighbours.setdefault(friend_id, set()).add(user_id)
+        friends = {user_id: array("I", sorted(ids)) for user_id, ids in neighbours.items()}
+        with self._lock:
+            self._rows = rows
+            self._friends = friends
+            self._loaded_at = time.monotonic()
+            self._stats["loads"] += 1
+
+    def refresh_activity(self):
+        """Reload the window's daily totals from daily_activity."""
+        since = date.today() - timedelta(days=self.window_days - 1)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT user_id, activity_date, steps, calories,
+                           water_logs + steps_logs + food_items
+                    FROM daily_activity
+                    WHERE activity_date >= %s
+                """, (since,))
+                rows = cursor.fetchall()
+
+        days = {}
+        for user_id, activity_date, steps, calories, logs in rows:
+            days.setdefault(user_id, {})[activity_date] = [steps, calories, logs]
+        with self._lock:
+            self._days = days
+            self._activity_at = time.monotonic()
+            self._stats["activity_refreshes"] += 1
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None:
+            with self._load_lock:
+                if self._loaded_at is None:
+                    self.refresh_activity()
+                    self.load()
+
+    # ===== Incremental updates =====
+
+    def _link(self, user_id: int, friend_id: int):
+        for a, b in ((user_id, friend_id), (friend_id, user_id)):
+            ids = self._friends.setdefault(a, array("I"))
+            if not _contains(ids, b):
+                insort(ids, b)
+
+    def _unlink(self, user_id: int, friend_id: int):
+        # Still friends if the reverse row is accepted too
+        if (friend_id, user_id) in self._rows:
+            return
+        for a, b in ((user_id, friend_id), (friend_id, user_id)):
+            ids = self._friends.get(a)
+            if ids is not None and _contains(ids, b):
+                ids.pop(bisect_left(ids, b))
+
+    def apply_change(self, payload: str):
+        """Apply one friends_changed notification (see migration 008)."""
+        if payload == "reload":
+            self.load()
+            return
+        change = json.loads(payload)
+        with self._lock:
+            if change.get("old"):
+                old = tuple(change["old"])
+                self._rows.discard(old)
+                self._unlink(*old)
+            if change.get("new"):
+                new = tuple(change["new"])
+                self._rows.add(new)
+                self._link(*new)
+            self._stats["changes"] += 1
+
+    def add_activity(self, deltas: list):
+        """Add committed log_delta() results (activity_rollup.py) to the daily totals."""
+        since = date.today() - timedelta(days=self.window_days - 1)
+        with self._lock:
+            for delta in deltas:
+                if delta["activity_date"] < since:
+                    continue
+                day = self._days.setdefault(delta["user_id"], {}).setdefault(
+                    delta["activity_date"], [0, 0, 0]
+                )
+                day[0] += delta.get("steps", 0)
+                day[1] += delta.get("calories", 0)
+                day[2] += 1
+            self._stats["activity_updates"] += len(deltas)
+
+    # ===== Reads =====
+
+    def friends(self, user_id: int) -> list:
+        """Ids of the user's accepted friends, ascending."""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self._friends.get(user_id, ()))
+
+    def friend_count(self, user_id: int) -> int:
+        self._ensure_loaded()
+        with self._lock:
+            return len(self._friends.get(user_id, ()))
+
+    def mutual_friends(self, user_id: int, other_id: int) -> list:
+        """Friends the two users have in common, ascending."""
+        self._ensure_loaded()
+        with self._lock:
+            self._stats["mutual_lookups"] += 1
+            mine = self._friends.get(user_id, ())
+            theirs = self._friends.get(other_id, ())
+            if len(mine) > len(theirs):
+                mine, theirs = theirs, mine
+            return [friend_id for friend_id in mine if _contains(theirs, friend_id)]
+
+    def _totals(self, user_id: int, since: date) -> dict:
+        steps = calories = active_days = 0
+        for activity_date, (day_steps, day_calories, logs) in self._days.get(user_id, {}).items():
+            if activity_date >= since:
+                steps += day_steps
+                calories += day_calories
+                active_days += 1 if logs else 0
+        return {"steps": int(steps), "calories": int(calories), "active_days": active_days}
+
+    def weekly_totals(self, user_id: int) -> dict:
+        """The user's steps, calories and days with any log over the rolling window."""
+        self._ensure_loaded()
+        since = date.today() - timedelta(days=self.window_days - 1)
+        with self._lock:
+            return self._totals(user_id, since)
+
+    def leaderboard(self, user_id: int, metric: str = "steps") -> list:
+        """
+        The user and their friends ranked by a METRICS total over the window.
+
+        Ties share a rank; entries are {rank, user_id, steps, calories,
+        active_days, is_self}.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown leaderboard metric: {metric}")
+        self._ensure_loaded()
+        since = date.today() - timedelta(days=self.window_days - 1)
+        with self._lock:
+            self._stats["leaderboards"] += 1
+            members = [user_id, *self._friends.get(user_id, ())]
+            entries = [
+                {"user_id": member, **self._totals(member, since), "is_self": member == user_id}
+                for member in members
+            ]
+
+        entries.sort(key=lambda entry: (-entry[metric], entry["user_id"]))
+        previous, rank = None, 0
+        for position, entry in enumerate(entries, start=1):
+            if entry[metric] != previous:
+                previous, rank = entry[metric], position
+            entry["rank"] = rank
+        return entries
+
+    # ===== Listener =====
+
+    def start(self):
+        if self._thread:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="friends-graph", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(**connection_settings())
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Changes made while we were not listening are unknown
+                self.load()
+                self.refresh_activity()
+
+                while not self._stopping.is_set():
+                    if time.monotonic() - self._activity_at >= self.refresh_interval:
+                        self.refresh_activity()
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self.apply_change(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"Friends graph listener error: {e}")
+                with self._lock:
+                    self._stats["errors"] += 1
+                self._stopping.wait(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "users": len(self._friends),
+                "friendships": sum(len(ids) for ids in self._friends.values()) // 2,
+                "active_users": len(self._days),
+                "window_days": self.window_days,
+                "listening": self._thread is not None,
+                "age_seconds": round(now - self._loaded_at, 1) if self._loaded_at else None,
+                "activity_age_seconds": round(now - self._activity_at, 1) if self._activity_at else None,
+                **self._stats,
+            }
+
+
+friends_graph = FriendsGraph(
+    window_days=int(os.getenv("FRIENDS_LEADERBOARD_DAYS", "7")),
+    refresh_interval=float(os.getenv("FRIENDS_ACTIVITY_REFRESH", "60")),
+)
+
+
+def start_friends_graph():
+    """Start LISTEN/NOTIFY updates and activity refreshes unless FRIENDS_GRAPH_LISTEN=false."""
+    if os.getenv("FRIENDS_GRAPH_LISTEN", "true").lower() != "false":
+        friends_graph.start()
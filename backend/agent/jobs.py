@@ -0,0 +1,297 @@
+"""
+Background Schedule Jobs
+Postgres-backed job queue so POST /ai/schedule can return a job id right away
+
+Jobs live in the schedule_jobs table (migration 002), so queued work and
+results survive API restarts. Worker threads in every API process claim jobs
+with FOR UPDATE SKIP LOCKED, and a job left 'running' by a worker that died
+is picked up again once it is older than SCHEDULE_JOB_STALE_AFTER seconds.
+
+Configure with environment variables:
+- SCHEDULE_JOB_WORKERS - jobs run concurrently per API process (default 2, 0 disables)
+- SCHEDULE_JOB_MAX_PENDING - queued + running jobs before submissions are refused (default 100)
+- SCHEDULE_JOB_MAX_ATTEMPTS - attempts before a job is marked failed (default 2)
+- SCHEDULE_JOB_STALE_AFTER - seconds before a 'running' job counts as abandoned (default 600)
+- SCHEDULE_JOB_POLL_INTERVAL - seconds between queue polls when idle (default 2)
+"""
+
+from psycopg2.extras import RealDictCursor
+from typing import Callable, Optional
+from dotenv import load_dotenv
+import threading
+import json
+import uuid
+import os
+
+from database import get_db_connection
+
+load_dotenv()
+
+# Inserts tried when the active job for the same user and week finishes mid-submit
+SUBMIT_ATTEMPTS = 3
+
+JOB_COLUMNS = "id, user_id, week_start_date, status, attempts, result, error, created_at, started_at, finished_at"
+
+
+class QueueFullError(Exception):
+    """Raised when SCHEDULE_JOB_MAX_PENDING jobs are already queued or running."""
+
+
+class ScheduleJobQueue:
+    """
+    Bounded worker pool running schedule generation jobs stored in Postgres.
+
+    `run_job(user_id, week_start_date)` must return the same dict as
+    generate_weekly_schedule: {"success": bool, "error": ..., ...}.
+    """
+
+    def __init__(self, run_job: Callable[[int, str], dict], workers: int = 2,
+                 max_pending: int = 100, max_attempts: int = 2,
+                 stale_after: float = 600.0, poll_interval: float = 2.0):
+        self.run_job = run_job
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._stopping = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {
+            "submitted": 0,
+            "deduplicated": 0,
+            "rejected": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+        }
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    # ===== Lifecycle =====
+
+    def start(self):
+        """Start the worker threads; also resumes jobs left behind by a previous process."""
+        if self._threads:
+            return
+        self._stopping.clear()
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker_loop, name=f"schedule-job-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stop claiming new jobs and wait for the running ones.
+
+        A job interrupted by a hard shutdown stays 'running' in the table and is
+        retried by the next worker once it goes stale.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    # ===== Submit / poll =====
+
+    def submit(self, user_id: int, week_start_date: str) -> tuple[dict, bool]:
+        """
+        Queue a job, or return the active job for the same user and week.
+
+        Returns (job, created). Raises QueueFullError when the queue is at capacity.
+        """
+        job = None
+        full = False
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                # The insert can miss because of the active job for this user and
+                # week, or because of the capacity guard. If that job finishes
+                # before the lookup below, neither applies any more: insert again.
+                for _ in range(SUBMIT_ATTEMPTS):
+                    cursor.execute(f"""
+                        INSERT INTO schedule_jobs (id, user_id, week_start_date, status, created_at)
+                        SELECT %s, %s, %s, 'queued', NOW()
+                        WHERE (
+                            SELECT COUNT(*) FROM schedule_jobs WHERE status IN ('queued', 'running')
+                        ) < %s
+                        ON CONFLICT (user_id, week_start_date) WHERE status IN ('queued', 'running')
+                        DO NOTHING
+                        RETURNING {JOB_COLUMNS}
+                    """, (str(uuid.uuid4()), user_id, week_start_date, self.max_pending))
+                    job = cursor.fetchone()
+                    created = job is not None
+                    if created:
+                        break
+
+                    cursor.execute(f"""
+                        SELECT {JOB_COLUMNS}
+                        FROM schedule_jobs
+                        WHERE user_id = %s AND week_start_date = %s
+                          AND status IN ('queued', 'running')
+                    """, (user_id, week_start_date))
+                    job = cursor.fetchone()
+                    if job is not None:
+                        break
+
+                    cursor.execute("""
+                        SELECT COUNT(*) AS pending FROM schedule_jobs WHERE status IN ('queued', 'running')
+                    """)
+                    full = cursor.fetchone()["pending"] >= self.max_pending
+                    if full:
+                        break
+            conn.commit()
+
+        if full:
+            self._count("rejected")
+            raise QueueFullError(
+                f"Schedule job queue is full ({self.max_pending} pending jobs)"
+            )
+        if job is None:
+            raise RuntimeError(
+                f"Could not queue a schedule job for user {user_id}, week {week_start_date}: "
+                f"the active job kept finishing during {SUBMIT_ATTEMPTS} attempts"
+            )
+
+        self._count("submitted" if created else "deduplicated")
+        if created:
+            self._wakeup.set()
+        return dict(job), created
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Fetch a job by id, or None if it does not exist."""
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"""
+                    SELECT {JOB_COLUMNS}
+                    FROM schedule_jobs
+                    WHERE id = %s
+                """, (job_id,))
+                job = cursor.fetchone()
+        return dict(job) if job else None
+
+    def stats(self) -> dict:
+        """Counters for this process plus queue depth across all workers."""
+        with self._lock:
+            local = dict(self._stats)
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT status, COUNT(*)
+                    FROM schedule_jobs
+                    WHERE status IN ('queued', 'running')
+                    GROUP BY status
+                """)
+                depth = dict(cursor.fetchall())
+        return {
+            "workers": self.workers,
+            "queued": depth.get("queued", 0),
+            "running": depth.get("running", 0),
+            **local,
+        }
+
+    # ===== Workers =====
+
+    def _claim(self) -> Optional[dict]:
+        """Atomically move the oldest runnable job to 'running'."""
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                # Abandoned jobs that are out of attempts will never be claimed; fail them
+                cursor.execute("""
+                    UPDATE schedule_jobs
+                    SET status = 'failed', finished_at = NOW(),
+                        error = 'Worker stopped while running the job'
+                    WHERE status = 'running'
+                      AND started_at < NOW() - make_interval(secs => %s)
+                      AND attempts >= %s
+                """, (self.stale_after, self.max_attempts))
+                cursor.execute("""
+                    UPDATE schedule_jobs
+                    SET status = 'running', started_at = NOW(), attempts = attempts + 1
+                    WHERE id = (
+                        SELECT id FROM schedule_jobs
+                        WHERE status = 'queued'
+                           OR (status = 'running'
+                               AND started_at < NOW() - make_interval(secs => %s))
+                        ORDER BY created_at
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING id, user_id, week_start_date, attempts
+                """, (self.stale_after,))
+                job = cursor.fetchone()
+            conn.commit()
+        return dict(job) if job else None
+
+    def _finish(self, job: dict, result: Optional[dict], error: Optional[str]):
+        if error is None:
+            status = "succeeded"
+        elif job["attempts"] < self.max_attempts:
+            status = "queued"
+        else:
+            status = "failed"
+
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE schedule_jobs
+                    SET status = %s, result = %s, error = %s,
+                        finished_at = CASE WHEN %s = 'queued' THEN NULL ELSE NOW() END
+                    WHERE id = %s
+                """, (
+                    status,
+                    json.dumps(result, default=str) if result is not None else None,
+                    error,
+                    status,
+                    str(job["id"]),
+                ))
+            conn.commit()
+
+        self._count("retried" if status == "queued" else status)
+        if status == "queued":
+            self._wakeup.set()
+
+    def _run(self, job: dict):
+        week_start = job["week_start_date"].isoformat()
+        try:
+            result = self.run_job(job["user_id"], week_start)
+            error = None if result.get("success") else result.get("error", "Failed to generate schedule")
+        except Exception as e:
+            result, error = None, str(e)
+        self._finish(job, result, error)
+
+    def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"Error claiming schedule job: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._run(job)
+            except Exception as e:
+                # Could not record the outcome; the job is retried once it goes stale
+                print(f"Error finishing schedule job {job['id']}: {e}")
+
+
+def create_job_queue(run_job: Callable[[int, str], dict]) -> ScheduleJobQueue:
+    """Build a queue configured from SCHEDULE_JOB_* environment variables."""
+    return ScheduleJobQueue(
+        run_job,
+        workers=int(os.getenv("SCHEDULE_JOB_WORKERS", "2")),
+        max_pending=int(os.getenv("SCHEDULE_JOB_MAX_PENDING", "100")),
+        max_attempts=int(os.getenv("SCHEDULE_JOB_MAX_ATTEMPTS", "2")),
+        stale_after=float(os.getenv("SCHEDULE_JOB_STALE_AFTER", "600")),
+        poll_interval=float(os.getenv("SCHEDULE_JOB_POLL_INTERVAL", "2")),
+    )
@@ -0,0 +1,433 @@
+"""
+LLM Concurrency Governor
+Admission control in front of every model call the schedule agent makes
+
+Without it, a traffic spike or a weekly batch run sends as many concurrent
+requests to Anthropic as there are threads, everyone gets rate-limited,
+and interactive users wait behind bulk work. Each model call (workout_agent.py)
+now goes through llm_governor.slot(), which:
+- takes one request (one per model call, for a slot that covers several,
+  like the tool-mode agent loop) and the estimated tokens from a token bucket
+  shared by every API worker and the batch CLI: one row of llm_rate_limits
+  (migration 009), refilled from the time elapsed and updated under its row
+  lock. Estimates are corrected with the real usage after the call
+- limits concurrent calls per process, with two lanes: 'interactive'
+  (default) and 'batch' (batch.py). Batch calls never take the last
+  LLM_INTERACTIVE_RESERVE of the bucket or of the local slots, and wait
+  while an interactive call is queued
+- fails fast with CircuitOpenError once provider errors pass
+  LLM_BREAKER_ERROR_RATE; after LLM_BREAKER_COOLDOWN seconds one probe call
+  decides whether it closes again. Callers treat this like the model being
+  unavailable (rule-based fallback)
+
+A call that can't get through within LLM_MAX_WAIT (LLM_BATCH_MAX_WAIT for
+batch) raises GovernorTimeoutError. If Postgres can't be reached the bucket
+is skipped and only the local limits apply. Queue depth, waits and
+rejections are exported on GET /metrics; GET /ai/governor/stats has the rest.
+
+Configure with environment variables:
+- LLM_REQUESTS_PER_MINUTE - shared request budget (default 50, 0 disables the bucket)
+- LLM_TOKENS_PER_MINUTE - shared input + output token budget (default 40000)
+- LLM_MAX_CONCURRENT - model calls in flight per process (default 4)
+- LLM_INTERACTIVE_RESERVE - share of the budget and slots batch can't use (default 0.25)
+- LLM_MAX_WAIT - seconds an interactive call may wait (default 30)
+- LLM_BATCH_MAX_WAIT - seconds a batch call may wait (default 300)
+- LLM_BREAKER_ERROR_RATE - provider error rate that opens the breaker (default 0.5)
+- LLM_BREAKER_MIN_CALLS - calls in the window before it can open (default 5)
+- LLM_BREAKER_WINDOW - seconds of outcomes considered (default 60)
+- LLM_BREAKER_COOLDOWN - seconds the breaker stays open (default 30)
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import deque
+from typing import Optional
+from dotenv import load_dotenv
+import threading
+import math
+import time
+import os
+
+from database import get_db_connection
+from telemetry import LLM_WAIT_SECONDS, LLM_QUEUE_DEPTH, LLM_REJECTED, LLM_CIRCUIT_OPEN
+
+load_dotenv()
+
+LANES = ("interactive", "batch")
+_lane = ContextVar("llm_lane", default="interactive")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open."""
+
+
+class GovernorTimeoutError(Exception):
+    """Raised when a model call waited longer than its lane allows."""
+
+
+@contextmanager
+def llm_lane(lane: str):
+    """Run model calls made in this block (this thread/context) in `lane`."""
+    if lane not in LANES:
+        raise ValueError(f"Unknown LLM lane: {lane}")
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def current_lane() -> str:
+    return _lane.get()
+
+
+class TokenBucket:
+    """Requests-per-minute and tokens-per-minute buckets kept in one llm_rate_limits row."""
+
+    def __init__(self, name: str, requests_per_minute: float, tokens_per_minute: float,
+                 reserve: float = 0.25):
+        self.name = name
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.reserve = reserve
+        self._created = False
+
+    def _ensure_row(self, cursor):
+        if not self._created:
+            cursor.execute("""
+                INSERT INTO llm_rate_limits (name, requests, tokens, updated_at)
+                VALUES (%s, %s, %s, clock_timestamp())
+                ON CONFLICT (name) DO NOTHING
+            """, (self.name, self.requests_per_minute, self.tokens_per_minute))
+            self._created = True
+
+    def try_take(self, tokens: float, lane: str, requests: int = 1) -> float:
+        """Take `requests` and `tokens`; returns 0 if taken, else seconds until they could be."""
+        tokens = min(tokens, self.tokens_per_minute * (1 - self.reserve))
+        requests = min(requests, self.requests_per_minute * (1 - self.reserve))
+        # Batch leaves the reserve for interactive calls
+        floor = self.reserve if lane == "batch" else 0.0
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                self._ensure_row(cursor)
+                cursor.execute("""
+                    SELECT requests, tokens, EXTRACT(EPOCH FROM clock_timestamp() - updated_at)
+                    FROM llm_rate_limits
+                    WHERE name = %s
+                    FOR UPDATE
+                """, (self.name,))
+                requests_left, available, elapsed = cursor.fetchone()
+                elapsed = max(float(elapsed), 0.0)
+                requests_left = min(self.requests_per_minute, requests_left + self.requests_per_minute * elapsed / 60)
+                available = min(self.tokens_per_minute, available + self.tokens_per_minute * elapsed / 60)
+
+                need_requests = requests + floor * self.requests_per_minute
+                need_tokens = tokens + floor * self.tokens_per_minute
+                if requests_left >= need_requests and available >= need_tokens:
+                    cursor.execute("""
+                        UPDATE llm_rate_limits
+                        SET requests = %s, tokens = %s, updated_at = clock_timestamp()
+                        WHERE name = %s
+                    """, (requests_left - requests, available - tokens, self.name))
+                    wait = 0.0
+                else:
+                    wait = max(
+                        (need_requests - requests_left) * 60 / self.requests_per_minute,
+                        (need_tokens - available) * 60 / self.tokens_per_minute,
+                        0.01,
+                    )
+            conn.commit()
+        return wait
+
+    def adjust(self, tokens: float, requests: int = 0):
+        """Charge (or refund, if negative) the difference between estimated and real usage."""
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE llm_rate_limits
+                    SET tokens = LEAST(tokens - %s, %s),
+                        requests = LEAST(requests - %s, %s)
+                    WHERE name = %s
+                """, (tokens, self.tokens_per_minute, requests, self.requests_per_minute, self.name))
+            conn.commit()
+
+
+class CircuitBreaker:
+    """Opens when the provider error rate over a sliding window gets too high (per process)."""
+
+    def __init__(self, error_rate: float = 0.5, min_calls: int = 5,
+                 window: float = 60.0, cooldown: float = 30.0):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (finished_at, failed)
+        self._opened_at = None
+        self._probing = False
+        self.opened = 0
+
+    def _set_state(self, state: str):
+        self.state = state
+        LLM_CIRCUIT_OPEN.set(0 if state == "closed" else 1)
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError if calls aren't allowed; True if this call is the half-open probe."""
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    raise CircuitOpenError(
+                        f"Model circuit breaker open for another "
+                        f"{self.cooldown - (time.monotonic() - self._opened_at):.0f}s"
+                    )
+                self._set_state("half_open")
+            if self.state == "half_open":
+                if self._probing:
+                    raise CircuitOpenError("Model circuit breaker is half-open; a probe call is in flight")
+                self._probing = True
+                return True
+            return False
+
+    def cancel_probe(self):
+        """The probe never reached the model; let the next call probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, failed: bool, probe: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                self._probing = False
+                self._outcomes.clear()
+                if failed:
+                    self._opened_at = now
+                    self._set_state("open")
+                else:
+                    self._set_state("closed")
+                return
+
+            self._outcomes.append((now, failed))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, outcome in self._outcomes if outcome)
+            if (self.state == "closed" and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.error_rate):
+                self._opened_at = now
+                self.opened += 1
+                self._set_state("open")
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(1 for _, outcome in self._outcomes if outcome)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "window_error_rate": round(failures / calls, 3) if calls else 0.0,
+                "opened": self.opened,
+            }
+
+
+class _Slot:
+    """What a caller holds while its model call runs; record() the real usage."""
+
+    def __init__(self, estimated_tokens: int, requests: int = 1):
+        self.estimated_tokens = estimated_tokens
+        self.requests = requests
+        self.used_tokens = None
+        self.calls = 0
+
+    def record(self, usage: Optional[dict]):
+        """Once per model call made under the slot."""
+        self.calls += 1
+        if usage:
+            tokens = usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+            self.used_tokens = (self.used_tokens or 0) + tokens
+
+
+class LLMGovernor:
+    """Shared token bucket + per-process priority slots + circuit breaker."""
+
+    def __init__(self, bucket: Optional[TokenBucket] = None, max_concurrent: int = 4,
+                 reserve: float = 0.25, max_wait: Optional[dict] = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.bucket = bucket
+        self.max_concurrent = max_concurrent
+        # Batch may use all but the reserved share of the slots (at least one)
+        self.batch_slots = max(1, math.floor(max_concurrent * (1 - reserve)))
+        self.max_wait = max_wait or {"interactive": 30.0, "batch": 300.0}
+        self.breaker = breaker or CircuitBreaker()
+        self._cond = threading.Condition()
+        self._active = dict.fromkeys(LANES, 0)
+        self._waiting = dict.fromkeys(LANES, 0)
+        self._stats = {
+            "calls": 0, "failures": 0, "rejected_open": 0, "timeouts": 0,
+            "bucket_waits": 0, "bucket_errors": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+        }
+
+    def _count(self, key: str, amount: float = 1):
+        with self._cond:
+            self._stats[key] += amount
+
+    def _can_run(self, lane: str) -> bool:
+        if sum(self._active.values()) >= self.max_concurrent:
+            return False
+        if lane == "batch":
+            return self._active["batch"] < self.batch_slots and not self._waiting["interactive"]
+        return True
+
+    def _acquire_local(self, lane: str, deadline: float):
+        with self._cond:
+            self._waiting[lane] += 1
+            LLM_QUEUE_DEPTH.set(self._waiting[lane], lane=lane)
+            try:
+                while not self._can_run(lane):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise GovernorTimeoutError(f"No free model slot within {self.max_wait[lane]:.0f}s ({lane})")
+                    self._cond.wait(remaining)
+                self._active[lane] += 1
+            finally:
+                self._waiting[lane] -= 1
+                LLM_QUEUE_DEPTH.set(self._waiting[lane], lane=lane)
+
+    def _release_local(self, lane: str):
+        with self._cond:
+            self._active[lane] -= 1
+            self._cond.notify_all()
+
+    def _acquire_bucket(self, tokens: int, lane: str, deadline: float, requests: int = 1):
+        if self.bucket is None:
+            return
+        while True:
+            try:
+                wait = self.bucket.try_take(tokens, lane, requests)
+            except Exception as e:
+                # The bucket is advisory; don't take the agent down with it
+                print(f"LLM governor bucket error, continuing without it: {e}")
+                self._count("bucket_errors")
+                return
+            if wait <= 0:
+                return
+            self._count("bucket_waits")
+            remaining = deadline - time.monotonic()
+            if wait > remaining:
+                raise GovernorTimeoutError(
+                    f"Model rate budget exhausted; next slot in {wait:.1f}s ({lane})"
+                )
+            time.sleep(wait)
+
+    @contextmanager
+    def slot(self, estimated_tokens: int, failures: tuple = (Exception,), lane: Optional[str] = None,
+             requests: int = 1):
+        """
+        Hold a model call slot for the duration of the block.
+
+        estimated_tokens and `requests` (the most model calls the block makes)
+        are charged up front; call slot.record(usage_metadata) after each call
+        so unused requests are refunded and tokens corrected. Exceptions of the
+        `failures` types count as provider errors for the circuit breaker.
+        """
+        lane = lane or current_lane()
+        started = time.monotonic()
+        deadline = started + self.max_wait[lane]
+        try:
+            probe = self.breaker.before_call()
+        except CircuitOpenError:
+            self._count("rejected_open")
+            LLM_REJECTED.inc(lane=lane, reason="circuit_open")
+            raise
+
+        acquired = False
+        try:
+            self._acquire_local(lane, deadline)
+            acquired = True
+            self._acquire_bucket(estimated_tokens, lane, deadline, requests)
+        except GovernorTimeoutError:
+            self._count("timeouts")
+            LLM_REJECTED.inc(lane=lane, reason="timeout")
+            LLM_WAIT_SECONDS.observe(time.monotonic() - started, lane=lane, outcome="timeout")
+            if acquired:
+                self._release_local(lane)
+            if probe:
+                self.breaker.cancel_probe()
+            raise
+
+        waited = time.monotonic() - started
+        LLM_WAIT_SECONDS.observe(waited, lane=lane, outcome="admitted")
+        with self._cond:
+            self._stats["calls"] += 1
+            self._stats["wait_seconds_total"] += waited
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+
+        handle = _Slot(estimated_tokens, requests)
+        failed = False
+        try:
+            yield handle
+        except failures:
+            failed = True
+            self._count("failures")
+            raise
+        finally:
+            self._release_local(lane)
+            self.breaker.record(failed, probe)
+            # Unrecorded calls keep their charge; recorded ones are corrected
+            token_change = handle.used_tokens - estimated_tokens if handle.used_tokens is not None else 0
+            request_change = min(handle.calls, requests) - requests if handle.calls else 0
+            if self.bucket is not None and (token_change or request_change):
+                try:
+                    self.bucket.adjust(token_change, request_change)
+                except Exception as e:
+                    print(f"LLM governor bucket adjust error: {e}")
+                    self._count("bucket_errors")
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            active, waiting = dict(self._active), dict(self._waiting)
+        calls = stats["calls"]
+        return {
+            "requests_per_minute": self.bucket.requests_per_minute if self.bucket else None,
+            "tokens_per_minute": self.bucket.tokens_per_minute if self.bucket else None,
+            "max_concurrent": self.max_concurrent,
+            "batch_slots": self.batch_slots,
+            "active": active,
+            "waiting": waiting,
+            "breaker": self.breaker.stats(),
+            **{key: value for key, value in stats.items() if not key.startswith("wait_seconds")},
+            "wait_seconds_avg": round(stats["wait_seconds_total"] / calls, 3) if calls else 0.0,
+            "wait_seconds_max": round(stats["wait_seconds_max"], 3),
+        }
+
+
+def create_llm_governor() -> LLMGovernor:
+    """Build the governor configured from LLM_* environment variables."""
+    reserve = float(os.getenv("LLM_INTERACTIVE_RESERVE", "0.25"))
+    requests_per_minute = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "50"))
+    bucket = None
+    if requests_per_minute > 0:
+        bucket = TokenBucket(
+            "anthropic",
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "40000")),
+            reserve=reserve,
+        )
+    return LLMGovernor(
+        bucket=bucket,
+        max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", "4")),
+        reserve=reserve,
+        max_wait={
+            "interactive": float(os.getenv("LLM_MAX_WAIT", "30")),
+            "batch": float(os.getenv("LLM_BATCH_MAX_WAIT", "300")),
+        },
+        breaker=CircuitBreaker(
+            error_rate=float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5")),
+            min_calls=int(os.getenv("LLM_BREAKER_MIN_CALLS", "5")),
+            window=float(os.getenv("LLM_BREAKER_WINDOW", "60")),
+            cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+        ),
+    )
+
+
+llm_governor = create_llm_governor()
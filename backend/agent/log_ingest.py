@@ -0,0 +1,279 @@
+"""
+Activity Log Ingestion
+Group-commit buffer behind POST /logs/batch (routes/logs.py)
+
+Wearable syncs upload hundreds of water/steps/calories readings at once.
+Batches from concurrent requests are buffered in memory and written together
+once LOG_BATCH_MAX_ROWS records are waiting or the oldest has waited
+LOG_BATCH_MAX_WAIT seconds. Each flush is one transaction:
+- idempotency keys go into log_ingest_keys (migration 007); records whose
+  key is already there are dropped as duplicates
+- records for unknown users are rejected instead of failing the flush
+- the rest are COPYed into water_logs, steps_logs and calories_logs
+- the log table triggers add their totals to daily_activity (migration 006)
+Once committed, the totals also go to the friends leaderboards (friends_graph.py).
+
+A request's ack is only returned after its flush commits, so an acked batch
+is durable, and a failed flush can simply be retried by the client (keys
+were rolled back with it). When more than LOG_BUFFER_MAX_ROWS records are
+waiting, new batches are refused with BufferFullError.
+
+Configure with environment variables:
+- LOG_BATCH_MAX_ROWS - records per flush (default 5000)
+- LOG_BATCH_MAX_WAIT - seconds a record waits for more to batch with (default 0.05)
+- LOG_BUFFER_MAX_ROWS - records waiting before batches are refused (default 100000)
+- LOG_IDEMPOTENCY_TTL - seconds idempotency keys are kept (default 604800, one week)
+"""
+
+from collections import deque
+from datetime import datetime
+from dotenv import load_dotenv
+import asyncio
+import random
+import time
+import uuid
+import os
+
+from database import get_async_connection
+from activity_rollup import log_delta
+from friends_graph import friends_graph
+
+load_dotenv()
+
+# Log type -> (table, columns copied from each record)
+LOG_TABLES = {
+    "water": ("water_logs", ("user_id", "amount", "unit", "logged_at")),
+    "steps": ("steps_logs", ("user_id", "steps", "logged_at")),
+    "calories": ("calories_logs", (
+        "user_id", "food_name", "calories", "protein", "carbs", "fat",
+        "fiber", "sugar", "serving_size", "logged_at",
+    )),
+}
+RATE_WINDOW = 60.0  # seconds behind rows_per_second
+
+
+class BufferFullError(Exception):
+    """Raised when too many records are already waiting to be flushed."""
+
+
+class _PendingBatch:
+    def __init__(self, records: list):
+        self.ack_id = str(uuid.uuid4())
+        self.records = records
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class LogIngestBuffer:
+    """Buffers log batches and flushes them with COPY at size/time thresholds."""
+
+    def __init__(self, max_rows: int = 5000, max_wait: float = 0.05,
+                 max_buffered: int = 100000, key_ttl: float = 604800.0):
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.max_buffered = max_buffered
+        self.key_ttl = key_ttl
+        self._pending = []
+        self._pending_rows = 0
+        self._flush_lock = None
+        self._timer = None
+        self._tasks = set()
+        self._flushes = deque()  # (finished_at, rows written) within RATE_WINDOW
+        self._started = None
+        self._stats = {
+            "batches": 0, "records": 0, "inserted": 0, "duplicates": 0, "rejected": 0,
+            "flushes": 0, "flush_errors": 0, "refused": 0, "flush_ms_total": 0.0, "flush_ms_max": 0.0,
+        }
+
+    # ===== Submit =====
+
+    async def submit(self, records: list) -> dict:
+        """
+        Queue one request's records and wait until they are committed.
+
+        Records are dicts with "type" ('water', 'steps' or 'calories'),
+        "user_id", the log columns and optionally "idempotency_key". Returns
+        the ack: ack_id and inserted/duplicates/rejected counts.
+        """
+        if self._pending_rows + len(records) > self.max_buffered:
+            self._stats["refused"] += 1
+            raise BufferFullError(f"{self._pending_rows} log records already waiting to be written")
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        if self._started is None:
+            self._started = time.monotonic()
+
+        now = datetime.now()
+        for record in records:
+            logged_at = record.get("logged_at") or now
+            if logged_at.tzinfo is not None:
+                # logged_at columns are TIMESTAMP (local time, like CURRENT_TIMESTAMP)
+                logged_at = logged_at.astimezone().replace(tzinfo=None)
+            record["logged_at"] = logged_at
+
+        batch = _PendingBatch(records)
+        self._pending.append(batch)
+        self._pending_rows += len(records)
+        self._stats["batches"] += 1
+        self._stats["records"] += len(records)
+
+        if self._pending_rows >= self.max_rows:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._schedule_flush)
+        return await batch.future
+
+    # ===== Flush =====
+
+    def _schedule_flush(self):
+        # Keep a reference so the task isn't garbage collected mid-flush
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take(self) -> list:
+        """Pending batches up to max_rows records (at least one batch)."""
+        taken, rows = [], 0
+        while self._pending and (not taken or rows + len(self._pending[0].records) <= self.max_rows):
+            batch = self._pending.pop(0)
+            taken.append(batch)
+            rows += len(batch.records)
+        self._pending_rows -= rows
+        return taken
+
+    async def flush(self):
+        """Write everything pending, max_rows records per transaction."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._flush_lock:
+            while self._pending:
+                batches = self._take()
+                started = time.perf_counter()
+                try:
+                    acks = await self._write(batches)
+                except Exception as e:
+                    self._stats["flush_errors"] += 1
+                    for batch in batches:
+                        if not batch.future.done():
+                            batch.future.set_exception(e)
+                    continue
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self._record_flush(sum(ack["inserted"] for ack in acks), elapsed_ms)
+                for batch, ack in zip(batches, acks):
+                    if not batch.future.done():
+                        batch.future.set_result(ack)
+
+    async def _write(self, batches: list) -> list:
+        """One transaction for these batches; returns each batch's ack."""
+        records = [record for batch in batches for record in batch.records]
+        user_ids = list({record["user_id"] for record in records})
+        keyed = {}
+        for record in records:
+            key = record.get("idempotency_key")
+            if key is not None:
+                keyed.setdefault((record["user_id"], key), record)
+
+        async with get_async_connection() as conn:
+            async with conn.transaction():
+                known = {row["id"] for row in await conn.fetch(
+                    "SELECT id FROM users WHERE id = ANY($1::int[])", user_ids
+                )}
+                fresh = set()
+                keys = [key for key in keyed if key[0] in known]
+                if keys:
+                    rows = await conn.fetch("""
+                        INSERT INTO log_ingest_keys (user_id, idempotency_key, created_at)
+                        SELECT user_id, idempotency_key, NOW()
+                        FROM unnest($1::int[], $2::text[]) AS keys (user_id, idempotency_key)
+                        ON CONFLICT DO NOTHING
+                        RETURNING user_id, idempotency_key
+                    """, [user_id for user_id, _ in keys], [key for _, key in keys])
+                    fresh = {(row["user_id"], row["idempotency_key"]) for row in rows}
+
+                # Status per record: the first record with a fresh key wins
+                statuses = []
+                by_type = {log_type: [] for log_type in LOG_TABLES}
+                for record in records:
+                    key = record.get("idempotency_key")
+                    if record["user_id"] not in known:
+                        statuses.append("rejected")
+                    elif key is not None and (
+                        (record["user_id"], key) not in fresh or keyed[(record["user_id"], key)] is not record
+                    ):
+                        statuses.append("duplicates")
+                    else:
+                        statuses.append("inserted")
+                        by_type[record["type"]].append(record)
+
+                for log_type, typed in by_type.items():
+                    if typed:
+                        table, columns = LOG_TABLES[log_type]
+                        await conn.copy_records_to_table(
+                            table, columns=columns,
+                            records=[tuple(record.get(column) for column in columns) for record in typed],
+                        )
+            deltas = [log_delta(record["type"], record) for typed in by_type.values() for record in typed]
+            friends_graph.add_activity(deltas)
+
+            # Expired keys go now and then rather than on every flush
+            if random.random() < 0.01:
+                await conn.execute(
+                    "DELETE FROM log_ingest_keys WHERE created_at < NOW() - make_interval(secs => $1)",
+                    self.key_ttl,
+                )
+
+        acks, position = [], 0
+        for batch in batches:
+            counts = {"inserted": 0, "duplicates": 0, "rejected": 0}
+            for status in statuses[position:position + len(batch.records)]:
+                counts[status] += 1
+            position += len(batch.records)
+            acks.append({"ack_id": batch.ack_id, "records": len(batch.records), **counts})
+            for key, count in counts.items():
+                self._stats[key] += count
+        return acks
+
+    def _record_flush(self, rows: int, elapsed_ms: float):
+        now = time.monotonic()
+        self._flushes.append((now, rows))
+        while self._flushes and self._flushes[0][0] < now - RATE_WINDOW:
+            self._flushes.popleft()
+        self._stats["flushes"] += 1
+        self._stats["flush_ms_total"] += elapsed_ms
+        self._stats["flush_ms_max"] = max(self._stats["flush_ms_max"], elapsed_ms)
+
+    async def close(self):
+        """Flush what is left; called on application shutdown."""
+        if self._pending:
+            await self.flush()
+
+    def stats(self) -> dict:
+        """Counters plus rows/sec written over the last minute."""
+        now = time.monotonic()
+        recent = [rows for finished, rows in self._flushes if finished >= now - RATE_WINDOW]
+        window = min(RATE_WINDOW, now - self._started) if self._started else 0
+        flushes = self._stats["flushes"]
+        return {
+            "max_rows": self.max_rows,
+            "max_wait": self.max_wait,
+            "buffered": self._pending_rows,
+            **{key: value for key, value in self._stats.items() if not key.startswith("flush_ms")},
+            "flush_ms_avg": round(self._stats["flush_ms_total"] / flushes, 2) if flushes else 0.0,
+            "flush_ms_max": round(self._stats["flush_ms_max"], 2),
+            "rows_per_flush_avg": round(self._stats["inserted"] / flushes, 1) if flushes else 0.0,
+            "rows_per_second": round(sum(recent) / window, 1) if window else 0.0,
+        }
+
+
+def create_log_ingest_buffer() -> LogIngestBuffer:
+    """Build the buffer configured from LOG_* environment variables."""
+    return LogIngestBuffer(
+        max_rows=int(os.getenv("LOG_BATCH_MAX_ROWS", "5000")),
+        max_wait=float(os.getenv("LOG_BATCH_MAX_WAIT", "0.05")),
+        max_buffered=int(os.getenv("LOG_BUFFER_MAX_ROWS", "100000")),
+        key_ttl=float(os.getenv("LOG_IDEMPOTENCY_TTL", "604800")),
+    )
+
+
+log_ingest = create_log_ingest_buffer()
@@ -0,0 +1,413 @@
+"""
+Activity Log Partitions
+Monthly partitions of the water, steps and calories logs, with a Parquet archive
+
+Migration 010 turned water_logs, steps_logs and calories_logs into tables
+range-partitioned by month on logged_at, indexed on (user_id, logged_at)
+plus a BRIN index on logged_at. A user's 7/30-day reads only touch the
+months in range, and vacuum and index upkeep work one month at a time
+instead of on the whole history.
+
+LogPartitionMaintainer runs every LOG_PARTITION_INTERVAL seconds, in one
+process at a time (advisory lock):
+- creates the partitions for the next LOG_PARTITION_MONTHS_AHEAD months, so
+  inserts don't land in the default partition; rows that did are moved into
+  their month's partition once it exists
+- archives months older than LOG_RETAIN_MONTHS: each is written to
+  LOG_ARCHIVE_DIR/<table>/<YYYY-MM>.parquet (zstd, sorted by user and time,
+  so row-group statistics skip other users' rows), then detached, recorded
+  in log_archives and dropped in one transaction
+Daily totals stay in daily_activity, so summaries and trends don't change;
+read_logs() returns raw logs for any range, reading archived months from
+their Parquet files (GET /logs/{user_id}).
+
+Archiving needs the `pyarrow` package; without it old months stay in Postgres.
+
+Run once with: python backend/agent/log_partitions.py [--dry-run]
+
+Configure with environment variables:
+- LOG_PARTITION_INTERVAL - seconds between maintenance runs (default 3600, 0 disables)
+- LOG_PARTITION_MONTHS_AHEAD - future months to create ahead of time (default 3)
+- LOG_RETAIN_MONTHS - months kept in Postgres, the current one included (default 13, 0 keeps all)
+- LOG_ARCHIVE_DIR - where archived months are written (default backend/archive/logs)
+"""
+
+from datetime import date, datetime
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+import argparse
+import threading
+import asyncio
+import time
+import json
+import re
+import os
+
+from database import get_db_connection
+
+load_dotenv()
+
+# Log type (as in log_ingest.LOG_TABLES) -> partitioned table
+LOG_TABLES = {"water": "water_logs", "steps": "steps_logs", "calories": "calories_logs"}
+PARTITION_SUFFIX = re.compile(r"_(\d{4})_(\d{2})$")
+EXPORT_BATCH_ROWS = 50000
+
+
+class ArchiveUnavailableError(Exception):
+    """Raised when archived months are needed but pyarrow is not installed."""
+
+
+def _pyarrow():
+    """(pyarrow, pyarrow.parquet), imported on first use; it is large and optional."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ArchiveUnavailableError("Archived log months need the pyarrow package")
+    return pyarrow, pyarrow.parquet
+
+
+def add_months(month: date, count: int) -> date:
+    """First day of the month `count` months after `month`."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def list_partitions(cursor, table: str) -> dict:
+    """month -> partition name of the monthly partitions attached to `table`."""
+    cursor.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = %s::regclass
+    """, (table,))
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = PARTITION_SUFFIX.search(name)
+        if match and name == partition_name(table, date(int(match[1]), int(match[2]), 1)):
+            partitions[date(int(match[1]), int(match[2]), 1)] = name
+    return partitions
+
+
+def ensure_partition(conn, table: str, month: date) -> bool:
+    """
+    Create the partition for `month` if it is missing; True if it was created.
+
+    Rows already in the default partition for that month would block the
+    new partition, so the default one is detached while they are moved.
+    """
+    name, end = partition_name(table, month), add_months(month, 1)
+    default = f"{table}_default"
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(
+            f"SELECT EXISTS (SELECT 1 FROM {default} WHERE logged_at >= %s AND logged_at < %s)",
+            (month, end),
+        )
+        strays = cursor.fetchone()[0]
+        if strays:
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+            (month.isoformat(), end.isoformat()),
+        )
+        if strays:
+            # Moving rows doesn't change any day's totals; keep the daily_activity triggers out of it
+            cursor.execute("SET LOCAL daily_activity.skip_triggers = 'on'")
+            cursor.execute(f"""
+                WITH moved AS (
+                    DELETE FROM {default} WHERE logged_at >= %s AND logged_at < %s RETURNING *
+                )
+                INSERT INTO {table} SELECT * FROM moved
+            """, (month, end))
+            cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+    conn.commit()
+    return True
+
+
+def _arrow_schema(cursor, name: str):
+    """Parquet schema for a partition, from its Postgres column types."""
+    pa, _ = _pyarrow()
+    types = {
+        "integer": pa.int32(),
+        "bigint": pa.int64(),
+        "character varying": pa.string(),
+        "text": pa.string(),
+        "timestamp without time zone": pa.timestamp("us"),
+        "timestamp with time zone": pa.timestamp("us", tz="UTC"),
+        "date": pa.date32(),
+    }
+    cursor.execute("""
+        SELECT column_name, data_type, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+    """, (name,))
+    fields = []
+    for column, data_type, precision, scale in cursor.fetchall():
+        if data_type == "numeric":
+            fields.append(pa.field(column, pa.decimal128(precision or 38, scale or 0)))
+        else:
+            fields.append(pa.field(column, types.get(data_type, pa.string())))
+    return pa.schema(fields)
+
+
+def export_partition(conn, name: str, path: Path) -> tuple[int, int]:
+    """Write a partition to a zstd Parquet file, sorted by (user_id, logged_at); returns (rows, bytes)."""
+    pa, pq = _pyarrow()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_suffix(".parquet.partial")
+    rows = 0
+    with conn.cursor() as cursor:
+        schema = _arrow_schema(cursor, name)
+    # Server-side cursor, so a month is never held in memory at once
+    with conn.cursor(name=f"export_{name}") as cursor:
+        cursor.execute(f"SELECT * FROM {name} ORDER BY user_id, logged_at")
+        columns = schema.names
+        with pq.ParquetWriter(partial, schema, compression="zstd") as writer:
+            while True:
+                batch = cursor.fetchmany(EXPORT_BATCH_ROWS)
+                if not batch:
+                    break
+                writer.write_table(pa.Table.from_pylist([dict(zip(columns, row)) for row in batch], schema=schema))
+                rows += len(batch)
+    conn.commit()
+    os.replace(partial, path)
+    return rows, path.stat().st_size
+
+
+def archive_partition(conn, table: str, month: date, archive_dir: Path) -> Optional[dict]:
+    """
+    Export one month to Parquet, then detach, record and drop it.
+
+    The partition stays attached (and readable) while it is exported; if
+    rows were added or removed meanwhile, it is exported again on the next run.
+    """
+    name = partition_name(table, month)
+    path = archive_dir / table / f"{month:%Y-%m}.parquet"
+    rows, size = export_partition(conn, name, path)
+    with conn.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+        cursor.execute(f"SELECT COUNT(*) FROM {name}")
+        if cursor.fetchone()[0] != rows:
+            conn.rollback()
+            return None
+        cursor.execute("""
+            INSERT INTO log_archives (table_name, month, path, rows, bytes)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (table_name, month) DO UPDATE SET
+                path = EXCLUDED.path, rows = EXCLUDED.rows, bytes = EXCLUDED.bytes, archived_at = NOW()
+        """, (table, month, str(path), rows, size))
+        cursor.execute(f"DROP TABLE {name}")
+    conn.commit()
+    return {"table": table, "month": month.isoformat(), "path": str(path), "rows": rows, "bytes": size}
+
+
+class LogPartitionMaintainer:
+    """Background thread that creates upcoming partitions and archives old ones."""
+
+    def __init__(self, interval: float = 3600.0, months_ahead: int = 3,
+                 retain_months: int = 13, archive_dir: Optional[Path] = None):
+        self.interval = interval
+        self.months_ahead = months_ahead
+        self.retain_months = retain_months
+        self.archive_dir = Path(archive_dir or Path(__file__).resolve().parent.parent / "archive" / "logs")
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "runs": 0, "skipped": 0, "partitions_created": 0, "months_archived": 0,
+            "rows_archived": 0, "archive_bytes": 0, "archive_retries": 0, "archive_unavailable": 0, "errors": 0,
+        }
+        self._last_run = None
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def start(self):
+        if self._thread or self.interval <= 0:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="log-partitions", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def plan(self, today: Optional[date] = None) -> dict:
+        """Months to create and months to archive, per table, as of `today`."""
+        current = (today or date.today()).replace(day=1)
+        wanted = [add_months(current, offset) for offset in range(self.months_ahead + 1)]
+        cutoff = add_months(current, -(self.retain_months - 1)) if self.retain_months > 0 else None
+        plan = {}
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                for table in LOG_TABLES.values():
+                    partitions = list_partitions(cursor, table)
+                    plan[table] = {
+                        "create": [month for month in wanted if month not in partitions],
+                        "archive": sorted(month for month in partitions if cutoff and month < cutoff),
+                    }
+        return plan
+
+    def run_once(self, dry_run: bool = False, raise_errors: bool = False) -> Optional[dict]:
+        """One maintenance pass; None if another process holds the lock (or on error, unless raise_errors)."""
+        started = time.perf_counter()
+        created, archived = [], []
+        try:
+            plan = self.plan()
+            if dry_run:
+                return {"dry_run": True, "plan": plan}
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    # Session lock: every step below commits on its own
+                    cursor.execute("SELECT pg_try_advisory_lock(hashtext('log_partitions'))")
+                    if not cursor.fetchone()[0]:
+                        self._count("skipped")
+                        return None
+                conn.commit()
+                try:
+                    for table, steps in plan.items():
+                        for month in steps["create"]:
+                            if ensure_partition(conn, table, month):
+                                created.append(partition_name(table, month))
+                    for table, steps in plan.items():
+                        for month in steps["archive"]:
+                            result = archive_partition(conn, table, month, self.archive_dir)
+                            if result is None:
+                                self._count("archive_retries")
+                                continue
+                            archived.append(result)
+                finally:
+                    conn.rollback()
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT pg_advisory_unlock(hashtext('log_partitions'))")
+                    conn.commit()
+        except ArchiveUnavailableError as e:
+            # Upcoming partitions were still created; old months wait for pyarrow
+            print(f"Log archive skipped: {e}")
+            self._count("archive_unavailable")
+        except Exception as e:
+            print(f"Log partition maintenance error: {e}")
+            self._count("errors")
+            if raise_errors:
+                raise
+            return None
+
+        result = {"created": created, "archived": archived}
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["partitions_created"] += len(created)
+            self._stats["months_archived"] += len(archived)
+            self._stats["rows_archived"] += sum(item["rows"] for item in archived)
+            self._stats["archive_bytes"] += sum(item["bytes"] for item in archived)
+            self._last_run = {
+                **result,
+                "finished_at": datetime.now().isoformat(),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+        return result
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self.run_once()
+            self._stopping.wait(self.interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "months_ahead": self.months_ahead,
+                "retain_months": self.retain_months,
+                "archive_dir": str(self.archive_dir),
+                "running": self._thread is not None,
+                **self._stats,
+                "last_run": self._last_run,
+            }
+
+
+# ===== Reads =====
+
+def _read_archive(path: str, user_id: int, start: datetime, end: datetime) -> list:
+    _, pq = _pyarrow()
+    table = pq.read_table(path, filters=[
+        ("user_id", "=", user_id), ("logged_at", ">=", start), ("logged_at", "<", end),
+    ])
+    return table.to_pylist()
+
+
+async def read_logs(conn, log_type: str, user_id: int, start: datetime, end: datetime,
+                    limit: int = 1000) -> dict:
+    """
+    A user's raw logs of one type with start <= logged_at < end, oldest first.
+
+    Months still in Postgres are read with the (user_id, logged_at) index;
+    archived months are read from their Parquet files (in a thread).
+    Returns {"logs": [...], "archived_months": [...], "truncated": bool}.
+    """
+    table = LOG_TABLES[log_type]
+    archives = await conn.fetch("""
+        SELECT month, path
+        FROM log_archives
+        WHERE table_name = $1 AND month < $3::timestamp AND month >= date_trunc('month', $2::timestamp)
+        ORDER BY month
+    """, table, start, end)
+    logs = []
+    for archive in archives:
+        logs.extend(await asyncio.to_thread(_read_archive, archive["path"], user_id, start, end))
+        if len(logs) > limit:
+            break
+    if len(logs) <= limit:
+        rows = await conn.fetch(f"""
+            SELECT *
+            FROM {table}
+            WHERE user_id = $1 AND logged_at >= $2 AND logged_at < $3
+            ORDER BY logged_at
+            LIMIT $4
+        """, user_id, start, end, limit + 1 - len(logs))
+        logs.extend(dict(row) for row in rows)
+    logs.sort(key=lambda log: log["logged_at"])
+    return {
+        "logs": logs[:limit],
+        "archived_months": [archive["month"].isoformat() for archive in archives],
+        "truncated": len(logs) > limit,
+    }
+
+
+def create_log_partition_maintainer() -> LogPartitionMaintainer:
+    return LogPartitionMaintainer(
+        interval=float(os.getenv("LOG_PARTITION_INTERVAL", "3600")),
+        months_ahead=int(os.getenv("LOG_PARTITION_MONTHS_AHEAD", "3")),
+        retain_months=int(os.getenv("LOG_RETAIN_MONTHS", "13")),
+        archive_dir=os.getenv("LOG_ARCHIVE_DIR") or None,
+    )
+
+
+log_partitions = create_log_partition_maintainer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create upcoming log partitions and archive old ones")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would be created and archived")
+    args = parser.parse_args()
+
+    result = log_partitions.run_once(dry_run=args.dry_run, raise_errors=True)
+    if result is None:
+        print("Another process is maintaining the log partitions; try again later")
+        return
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
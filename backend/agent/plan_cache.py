@@ -0,0 +1,255 @@
+"""
+LLM Plan Cache
+Reuse generated plans for users whose planning inputs are the same
+
+Many users look identical to the planner: same goal, experience, location
+and days per week, the same catalog and no (or the same) recent schedules.
+Plans are cached under a hash of those normalized inputs, the catalog
+content digest and a digest of the workout ids in the recent schedules, so a
+new user in a common cohort gets a plan without a model call.
+
+Two levels: a per-process LRU in front of the plan_cache table (migration
+005), which every API worker and batch run shares. Table rows expire after
+PLAN_CACHE_TTL and are pruned least-recently-used first above
+PLAN_CACHE_MAX_ROWS. With PLAN_CACHE_PERTURB a hit swaps one workout per day
+for a similar one, so users in a cohort don't all get identical weeks.
+
+Configure with environment variables:
+- PLAN_CACHE - set to 'false' to always call the model
+- PLAN_CACHE_TTL - seconds a cached plan stays valid (default 604800, one week)
+- PLAN_CACHE_SIZE - plans kept in memory per process (default 1000)
+- PLAN_CACHE_MAX_ROWS - plans kept in Postgres (default 10000)
+- PLAN_CACHE_PERSIST - set to 'false' to keep the cache in memory only
+- PLAN_CACHE_PERTURB - set to 'true' to vary cached plans per user
+"""
+
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+import threading
+import hashlib
+import random
+import copy
+import json
+import time
+import os
+
+from database import get_db_connection
+from catalog import split_terms, workout_location
+from rule_scheduler import normalize_goal, normalize_experience, days_per_week
+
+load_dotenv()
+
+
+def history_digest(previous_schedules: Optional[list]) -> str:
+    """Digest of the workout ids per day in the recent schedules ('none' without history)."""
+    weeks = []
+    for schedule in previous_schedules or []:
+        plan = schedule.get("plan_data") or {}
+        days = plan.get("workouts", []) if isinstance(plan, dict) else []
+        weeks.append(sorted((day.get("day", ""), sorted(day.get("workout_ids", []))) for day in days))
+    if not any(weeks):
+        return "none"
+    return hashlib.sha1(json.dumps(weeks).encode()).hexdigest()[:16]
+
+
+def cache_inputs(profile: dict, catalog_digest: str, previous_schedules: Optional[list]) -> dict:
+    """The normalized inputs a cached plan is valid for."""
+    return {
+        "goal": normalize_goal(profile),
+        "experience": normalize_experience(profile),
+        "location": workout_location(profile),
+        "days_per_week": days_per_week(profile),
+        "catalog": catalog_digest,
+        "history": history_digest(previous_schedules),
+    }
+
+
+def perturb_plan(plan_data: dict, workouts: list, seed: str) -> dict:
+    """
+    Swap one workout per day for an unused one of the same type sharing a muscle group.
+
+    Deterministic for a seed (user and week), so regenerating gives the same plan.
+    """
+    rng = random.Random(seed)
+    by_id = {w["id"]: w for w in workouts}
+    plan = copy.deepcopy(plan_data)
+    for day in plan.get("workouts", []):
+        ids = day["workout_ids"]
+        if not ids:
+            continue
+        index = rng.randrange(len(ids))
+        current = by_id.get(ids[index])
+        if current is None:
+            continue
+        muscles = set(split_terms(current["muscles"]))
+        similar = [
+            w["id"] for w in workouts
+            if w["id"] not in ids and w["type"] == current["type"]
+            and muscles & set(split_terms(w["muscles"]))
+        ]
+        if similar:
+            ids[index] = rng.choice(sorted(similar))
+    return plan
+
+
+class PlanCache:
+    """Memory LRU over the plan_cache table, with hit/miss counters."""
+
+    def __init__(self, ttl: float = 604800.0, max_entries: int = 1000, max_rows: int = 10000,
+                 persist: bool = True, perturb: bool = False, enabled: bool = True):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.persist = persist
+        self.perturb = perturb
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # cache_key -> (expires_at, plan_data)
+        self._stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "pruned": 0, "errors": 0}
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    @staticmethod
+    def key_for(inputs: dict) -> str:
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+    def _remember(self, cache_key: str, plan_data: dict, ttl: float):
+        with self._lock:
+            self._entries[cache_key] = (time.monotonic() + ttl, plan_data)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_memory(self, cache_key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            if time.monotonic() >= entry[0]:
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return entry[1]
+
+    def _get_db(self, cache_key: str) -> Optional[tuple[dict, float]]:
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE plan_cache
+                    SET hits = hits + 1, last_used_at = NOW()
+                    WHERE cache_key = %s AND expires_at > NOW()
+                    RETURNING plan_data, EXTRACT(EPOCH FROM (expires_at - NOW()))
+                """, (cache_key,))
+                row = cursor.fetchone()
+            conn.commit()
+        return (row[0], float(row[1])) if row else None
+
+    def get(self, inputs: dict) -> Optional[dict]:
+        """Cached plan_data for these inputs, or None."""
+        if not self.enabled:
+            return None
+        cache_key = self.key_for(inputs)
+        plan_data = self._get_memory(cache_key)
+        if plan_data is not None:
+            self._count("memory_hits")
+            return copy.deepcopy(plan_data)
+
+        if self.persist:
+            try:
+                row = self._get_db(cache_key)
+            except Exception as e:
+                # A cache outage should only cost a model call
+                print(f"Plan cache read error: {e}")
+                self._count("errors")
+                row = None
+            if row:
+                plan_data, remaining = row
+                self._remember(cache_key, plan_data, min(remaining, self.ttl))
+                self._count("db_hits")
+                return copy.deepcopy(plan_data)
+
+        self._count("misses")
+        return None
+
+    def put(self, inputs: dict, plan_data: dict):
+        if not self.enabled:
+            return
+        cache_key = self.key_for(inputs)
+        self._remember(cache_key, copy.deepcopy(plan_data), self.ttl)
+        self._count("stores")
+        if not self.persist:
+            return
+        try:
+            with get_db_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        INSERT INTO plan_cache (cache_key, inputs, plan_data, created_at, last_used_at, expires_at)
+                        VALUES (%s, %s, %s, NOW(), NOW(), NOW() + make_interval(secs => %s))
+                        ON CONFLICT (cache_key)
+                        DO UPDATE SET plan_data = EXCLUDED.plan_data, last_used_at = NOW(),
+                                      expires_at = EXCLUDED.expires_at
+                    """, (cache_key, json.dumps(inputs), json.dumps(plan_data), self.ttl))
+                conn.commit()
+            # Prune now and then rather than on every insert
+            if random.random() < 0.05:
+                self.prune()
+        except Exception as e:
+            print(f"Plan cache write error: {e}")
+            self._count("errors")
+
+    def prune(self) -> int:
+        """Delete expired rows and the least recently used ones above max_rows."""
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM plan_cache
+                    WHERE expires_at <= NOW()
+                       OR cache_key IN (
+                           SELECT cache_key FROM plan_cache
+                           ORDER BY last_used_at DESC
+                           OFFSET %s
+                       )
+                """, (self.max_rows,))
+                deleted = cursor.rowcount
+            conn.commit()
+        self._count("pruned", deleted)
+        return deleted
+
+    def clear(self):
+        """Forget in-memory plans (the table is left to expire)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+        hits = stats["memory_hits"] + stats["db_hits"]
+        lookups = hits + stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "persist": self.persist,
+            "perturb": self.perturb,
+            "ttl": self.ttl,
+            "entries": entries,
+            **stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+def create_plan_cache() -> PlanCache:
+    """Build the cache configured from PLAN_CACHE_* environment variables."""
+    return PlanCache(
+        ttl=float(os.getenv("PLAN_CACHE_TTL", "604800")),
+        max_entries=int(os.getenv("PLAN_CACHE_SIZE", "1000")),
+        max_rows=int(os.getenv("PLAN_CACHE_MAX_ROWS", "10000")),
+        persist=os.getenv("PLAN_CACHE_PERSIST", "true").lower() != "false",
+        perturb=os.getenv("PLAN_CACHE_PERTURB", "false").lower() == "true",
+        enabled=os.getenv("PLAN_CACHE", "true").lower() != "false",
+    )
+
+
+plan_cache = create_plan_cache()
@@ -0,0 +1,194 @@
+"""
+Rule-Based Schedule Generator
+Deterministic, millisecond alternative to the LLM agent
+
+Builds the same plan_data structure as SYSTEM_PROMPT in workout_agent.py
+(workouts per day, rest_days, weekly_summary) from the user's goal,
+experience, days per week and workout location. Muscle-group focus rotates
+against the user's previous schedules so consecutive weeks differ.
+
+Used by POST /ai/schedule with "mode": "fast", and as the fallback when the
+model times out or is rate-limited.
+"""
+
+from typing import Optional
+import re
+
+from catalog import split_terms, workout_location
+
+WEEK_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Training days for each days-per-week value, spread to leave recovery gaps
+DAY_PATTERNS = {
+    1: ["Monday"],
+    2: ["Monday", "Thursday"],
+    3: ["Monday", "Wednesday", "Friday"],
+    4: ["Monday", "Tuesday", "Thursday", "Friday"],
+    5: ["Monday", "Tuesday", "Wednesday", "Friday", "Saturday"],
+    6: ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"],
+    7: WEEK_DAYS,
+}
+
+FOCUS_MUSCLES = {
+    "upper": {"chest", "shoulders", "triceps", "biceps", "back"},
+    "lower": {"quadriceps", "glutes", "hamstrings", "legs"},
+    "core": {"core", "obliques"},
+    "cardio": {"cardiovascular", "full body"},
+}
+
+FOCUS_NOTES = {
+    "upper": "Focus on upper body",
+    "lower": "Focus on lower body",
+    "core": "Core stability and control",
+    "cardio": "Conditioning and full body",
+}
+
+# Day focus order per goal; the week starts wherever the rotation left off
+GOAL_ROTATIONS = {
+    "gain_muscle": ["upper", "lower", "core", "upper", "lower", "cardio"],
+    "lose_fat": ["cardio", "lower", "upper", "cardio", "core", "lower"],
+    "maintain": ["upper", "lower", "cardio", "core"],
+}
+
+GOAL_FOCUS = {
+    "gain_muscle": "strength_training",
+    "lose_fat": "fat_loss",
+    "maintain": "general_fitness",
+}
+
+# (minutes, exercises per day, intensity)
+EXPERIENCE_LEVELS = {
+    "beginner": (30, 3, "low"),
+    "intermediate": (45, 4, "moderate"),
+    "advanced": (60, 5, "high"),
+}
+
+
+def normalize_goal(profile: dict) -> str:
+    """Map the routes/user.py `goal` column or free-text `goals` to a GOAL_ROTATIONS key."""
+    goal = profile.get("goal")
+    if goal in GOAL_ROTATIONS:
+        return goal
+    text = (profile.get("goals") or "").lower()
+    if re.search(r"lose|fat|weight loss|lean|cut", text):
+        return "lose_fat"
+    if re.search(r"muscle|strength|build|gain|bulk", text):
+        return "gain_muscle"
+    return "maintain"
+
+
+def normalize_experience(profile: dict) -> str:
+    experience = (profile.get("experience_level") or profile.get("experience") or "").lower()
+    return experience if experience in EXPERIENCE_LEVELS else "beginner"
+
+
+def days_per_week(profile: dict) -> int:
+    preferences = profile.get("preferences") or {}
+    days = profile.get("days_per_week")
+    if days is None and isinstance(preferences, dict):
+        days = preferences.get("days_per_week")
+    try:
+        return min(max(int(days), 1), 7)
+    except (TypeError, ValueError):
+        return 3
+
+
+def workout_focus(workout: dict) -> set:
+    """The FOCUS_MUSCLES groups a workout trains."""
+    muscles = set(split_terms(workout["muscles"]))
+    return {focus for focus, group in FOCUS_MUSCLES.items() if muscles & group}
+
+
+def _recent_usage(previous_schedules: list, by_id: dict) -> tuple[dict, dict]:
+    """How often each workout id and each focus appeared in the previous plans."""
+    workout_counts, focus_counts = {}, {}
+    for schedule in previous_schedules or []:
+        plan = schedule.get("plan_data") or {}
+        for day in plan.get("workouts", []) if isinstance(plan, dict) else []:
+            for workout_id in day.get("workout_ids", []):
+                workout_counts[workout_id] = workout_counts.get(workout_id, 0) + 1
+                workout = by_id.get(workout_id)
+                for focus in workout_focus(workout) if workout else ():
+                    focus_counts[focus] = focus_counts.get(focus, 0) + 1
+    return workout_counts, focus_counts
+
+
+def plan_day(day: str, focus: str, workouts: list, per_day: int, minutes: int, intensity: str,
+             used_this_week: dict, workout_counts: Optional[dict] = None) -> dict:
+    """
+    One training day: the `per_day` least used workouts for `focus`.
+
+    The picks are counted in `used_this_week`, so later days prefer others.
+    """
+    workout_counts = workout_counts or {}
+    candidates = [w for w in workouts if focus in workout_focus(w)] or workouts
+    # Least used (last weeks + this week) first, then by id for determinism
+    candidates = sorted(
+        candidates,
+        key=lambda w: (used_this_week.get(w["id"], 0), workout_counts.get(w["id"], 0), w["id"]),
+    )
+    chosen = [w["id"] for w in candidates[:per_day]]
+    for workout_id in chosen:
+        used_this_week[workout_id] = used_this_week.get(workout_id, 0) + 1
+    return {
+        "day": day,
+        "workout_ids": chosen,
+        "duration_minutes": minutes,
+        "intensity": intensity,
+        "notes": FOCUS_NOTES[focus],
+    }
+
+
+def ease_back_to_back(plan_workouts: list, days: Optional[set] = None):
+    """
+    Ease hard sessions on consecutive days: the second one becomes moderate.
+
+    `plan_workouts` is in week order; only the given `days` are changed (all by default).
+    """
+    for previous, current in zip(plan_workouts, plan_workouts[1:]):
+        if days is not None and current["day"] not in days:
+            continue
+        if current["intensity"] == "high" and previous["intensity"] == "high" and \
+                WEEK_DAYS.index(current["day"]) - WEEK_DAYS.index(previous["day"]) == 1:
+            current["intensity"] = "moderate"
+
+
+def generate_rule_based_plan(profile: dict, workouts: list,
+                             previous_schedules: Optional[list] = None) -> dict:
+    """
+    Build a weekly plan_data dict without calling the model.
+
+    `workouts` is the catalog (e.g. workout_catalog.all()); `previous_schedules`
+    is the get_previous_schedules output, newest first.
+    """
+    goal = normalize_goal(profile)
+    minutes, per_day, intensity = EXPERIENCE_LEVELS[normalize_experience(profile)]
+    training_days = DAY_PATTERNS[days_per_week(profile)]
+
+    if workout_location(profile) == "home":
+        workouts = [w for w in workouts if w["type"] == "home"]
+    by_id = {w["id"]: w for w in workouts}
+    workout_counts, focus_counts = _recent_usage(previous_schedules, by_id)
+
+    # Start the rotation at the focus trained least recently
+    rotation = GOAL_ROTATIONS[goal]
+    start = min(range(len(rotation)), key=lambda i: (focus_counts.get(rotation[i], 0), i))
+
+    plan_workouts = []
+    used_this_week = {}
+    for index, day in enumerate(training_days):
+        focus = rotation[(start + index) % len(rotation)]
+        plan_workouts.append(
+            plan_day(day, focus, workouts, per_day, minutes, intensity, used_this_week, workout_counts)
+        )
+    ease_back_to_back(plan_workouts)
+
+    return {
+        "workouts": plan_workouts,
+        "rest_days": [day for day in WEEK_DAYS if day not in training_days],
+        "weekly_summary": {
+            "total_workouts": len(plan_workouts),
+            "total_duration_minutes": minutes * len(plan_workouts),
+            "primary_focus": GOAL_FOCUS[goal],
+        },
+    }
@@ -0,0 +1,257 @@
+"""
+Schedule Response Cache
+Read-through cache for GET /schedule/{user_id}
+
+The frontend polls schedules far more often than they change (at most
+weekly), so the serialized response body is cached per user and variant
+(the limit and projection asked for) together with an ETag. A matching
+If-None-Match gets a 304 without touching Postgres. Entries for a user are
+dropped by the write paths (POST /schedule, store_schedule() used by the
+agent tools and the fast scheduler, batch upserts, profile-change patches);
+SCHEDULE_CACHE_TTL bounds staleness for writes made outside this service.
+
+Each invalidation also bumps a per-user generation. Readers take the
+generation before querying and pass it to set(), which drops the body if a
+write was invalidated in between, so an old body is never cached after
+the write that replaced it.
+
+Backends:
+- 'memory' - per-process LRU (default)
+- 'redis' - shared by every API worker and the batch CLI; needs the `redis`
+  package and SCHEDULE_CACHE_REDIS_URL
+- 'off' - disable caching (ETags are still sent)
+
+Configure with environment variables:
+- SCHEDULE_CACHE_BACKEND - memory, redis or off (default memory)
+- SCHEDULE_CACHE_SIZE - entries kept by the memory backend (default 1024)
+- SCHEDULE_CACHE_TTL - seconds an entry stays valid (default 300)
+- SCHEDULE_CACHE_REDIS_URL - e.g. redis://localhost:6379/0
+"""
+
+from collections import OrderedDict
+from typing import Optional
+from dotenv import load_dotenv
+import threading
+import hashlib
+import time
+import os
+
+load_dotenv()
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """RFC 9110 weak comparison against an If-None-Match header value."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+class MemoryBackend:
+    """Thread-safe LRU of (body, etag) per user and variant."""
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (user_id, variant) -> (expires_at, body, etag)
+        self._generations = {}  # user_id -> invalidations so far
+
+    def get(self, user_id: int, variant: str) -> Optional[tuple[bytes, str]]:
+        key = (user_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, body, etag = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return body, etag
+
+    def generation(self, user_id: int) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def set(self, user_id: int, variant: str, body: bytes, etag: str, ttl: float, generation: int) -> bool:
+        key = (user_id, variant)
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return False
+            self._entries[key] = (time.monotonic() + ttl, body, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def delete_user(self, user_id: int):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+
+    def size(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class RedisBackend:
+    """
+    Shared cache for multi-worker deployments.
+
+    Each user is one Redis hash (field = variant, value = etag + body), so a
+    write invalidates every cached variant with a single DEL. The user's
+    generation is a counter next to it, INCRed with the DEL and WATCHed by set().
+    """
+
+    def __init__(self, url: str, prefix: str = "schedule-cache"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError(
+                "SCHEDULE_CACHE_BACKEND=redis needs the redis package (pip install redis)"
+            ) from e
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._watch_error = redis.WatchError
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    def _generation_key(self, user_id: int) -> str:
+        return f"{self.prefix}:generation:{user_id}"
+
+    def generation(self, user_id: int) -> int:
+        return int(self.client.get(self._generation_key(user_id)) or 0)
+
+    def get(self, user_id: int, variant: str) -> Optional[tuple[bytes, str]]:
+        value = self.client.hget(self._key(user_id), variant)
+        if value is None:
+            return None
+        etag, _, body = value.partition(b"\n")
+        return body, etag.decode()
+
+    def set(self, user_id: int, variant: str, body: bytes, etag: str, ttl: float, generation: int) -> bool:
+        key, generation_key = self._key(user_id), self._generation_key(user_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(generation_key)
+                if int(pipe.get(generation_key) or 0) != generation:
+                    return False
+                pipe.multi()
+                pipe.hset(key, variant, etag.encode() + b"\n" + body)
+                pipe.expire(key, max(int(ttl), 1))
+                pipe.execute()
+            except self._watch_error:
+                return False  # invalidated while writing
+        return True
+
+    def delete_user(self, user_id: int):
+        with self.client.pipeline() as pipe:
+            pipe.incr(self._generation_key(user_id))
+            pipe.delete(self._key(user_id))
+            pipe.execute()
+
+    def size(self) -> Optional[int]:
+        return None  # Shared keyspace; not counted per process
+
+
+class ScheduleCache:
+    """Cache front-end with hit/miss counters; `backend` is None when disabled."""
+
+    def __init__(self, backend=None, ttl: float = 300.0):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "stale_skips": 0, "errors": 0
+        }
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get(self, user_id: int, variant: str) -> Optional[tuple[bytes, str]]:
+        if self.backend is None:
+            return None
+        try:
+            entry = self.backend.get(user_id, variant)
+        except Exception as e:
+            # A cache outage should only cost a database read
+            print(f"Schedule cache read error: {e}")
+            self._count("errors")
+            entry = None
+        self._count("hits" if entry else "misses")
+        return entry
+
+    def generation(self, user_id: int) -> Optional[int]:
+        """The user's invalidation count; read it before querying and pass it to set()."""
+        if self.backend is None:
+            return None
+        try:
+            return self.backend.generation(user_id)
+        except Exception as e:
+            print(f"Schedule cache read error: {e}")
+            self._count("errors")
+            return None
+
+    def set(self, user_id: int, variant: str, body: bytes, etag: str, generation: Optional[int]):
+        """Cache a response read at `generation`; skipped if the user was invalidated since."""
+        if self.backend is None or generation is None:
+            return
+        try:
+            stored = self.backend.set(user_id, variant, body, etag, self.ttl, generation)
+        except Exception as e:
+            print(f"Schedule cache write error: {e}")
+            self._count("errors")
+            return
+        if not stored:
+            self._count("stale_skips")
+
+    def invalidate(self, *user_ids: int):
+        """Drop every cached response for these users (call after writing schedules)."""
+        if self.backend is None:
+            return
+        for user_id in user_ids:
+            try:
+                self.backend.delete_user(user_id)
+            except Exception as e:
+                print(f"Schedule cache invalidation error: {e}")
+                self._count("errors")
+            self._count("invalidations")
+
+    def record_not_modified(self):
+        self._count("not_modified")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "backend": type(self.backend).__name__ if self.backend else "off",
+            "ttl": self.ttl,
+            "entries": self.backend.size() if self.backend else 0,
+            **stats,
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+        }
+
+
+def create_schedule_cache() -> ScheduleCache:
+    """Build the cache configured from SCHEDULE_CACHE_* environment variables."""
+    backend_name = os.getenv("SCHEDULE_CACHE_BACKEND", "memory").lower()
+    ttl = float(os.getenv("SCHEDULE_CACHE_TTL", "300"))
+    if backend_name == "off":
+        return ScheduleCache(None, ttl)
+    if backend_name == "redis":
+        url = os.getenv("SCHEDULE_CACHE_REDIS_URL", "redis://localhost:6379/0")
+        return ScheduleCache(RedisBackend(url), ttl)
+    return ScheduleCache(MemoryBackend(int(os.getenv("SCHEDULE_CACHE_SIZE", "1024"))), ttl)
+
+
+schedule_cache = create_schedule_cache()
@@ -0,0 +1,104 @@
+"""
+Schedule Response Encoding
+Schedule read responses built without decoding plan_data
+
+The schedule reads used to let the jsonb codec parse every plan_data into
+dicts, copy the rows, then re-encode everything with jsonable_encoder and
+json.dumps; three passes over the largest part of the response. Instead
+plan_data is selected as text (see plan_data_sql()), so it is never
+decoded, and Postgres' JSON is spliced into the body as-is. The few other
+columns are encoded with orjson when it is installed, stdlib json otherwise.
+
+Projection happens in SQL too, on the jsonb before it becomes text:
+- fields - keep only these top-level plan keys (e.g. workouts,nutrition)
+- days - keep only these days in plan_data.workouts (e.g. Monday,Friday)
+"""
+
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+import json
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is only slower
+    orjson = None
+
+WEEKDAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    """Compact JSON bytes; dates as ISO strings like jsonable_encoder."""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+
+def parse_projection(fields: Optional[str], days: Optional[str]) -> tuple[list, list]:
+    """
+    'workouts,nutrition' / 'monday,Fri' query values -> (field names, weekdays).
+
+    Raises ValueError for a day that isn't a weekday (or unambiguous prefix of one).
+    """
+    field_names = [field.strip() for field in (fields or "").split(",") if field.strip()]
+    weekdays = []
+    for day in (days or "").split(","):
+        day = day.strip().lower()
+        if not day:
+            continue
+        matches = [weekday for weekday in WEEKDAYS if weekday.lower().startswith(day)]
+        if len(matches) != 1:
+            raise ValueError(f"Unknown day: {day}")
+        weekdays.append(matches[0])
+    return list(dict.fromkeys(field_names)), list(dict.fromkeys(weekdays))
+
+
+def plan_data_sql(fields: list, days: list, next_param: int) -> tuple[str, list]:
+    """
+    Select expression for plan_data as JSON text, projected, plus its query args.
+
+    `next_param` is the number of the first $n placeholder the expression
+    may use.
+    """
+    expression, args = "plan_data", []
+    if days:
+        expression = f"""CASE WHEN jsonb_typeof(plan_data->'workouts') = 'array'
+            THEN jsonb_set(plan_data, '{{workouts}}', COALESCE((
+                SELECT jsonb_agg(workout ORDER BY position)
+                FROM jsonb_array_elements(plan_data->'workouts') WITH ORDINALITY AS w (workout, position)
+                WHERE workout->>'day' = ANY(${next_param}::text[])
+            ), '[]'::jsonb))
+            ELSE plan_data END"""
+        args.append(days)
+        next_param += 1
+    if fields:
+        expression = f"""COALESCE((
+                SELECT jsonb_object_agg(key, value)
+                FROM jsonb_each({expression})
+                WHERE key = ANY(${next_param}::text[])
+            ), '{{}}'::jsonb)"""
+        args.append(fields)
+    return f"({expression})::text AS plan_data", args
+
+
+def encode_schedule(row) -> bytes:
+    """One schedule row (plan_data as JSON text) as a JSON object."""
+    meta = dumps({key: value for key, value in row.items() if key != "plan_data"})
+    plan_data = row["plan_data"]
+    return meta[:-1] + b',"plan_data":' + (plan_data.encode() if plan_data is not None else b"null") + b"}"
+
+
+def encode_response(head: dict, rows: list, tail: Optional[dict] = None) -> bytes:
+    """{**head, "schedules": [rows...], **tail} as bytes; `head` must not be empty."""
+    body = dumps(head)[:-1] + b',"schedules":[' + b",".join(encode_schedule(row) for row in rows) + b"]"
+    if tail:
+        body += b"," + dumps(tail)[1:-1]
+    return body + b"}"
@@ -0,0 +1,416 @@
+"""
+Schedule Patching
+Regenerates only the days of a stored schedule that a profile change invalidates
+
+Updating goal, experience_level, days_per_week or workout_location through
+POST /api/users (routes/user.py) used to leave the current and upcoming
+weeks' schedules stale until a full 10-30 s agent run replaced them.
+profile_changes() compares the old and new profile on the fields a plan is
+built from, and patch_plan() works out which days each change invalidates:
+- workout_location -> home: days with gym workouts; only those workouts are
+  swapped for home workouts training the same muscles
+- days_per_week: training days are dropped or added; the other days stay
+- experience_level: duration and intensity of each day; workouts stay
+- goal: every day's focus, so the days are re-planned
+
+The first three are mechanical and patched with the rule-based scheduler's
+helpers (rule_scheduler.py) in milliseconds, before the profile update
+returns. A goal change asks the model for just the invalidated days with a
+short prompt (workout_agent.plan_days), falling back to the rules when the
+model is unavailable or its answer is invalid. Those patches run on a small
+worker pool, at most one per user at a time: further updates for the same
+user wait and are merged into one patch, and when too many users are
+waiting the rules patch straight away instead. Days of the current week
+that are already over are never changed.
+
+Only workouts, rest_days and weekly_summary are merged into the stored
+plan_data (other keys are untouched), and only if the row's updated_at is
+unchanged, so a schedule regenerated in the meantime is not overwritten.
+
+Configure with environment variables:
+- SCHEDULE_PATCH_MODEL - 'false' to re-plan goal changes with the rules only (default true)
+- SCHEDULE_PATCH_WORKERS - goal-change patches run at once per process (default 2)
+- SCHEDULE_PATCH_MAX_PENDING - users waiting for one before the rules are used (default 100)
+"""
+
+from psycopg2.extras import Json, RealDictCursor
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Callable, Optional
+from dotenv import load_dotenv
+import threading
+import asyncio
+import copy
+import os
+
+from database import get_db_connection
+from catalog import split_terms, workout_catalog, workout_location
+from rule_scheduler import (
+    WEEK_DAYS, DAY_PATTERNS, GOAL_ROTATIONS, GOAL_FOCUS, EXPERIENCE_LEVELS,
+    normalize_goal, normalize_experience, days_per_week, workout_focus, plan_day, ease_back_to_back
+)
+from schedule_cache import schedule_cache
+from schedule_schema import InvalidPlanError, ValidationError, validate_plan
+
+load_dotenv()
+
+# Normalized profile fields a plan depends on
+PROFILE_FIELDS = {
+    "goal": normalize_goal,
+    "experience": normalize_experience,
+    "days_per_week": days_per_week,
+    "location": workout_location,
+}
+# Changes the rules patch exactly; any other change re-plans days with the model
+MECHANICAL_CHANGES = {"experience", "days_per_week", "location"}
+
+
+def profile_changes(old: dict, new: dict) -> dict:
+    """{field: (old value, new value)} for the PROFILE_FIELDS that differ."""
+    changes = {}
+    for field, normalize in PROFILE_FIELDS.items():
+        before, after = normalize(old), normalize(new)
+        if before != after:
+            changes[field] = (before, after)
+    return changes
+
+
+def needs_model(changes: dict) -> bool:
+    return any(field not in MECHANICAL_CHANGES for field in changes)
+
+
+def _swap_for_home(day: dict, catalog_by_id: dict, home_workouts: list, used: dict) -> bool:
+    """Replace the day's non-home workouts with unused home ones sharing a muscle group."""
+    home_ids = {w["id"] for w in home_workouts}
+    ids = day["workout_ids"]
+    swapped = False
+    for index, workout_id in enumerate(ids):
+        if workout_id in home_ids:
+            continue
+        current = catalog_by_id.get(workout_id)
+        muscles = set(split_terms(current["muscles"])) if current else set()
+        candidates = [w for w in home_workouts if w["id"] not in ids]
+        similar = [w for w in candidates if muscles & set(split_terms(w["muscles"]))] or candidates
+        if not similar:
+            continue
+        replacement = min(similar, key=lambda w: (used.get(w["id"], 0), w["id"]))
+        used[workout_id] = used.get(workout_id, 0) - 1
+        used[replacement["id"]] = used.get(replacement["id"], 0) + 1
+        ids[index] = replacement["id"]
+        swapped = True
+    return swapped
+
+
+def patch_plan(plan: dict, profile: dict, changes: dict, workouts: list,
+               frozen: frozenset = frozenset(), replan: Optional[Callable] = None) -> tuple[dict, dict]:
+    """
+    Apply `changes` (profile_changes output) to plan_data for the new `profile`.
+
+    `workouts` is the catalog and `frozen` the days that must not change.
+    Days to re-plan are passed to `replan(profile, slots, kept, workouts)`,
+    which returns the new day dicts or None to use the rules. Returns the
+    patched plan and {day: [reasons]} for every day added, removed or changed.
+    """
+    plan = copy.deepcopy(plan)
+    goal = normalize_goal(profile)
+    minutes, per_day, intensity = EXPERIENCE_LEVELS[normalize_experience(profile)]
+    catalog_by_id = {w["id"]: w for w in workouts}
+    if workout_location(profile) == "home":
+        workouts = [w for w in workouts if w["type"] == "home"]
+
+    days = {day["day"]: day for day in plan.get("workouts", []) if day.get("day") in WEEK_DAYS}
+    used = {}
+    for day in days.values():
+        for workout_id in day["workout_ids"]:
+            used[workout_id] = used.get(workout_id, 0) + 1
+    changed = {}
+
+    def mark(day: str, reason: str):
+        changed.setdefault(day, []).append(reason)
+
+    if "days_per_week" in changes:
+        pattern = DAY_PATTERNS[days_per_week(profile)]
+        # Drop days off the standard pattern first, latest first
+        for day in sorted((d for d in days if d not in frozen), key=lambda d: (d in pattern, -WEEK_DAYS.index(d))):
+            if len(days) <= len(pattern):
+                break
+            for workout_id in days.pop(day)["workout_ids"]:
+                used[workout_id] -= 1
+            mark(day, "removed")
+
+        def training_neighbours(day: str) -> int:
+            index = WEEK_DAYS.index(day)
+            return sum(WEEK_DAYS[i] in days for i in (index - 1, index + 1) if 0 <= i < len(WEEK_DAYS))
+
+        # Add the pattern's days first, then the days with the fewest training neighbours
+        rest = [d for d in WEEK_DAYS if d not in days and d not in frozen]
+        while len(days) < len(pattern) and rest:
+            day = min(rest, key=lambda d: (d not in pattern, training_neighbours(d), WEEK_DAYS.index(d)))
+            rest.remove(day)
+            days[day] = None
+            mark(day, "added")
+
+    if "goal" in changes:
+        for day in days:
+            if day not in frozen and day not in changed:
+                mark(day, "goal")
+
+    if "location" in changes and workout_location(profile) == "home":
+        for name, day in days.items():
+            if day is not None and name not in frozen and "goal" not in changed.get(name, ()):
+                if _swap_for_home(day, catalog_by_id, workouts, used):
+                    mark(name, "location")
+
+    if "experience" in changes:
+        for name, day in days.items():
+            if day is not None and name not in frozen and "goal" not in changed.get(name, ()):
+                day["duration_minutes"], day["intensity"] = minutes, intensity
+                mark(name, "experience")
+
+    # Days to (re-)plan get the focus their goal trains least among the kept days
+    replanned = [d for d in WEEK_DAYS if d in days and ("added" in changed.get(d, ()) or "goal" in changed.get(d, ()))]
+    kept = [days[d] for d in WEEK_DAYS if d in days and d not in replanned]
+    if replanned:
+        rotation = GOAL_ROTATIONS[goal]
+        focus_counts = {}
+        for day in kept:
+            for workout_id in day["workout_ids"]:
+                for focus in workout_focus(catalog_by_id[workout_id]) if workout_id in catalog_by_id else ():
+                    focus_counts[focus] = focus_counts.get(focus, 0) + 1
+        slots = []
+        for day in replanned:
+            focus = min(rotation, key=lambda f: (focus_counts.get(f, 0), rotation.index(f)))
+            focus_counts[focus] = focus_counts.get(focus, 0) + per_day
+            slots.append({"day": day, "focus": focus, "duration_minutes": minutes, "intensity": intensity})
+
+        new_days = replan(profile, slots, kept, workouts) if replan is not None else None
+        if new_days is None:
+            new_days = [
+                plan_day(slot["day"], slot["focus"], workouts, per_day, minutes, intensity, used)
+                for slot in slots
+            ]
+        for day in new_days:
+            days[day["day"]] = day
+
+    plan_workouts = [days[d] for d in WEEK_DAYS if d in days]
+    ease_back_to_back(plan_workouts, {d for d in changed if d in days})
+    summary = plan.get("weekly_summary") or {}
+    plan["workouts"] = plan_workouts
+    plan["rest_days"] = [d for d in WEEK_DAYS if d not in days]
+    plan["weekly_summary"] = {
+        **summary,
+        "total_workouts": len(plan_workouts),
+        "total_duration_minutes": sum(day["duration_minutes"] for day in plan_workouts),
+        "primary_focus": GOAL_FOCUS[goal] if "goal" in changes or not summary.get("primary_focus")
+        else summary["primary_focus"],
+    }
+    return plan, changed
+
+
+class SchedulePatcher:
+    """Patches a user's current and upcoming schedules after a profile update."""
+
+    def __init__(self, use_model: bool = True, workers: int = 2, max_pending: int = 100):
+        self.use_model = use_model
+        self.workers = workers
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = {}  # user_id -> (old_profile, new_profile) not started yet
+        self._running = set()  # user_ids with a patch on the pool
+        self._stats = {
+            "profile_updates": 0,
+            "schedules_patched": 0,
+            "days_changed": 0,
+            "model_replans": 0,
+            "model_fallbacks": 0,
+            "coalesced": 0,
+            "overflow": 0,
+            "conflicts": 0,
+            "errors": 0,
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _replan_with_model(self, profile: dict, slots: list, kept: list, workouts: list) -> Optional[list]:
+        from agent_loader import load_agent  # the agent stack is only imported when a goal changes
+
+        agent = load_agent()
+        try:
+            days = agent.plan_days(profile, slots, kept, workouts)
+        except (*agent.LLM_UNAVAILABLE_ERRORS, InvalidPlanError) as e:
+            print(f"Model unavailable or invalid for schedule patch, using rules: {e}")
+            self._count("model_fallbacks")
+            return None
+        self._count("model_replans")
+        return days
+
+    def _load_schedules(self, user_id: int) -> list:
+        """This week's and later schedules for the user."""
+        with get_db_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute("""
+                    SELECT id, week_start_date, plan_data, updated_at
+                    FROM schedules
+                    WHERE user_id = %s AND week_start_date >= date_trunc('week', CURRENT_DATE)::date
+                    ORDER BY week_start_date
+                """, (user_id,))
+                return cursor.fetchall()
+
+    def _save(self, row: dict, plan: dict) -> bool:
+        """Merge the patched keys into plan_data unless the row changed since it was read."""
+        patch = {key: plan[key] for key in ("workouts", "rest_days", "weekly_summary")}
+        with get_db_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE schedules
+                    SET plan_data = plan_data || %s::jsonb, updated_at = NOW()
+                    WHERE id = %s AND updated_at = %s
+                """, (Json(patch), row["id"], row["updated_at"]))
+                saved = cursor.rowcount == 1
+            conn.commit()
+        return saved
+
+    def patch(self, user_id: int, old_profile: dict, new_profile: dict, model: Optional[bool] = None) -> dict:
+        """
+        Patch the user's schedules for the change from old_profile to new_profile.
+
+        The model re-plans goal changes when `model` (default: use_model)
+        allows it. Returns the changes and, per patched week, {day: [reasons]}.
+        """
+        changes = profile_changes(old_profile, new_profile)
+        result = {"changes": changes, "schedules": []}
+        if not changes:
+            return result
+        self._count("profile_updates")
+        use_model = self.use_model if model is None else model
+        replan = self._replan_with_model if use_model and needs_model(changes) else None
+
+        today = date.today()
+        workouts = workout_catalog.all()
+        for row in self._load_schedules(user_id):
+            plan = row["plan_data"]
+            if not isinstance(plan, dict):
+                continue
+            elapsed = (today - row["week_start_date"]).days
+            frozen = frozenset(WEEK_DAYS[:max(min(elapsed, len(WEEK_DAYS)), 0)])
+            plan, changed = patch_plan(plan, new_profile, changes, workouts, frozen, replan)
+            if not changed:
+                continue
+            try:
+                validate_plan(plan)
+            except ValidationError as e:
+                print(f"Patched schedule {row['id']} is invalid, left as it was: {e}")
+                self._count("errors")
+                continue
+            if not self._save(row, plan):
+                self._count("conflicts")
+                continue
+            self._count("schedules_patched")
+            self._count("days_changed", len(changed))
+            result["schedules"].append({
+                "week_start_date": row["week_start_date"].isoformat(),
+                "days": changed,
+            })
+
+        if result["schedules"]:
+            schedule_cache.invalidate(user_id)
+        return result
+
+    def _run_user(self, user_id: int):
+        """Pool task: patch the user's pending change, then any that arrived meanwhile."""
+        while True:
+            with self._lock:
+                profiles = self._pending.pop(user_id, None)
+                if profiles is None:
+                    self._running.discard(user_id)
+                    return
+            try:
+                self.patch(user_id, *profiles)
+            except Exception as e:
+                print(f"Schedule patch error for user {user_id}: {e}")
+                self._count("errors")
+
+    def _enqueue(self, user_id: int, old_profile: dict, new_profile: dict) -> bool:
+        """
+        Queue a model patch; False when max_pending users are already waiting.
+
+        A change for a user who is already waiting is merged into theirs
+        (their stored schedules still match the first old profile).
+        """
+        with self._lock:
+            waiting = self._pending.get(user_id)
+            if waiting is not None:
+                self._pending[user_id] = (waiting[0], new_profile)
+                self._stats["coalesced"] += 1
+                return True
+            if len(self._pending) >= self.max_pending:
+                return False
+            self._pending[user_id] = (old_profile, new_profile)
+            if user_id in self._running:
+                return True  # picked up by the running task when it finishes
+            self._running.add(user_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="schedule-patch")
+            executor = self._executor
+        executor.submit(self._run_user, user_id)
+        return True
+
+    def stop(self, timeout: Optional[float] = None):
+        """Drop patches not started yet and stop the pool; running ones finish in the background."""
+        with self._lock:
+            self._pending.clear()
+            self._running.clear()
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def apply(self, user_id: int, old_profile: dict, new_profile: dict) -> Optional[dict]:
+        """
+        Patch schedules after a profile update (routes/user.py); None if nothing relevant changed.
+
+        Mechanical changes are patched before returning. Changes that need
+        the model are queued for the worker pool and reported as "status":
+        "regenerating"; if the pool is backed up they are patched with the
+        rules before returning instead.
+        """
+        changes = profile_changes(old_profile, new_profile)
+        if not changes:
+            return None
+        model = self.use_model and needs_model(changes)
+        if model:
+            if self._enqueue(user_id, old_profile, new_profile):
+                return {"status": "regenerating", "changes": changes}
+            self._count("overflow")
+            model = False
+        try:
+            result = await asyncio.to_thread(self.patch, user_id, old_profile, new_profile, model)
+        except Exception as e:
+            # The profile is saved either way; the schedule is regenerated next week
+            print(f"Schedule patch error for user {user_id}: {e}")
+            self._count("errors")
+            return {"status": "failed", "changes": changes, "error": str(e)}
+        return {"status": "patched", **result}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "use_model": self.use_model,
+                "workers": self.workers,
+                "pending": len(self._pending),
+                "running": len(self._running),
+                **self._stats,
+            }
+
+
+def create_schedule_patcher() -> SchedulePatcher:
+    return SchedulePatcher(
+        use_model=os.getenv("SCHEDULE_PATCH_MODEL", "true").lower() != "false",
+        workers=int(os.getenv("SCHEDULE_PATCH_WORKERS", "2")),
+        max_pending=int(os.getenv("SCHEDULE_PATCH_MAX_PENDING", "100")),
+    )
+
+
+schedule_patcher = create_schedule_patcher()
@@ -0,0 +1,140 @@
+"""
+Schedule Output Schema
+Typed plan_data models for the agent's structured output
+
+WeeklyPlan mirrors the JSON structure in SYSTEM_PROMPT (and the schedules
+.plan_data column). The model is asked for it through structured output,
+so replies arrive as validated objects instead of free text. validate_plan()
+also checks workout_ids against the workouts the model was offered.
+
+plan_output_stats counts how often the first reply is invalid and how often
+the single repair pass fixes it (GET /ai/schedule/stats).
+"""
+
+from pydantic import BaseModel, Field, ValidationError, ValidationInfo, field_validator, model_validator
+from datetime import datetime, timedelta
+from typing import Literal, Optional
+import threading
+
+Weekday = Literal["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+class InvalidPlanError(Exception):
+    """Raised when the model's schedule is still invalid after the repair pass."""
+
+
+class ScheduleDay(BaseModel):
+    """One training day."""
+
+    day: Weekday
+    workout_ids: list[int] = Field(min_length=1, description="Ids from the Workouts list")
+    duration_minutes: int = Field(gt=0, le=240)
+    intensity: Literal["low", "moderate", "high"]
+    notes: str = ""
+
+    @field_validator("workout_ids")
+    @classmethod
+    def known_workouts(cls, workout_ids: list[int], info: ValidationInfo) -> list[int]:
+        allowed = (info.context or {}).get("workout_ids")
+        if allowed is not None:
+            unknown = [workout_id for workout_id in workout_ids if workout_id not in allowed]
+            if unknown:
+                raise ValueError(f"unknown workout ids {unknown}; use ids from the Workouts list")
+        return workout_ids
+
+
+class WeeklySummary(BaseModel):
+    total_workouts: int = Field(ge=0)
+    total_duration_minutes: int = Field(ge=0)
+    primary_focus: str
+
+
+class WeeklyPlan(BaseModel):
+    """A personalized weekly workout schedule."""
+
+    workouts: list[ScheduleDay]
+    rest_days: list[Weekday] = []
+    weekly_summary: WeeklySummary
+
+    @model_validator(mode="after")
+    def consistent_days(self) -> "WeeklyPlan":
+        days = [workout.day for workout in self.workouts]
+        repeated = sorted({day for day in days if days.count(day) > 1})
+        if repeated:
+            raise ValueError(f"days scheduled more than once: {repeated}")
+        overlap = sorted(set(days) & set(self.rest_days))
+        if overlap:
+            raise ValueError(f"rest days that also have workouts: {overlap}")
+        return self
+
+
+class PlanDays(BaseModel):
+    """Replacement days for part of an existing schedule (schedule_patch.py)."""
+
+    workouts: list[ScheduleDay]
+
+    @model_validator(mode="after")
+    def distinct_days(self) -> "PlanDays":
+        days = [workout.day for workout in self.workouts]
+        repeated = sorted({day for day in days if days.count(day) > 1})
+        if repeated:
+            raise ValueError(f"days returned more than once: {repeated}")
+        return self
+
+
+def validate_plan(plan_data, workout_ids: Optional[set] = None) -> WeeklyPlan:
+    """
+    Validate a plan_data dict (or JSON text); raises pydantic.ValidationError.
+
+    When workout_ids is given, every scheduled id must be in it.
+    """
+    context = {"workout_ids": workout_ids}
+    if isinstance(plan_data, str):
+        return WeeklyPlan.model_validate_json(plan_data, context=context)
+    if isinstance(plan_data, BaseModel):
+        plan_data = plan_data.model_dump()
+    return WeeklyPlan.model_validate(plan_data, context=context)
+
+
+def next_week_start() -> str:
+    """Next Monday as YYYY-MM-DD (today's date never counts, even on a Monday)."""
+    today = datetime.now()
+    days_ahead = 0 - today.weekday()
+    if days_ahead <= 0:
+        days_ahead += 7
+    return (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
+
+
+def describe_errors(error: ValidationError) -> str:
+    """Short, model-readable list of what is wrong with a plan."""
+    problems = []
+    for item in error.errors():
+        location = ".".join(str(part) for part in item["loc"]) or "plan"
+        problems.append(f"{location}: {item['msg']}")
+    return "; ".join(problems)
+
+
+class PlanOutputStats:
+    """Process-wide counters for structured schedule output."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "parse_failures": 0, "repairs": 0, "repaired": 0, "failed": 0}
+
+    def count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        requests = stats["requests"]
+        return {
+            **stats,
+            "parse_failure_rate": stats["parse_failures"] / requests if requests else 0.0,
+            "retry_rate": stats["repairs"] / requests if requests else 0.0,
+            "repair_success_rate": stats["repaired"] / stats["repairs"] if stats["repairs"] else 0.0,
+        }
+
+
+plan_output_stats = PlanOutputStats()
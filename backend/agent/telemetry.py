@@ -0,0 +1,353 @@
+"""
+Agent Pipeline Telemetry
+Per-stage latency histograms (Prometheus) and optional OpenTelemetry spans
+
+Where the time goes in a schedule request: pool checkout, each tool call
+(connection time included), each model call (with tokens, prompt-cache
+reads and writes included), the plan cache,
+the save, the agent turns per request, and time spent waiting for the LLM
+governor (llm_governor.py). Histograms are kept in-process and rendered in
+the Prometheus text format by GET /metrics; there is no client library
+dependency.
+
+OpenTelemetry is optional. With the opentelemetry-api package installed,
+every stage also becomes a span under one root span per request. Spans are
+exported when OTEL_EXPORTER_OTLP_ENDPOINT is set and opentelemetry-sdk plus
+opentelemetry-exporter-otlp are installed; otherwise they are no-ops.
+
+Configure with environment variables:
+- OTEL_EXPORTER_OTLP_ENDPOINT - e.g. http://localhost:4318 to export spans
+- OTEL_SERVICE_NAME - service name on exported spans (default workout-agent)
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator, Optional
+from dotenv import load_dotenv
+import threading
+import time
+import os
+
+load_dotenv()
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+# Seconds; covers pool checkouts (ms) up to slow model calls (tens of seconds)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+TURN_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 15)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, Prometheus style."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': bound})} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {values[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {values[-1]}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+# ===== Metrics =====
+
+DB_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds", "Time to get a connection from the pool.", ("pool",)
+)
+TOOL_SECONDS = Histogram(
+    "agent_tool_seconds", "Agent tool call duration, including connection checkout.", ("tool", "outcome")
+)
+MODEL_CALL_SECONDS = Histogram(
+    "agent_model_call_seconds", "Duration of one model call.", ("kind",)
+)
+MODEL_TOKENS = Counter(
+    "agent_model_tokens_total", "Tokens used by model calls.", ("kind", "direction")
+)
+STAGE_SECONDS = Histogram(
+    "agent_stage_seconds", "Duration of a schedule generation stage.", ("stage",)
+)
+AGENT_TURNS = Histogram(
+    "agent_turns", "Model turns per generated schedule.", ("flow",), buckets=TURN_BUCKETS
+)
+GENERATION_SECONDS = Histogram(
+    "schedule_generation_seconds", "End-to-end schedule generation time.", ("mode", "outcome")
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_seconds", "API request duration.", ("method", "route", "status")
+)
+LLM_WAIT_SECONDS = Histogram(
+    "llm_governor_wait_seconds", "Time a model call waited for the LLM governor.", ("lane", "outcome")
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_governor_queue_depth", "Model calls waiting for the LLM governor.", ("lane",)
+)
+LLM_REJECTED = Counter(
+    "llm_governor_rejected_total", "Model calls refused by the LLM governor.", ("lane", "reason")
+)
+LLM_CIRCUIT_OPEN = Gauge(
+    "llm_governor_circuit_open", "1 while the model circuit breaker is open or half-open."
+)
+
+REGISTRY = [
+    HTTP_REQUEST_SECONDS,
+    GENERATION_SECONDS,
+    STAGE_SECONDS,
+    TOOL_SECONDS,
+    MODEL_CALL_SECONDS,
+    MODEL_TOKENS,
+    AGENT_TURNS,
+    DB_CHECKOUT_SECONDS,
+    LLM_WAIT_SECONDS,
+    LLM_QUEUE_DEPTH,
+    LLM_REJECTED,
+    LLM_CIRCUIT_OPEN,
+]
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ===== Tracing =====
+
+_tracer = None
+
+
+def configure_tracing():
+    """Set up OTLP span export if OTEL_EXPORTER_OTLP_ENDPOINT is set; safe to call twice."""
+    global _tracer
+    if otel_trace is None:
+        return
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") and not _tracer:
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            print("OTEL_EXPORTER_OTLP_ENDPOINT is set but opentelemetry-sdk / "
+                  "opentelemetry-exporter-otlp are not installed; spans are not exported")
+        else:
+            provider = TracerProvider(resource=Resource.create({
+                "service.name": os.getenv("OTEL_SERVICE_NAME", "workout-agent"),
+            }))
+            provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+            otel_trace.set_tracer_provider(provider)
+    _tracer = otel_trace.get_tracer("workout-agent")
+
+
+def _start_span(name: str, parent=None, attributes: Optional[dict] = None,
+                start_time: Optional[int] = None):
+    if otel_trace is None:
+        return None
+    tracer = _tracer or otel_trace.get_tracer("workout-agent")
+    context = otel_trace.set_span_in_context(parent) if parent is not None else None
+    return tracer.start_span(name, context=context, attributes=attributes or {}, start_time=start_time)
+
+
+class RequestTrace:
+    """
+    Timings for one schedule request, plus its root span.
+
+    Spans are parented explicitly rather than through the current context,
+    so stages can stay open across generator yields (SSE streaming). Code
+    that has no trace to hand (agent tools) finds it through _active_trace
+    while the request runs it under traced().
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.timings = {}
+        self._started = time.perf_counter()
+        self._root = _start_span(name, attributes=attributes)
+
+    def record(self, stage: str, seconds: float, histogram: Histogram = STAGE_SECONDS,
+               labels: Optional[dict] = None, **attributes):
+        """Add a finished stage: per-request timing, histogram and span."""
+        self.timings[stage] = round(self.timings.get(stage, 0) + seconds * 1000, 1)
+        histogram.observe(seconds, **(labels or {"stage": stage}))
+        # The work already happened; backdate the span's start
+        end = time.time_ns()
+        span = _start_span(stage, self._root, attributes, start_time=end - int(seconds * 1e9))
+        if span is not None:
+            span.end(end_time=end)
+
+    @contextmanager
+    def stage(self, stage: str, histogram: Histogram = STAGE_SECONDS,
+              labels: Optional[dict] = None, **attributes):
+        started = time.perf_counter()
+        span = _start_span(stage, self._root, attributes)
+        try:
+            yield span
+        finally:
+            seconds = time.perf_counter() - started
+            self.timings[stage] = round(self.timings.get(stage, 0) + seconds * 1000, 1)
+            histogram.observe(seconds, **(labels or {"stage": stage}))
+            if span is not None:
+                span.end()
+
+    def traced(self, iterable: Iterable) -> Iterator:
+        """
+        Iterate with this trace active, so tool spans (timed_tool) opened while
+        producing each item are children of the root span.
+
+        The trace is set around each next() rather than once: a streaming
+        generator can be resumed in a different context (Starlette steps it in
+        a worker thread), and tool threads copy the context they start from.
+        """
+        iterator = iter(iterable)
+        while True:
+            token = _active_trace.set(self)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _active_trace.reset(token)
+            yield item
+
+    def finish(self, mode: str, outcome: str) -> dict:
+        """Close the request; returns stage timings in ms, including "total"."""
+        seconds = time.perf_counter() - self._started
+        GENERATION_SECONDS.observe(seconds, mode=mode, outcome=outcome)
+        self.timings["total"] = round(seconds * 1000, 1)
+        if self._root is not None:
+            self._root.set_attribute("outcome", outcome)
+            self._root.end()
+        return dict(self.timings)
+
+
+# The request whose agent is running (RequestTrace.traced); tool threads inherit it
+_active_trace: ContextVar[Optional[RequestTrace]] = ContextVar("active_request_trace", default=None)
+
+
+@contextmanager
+def timed_tool(name: str):
+    """
+    Time an agent tool call (histogram and span); works inside any thread.
+
+    The span is a child of the active request's root span, if there is one.
+    """
+    started = time.perf_counter()
+    trace = _active_trace.get()
+    span = _start_span(f"tool {name}", trace._root if trace is not None else None)
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        TOOL_SECONDS.observe(time.perf_counter() - started, tool=name, outcome=outcome)
+        if span is not None:
+            span.set_attribute("outcome", outcome)
+            span.end()
+
+
+def record_model_call(kind: str, seconds: float, usage: Optional[dict], trace: Optional[RequestTrace] = None):
+    """
+    Observe one model call and its token usage (usage_metadata of the AI message).
+
+    Prompt-cache reads and writes are part of the input tokens and are also
+    counted on their own, as the cache_read and cache_creation directions.
+    """
+    usage = usage or {}
+    cache = usage.get("input_token_details") or {}
+    MODEL_TOKENS.inc(usage.get("input_tokens", 0), kind=kind, direction="input")
+    MODEL_TOKENS.inc(usage.get("output_tokens", 0), kind=kind, direction="output")
+    MODEL_TOKENS.inc(cache.get("cache_read", 0), kind=kind, direction="cache_read")
+    MODEL_TOKENS.inc(cache.get("cache_creation", 0), kind=kind, direction="cache_creation")
+    if trace is not None:
+        trace.record(f"model_{kind}", seconds, MODEL_CALL_SECONDS, {"kind": kind},
+                     input_tokens=usage.get("input_tokens", 0),
+                     output_tokens=usage.get("output_tokens", 0),
+                     cache_read_tokens=cache.get("cache_read", 0),
+                     cache_creation_tokens=cache.get("cache_creation", 0))
+    else:
+        MODEL_CALL_SECONDS.observe(seconds, kind=kind)
@@ -58,6 +58,7 @@ try:
         print(f"   ✅ Schedule generated successfully!")
         print(f"      Week starting: {result.get('week_start_date')}")
         print(f"      Schedule preview: {str(result.get('schedule'))[:200]}...")
+        print(f"      Agent usage: {result.get('agent_usage')}")
     else:
         print(f"   ❌ Failed: {result.get('error')}")
 except Exception as e:
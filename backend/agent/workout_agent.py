@@ -1,31 +1,53 @@
 """
 Workout Schedule Generator Agent
 LangChain agent with PostgreSQL database tools
+
+Imports LangChain and the Anthropic SDK; api.py and batch.py load this
+module through agent_loader.py on first use.
+
+Prompts put what is the same for every user first (tool schemas, then
+SYSTEM_PROMPT and a snapshot of the workout catalog tagged with its digest)
+and mark the end of it for Anthropic prompt caching, so repeat calls read
+that prefix from the provider's cache. Everything about the user comes
+after the cache breakpoint. The snapshot is only sent when that prefix is
+long enough for Anthropic to cache it and short enough that reading it
+from the cache costs less than the per-user shortlist it replaces; otherwise
+the prompt carries just the shortlist (see bench_prompt_cache.py).
+
+Configure with environment variables:
+- AGENT_PROMPT_CACHE - set to 'false' to send the per-user shortlist prompt without cache breakpoints
+- AGENT_PROMPT_CACHE_TTL - provider cache lifetime, '5m' (default) or '1h'
+- AGENT_PROMPT_CACHE_MIN_TOKENS - provider minimum for a cached prefix (default 1024, Sonnet)
+- AGENT_PROMPT_CACHE_MAX_TOKENS - largest cached prefix worth sending (default 2000)
 """
 
 from langchain.tools import tool
 from langchain.agents import create_agent
-from langchain.messages import HumanMessage
+from langchain.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages import message_chunk_to_message
 from langchain_anthropic import ChatAnthropic
-import psycopg2
+from langchain_anthropic.middleware import AnthropicPromptCachingMiddleware
 from psycopg2.extras import RealDictCursor
+import anthropic
+import threading
 import json
-from datetime import datetime, timedelta
-from dotenv import load_dotenv
+import time
 import os
+from dotenv import load_dotenv
 
-load_dotenv()
+from database import get_db_connection
+from catalog import workout_catalog, compact_catalog, select_relevant_workouts, catalog_digest, workout_location
+from rule_scheduler import generate_rule_based_plan
+from plan_cache import plan_cache, cache_inputs, perturb_plan
+from schedule_cache import schedule_cache
+from llm_governor import llm_governor, CircuitOpenError, GovernorTimeoutError
+from telemetry import RequestTrace, AGENT_TURNS, timed_tool, record_model_call
+from schedule_schema import (
+    WeeklyPlan, PlanDays, InvalidPlanError, ValidationError, validate_plan, describe_errors, plan_output_stats,
+    next_week_start
+)
 
-# Database connection helper
-def get_db_connection():
-    """Create PostgreSQL database connection"""
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        port=int(os.getenv("DB_PORT")),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        database=os.getenv("DB_NAME")
-    )
+load_dotenv()
 
 
 SYSTEM_PROMPT = """You are a Workout Planning Agent that creates personalized weekly workout schedules.
@@ -34,11 +56,11 @@ You have access to tools to:
 1. Fetch user profiles (age, weight, goals, experience level, preferences)
 2. Get available workouts from the database (exercises for home/gym)
 3. Check user's previous schedules to ensure variety
-4. Save generated schedules to the database
 
 Create balanced weekly schedules based on user's fitness goals, experience level, and available equipment.
+Only use workout ids that appear in the available workouts.
 
-Return schedules in this JSON structure:
+Return schedules through the WeeklyPlan output, in this structure:
 {
   "workouts": [
     {
@@ -62,174 +84,781 @@ Return schedules in this JSON structure:
 @tool
 def get_user_profile(user_id: int) -> dict:
     """Fetch user's fitness profile from database."""
-    conn = get_db_connection()
-    cursor = None
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
-            SELECT id, name, age, height, weight, goals, experience, preferences
-            FROM users 
-            WHERE id = %s AND deleted_at IS NULL
-        """, (user_id,))
-        result = cursor.fetchone()
-        return dict(result) if result else {"error": "User not found"}
+        with timed_tool("get_user_profile"):
+            with get_db_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT id, name, age, height, weight, goals, experience, preferences
+                        FROM users 
+                        WHERE id = %s AND deleted_at IS NULL
+                    """, (user_id,))
+                    result = cursor.fetchone()
+            return dict(result) if result else {"error": "User not found"}
     except Exception as e:
         return {"error": str(e)}
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
 
 
 @tool
 def get_available_workouts(workout_type: str = "") -> list:
     """Get list of available workouts. Filter by 'home' or 'gym' if specified."""
-    conn = get_db_connection()
-    cursor = None
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        if workout_type and workout_type in ['home', 'gym']:
-            cursor.execute("""
-                SELECT id, name, type, equipment, muscles, instructions
-                FROM workouts
-                WHERE type = %s
-                ORDER BY name
-            """, (workout_type,))
-        else:
-            cursor.execute("""
-                SELECT id, name, type, equipment, muscles, instructions
-                FROM workouts
-                ORDER BY name
-            """)
-        results = cursor.fetchall()
-        return [dict(row) for row in results]
+        with timed_tool("get_available_workouts"):
+            # Served from the in-memory catalog cache (see catalog.py)
+            if workout_type and workout_type in ['home', 'gym']:
+                workouts = workout_catalog.filter(workout_type=workout_type)
+            else:
+                workouts = workout_catalog.all()
+            # Instructions are for the app, not for planning; leave them out of the prompt
+            return [
+                {key: w[key] for key in ("id", "name", "type", "equipment", "muscles")}
+                for w in workouts
+            ]
     except Exception as e:
         print(f"Error fetching workouts: {e}")
         return []
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
 
 
 @tool
 def get_previous_schedules(user_id: int, limit: int = 4) -> list:
     """Get user's previous workout schedules for context."""
-    conn = get_db_connection()
-    cursor = None
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("""
-            SELECT week_start_date, plan_data, created_at
-            FROM schedules
-            WHERE user_id = %s
-            ORDER BY week_start_date DESC
-            LIMIT %s
-        """, (user_id, limit))
-        results = cursor.fetchall()
-        return [dict(row) for row in results]
+        with timed_tool("get_previous_schedules"):
+            with get_db_connection() as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT week_start_date, plan_data, created_at
+                        FROM schedules
+                        WHERE user_id = %s
+                        ORDER BY week_start_date DESC
+                        LIMIT %s
+                    """, (user_id, limit))
+                    results = cursor.fetchall()
+            return [dict(row) for row in results]
     except Exception as e:
         print(f"Error fetching schedules: {e}")
         return []
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
 
 
-@tool
-def save_workout_schedule(user_id: int, week_start_date: str, plan_data: str) -> str:
-    """Save generated workout schedule to database."""
-    conn = get_db_connection()
-    cursor = None
-    try:
-        cursor = conn.cursor()
-        
-        # Convert to JSON if it's a dict
-        if isinstance(plan_data, dict):
-            plan_data = json.dumps(plan_data)
-        
-        cursor.execute("""
-            INSERT INTO schedules (user_id, week_start_date, plan_data, created_at, updated_at)
-            VALUES (%s, %s, %s, NOW(), NOW())
-            ON CONFLICT (user_id, week_start_date)
-            DO UPDATE SET plan_data = EXCLUDED.plan_data, updated_at = NOW()
-            RETURNING id
-        """, (user_id, week_start_date, plan_data))
-        
-        result = cursor.fetchone()
-        schedule_id = result[0] if result else None
+def store_schedule(user_id: int, week_start_date: str, plan_data) -> int | None:
+    """Upsert a schedule row and return its id. plan_data may be a dict or JSON text."""
+    # Convert to JSON if it's a dict
+    if isinstance(plan_data, dict):
+        plan_data = json.dumps(plan_data)
+    
+    # Uncommitted work is rolled back when the connection returns to the pool
+    with get_db_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO schedules (user_id, week_start_date, plan_data, created_at, updated_at)
+                VALUES (%s, %s, %s, NOW(), NOW())
+                ON CONFLICT (user_id, week_start_date)
+                DO UPDATE SET plan_data = EXCLUDED.plan_data, updated_at = NOW()
+                RETURNING id
+            """, (user_id, week_start_date, plan_data))
+            result = cursor.fetchone()
         conn.commit()
-        return f"Schedule saved successfully with ID: {schedule_id}"
-    except Exception as e:
-        conn.rollback()
-        return f"Error saving schedule: {str(e)}"
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
-
-
-# Create the agent
-Workout_Planner_agent = create_agent(
-    model=ChatAnthropic(model="claude-sonnet-4-20250514", max_tokens=2048),  # type: ignore
-    system_prompt=SYSTEM_PROMPT,
-    tools=[
-        get_user_profile,
-        get_available_workouts,
-        get_previous_schedules,
-        save_workout_schedule
-    ],
+    schedule_cache.invalidate(user_id)
+    return result[0] if result else None
+
+
+def fetch_agent_context(user_id: int, previous_limit: int = 4) -> dict:
+    """
+    Fetch everything the agent needs about a user in one database round-trip.
+
+    Returns the same data as get_user_profile, get_available_workouts and
+    get_previous_schedules. Profile and history are built as JSON by Postgres
+    from two CTEs; the workouts come from the in-memory catalog cache.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                WITH profile AS (
+                    SELECT id, name, age, height, weight, goals, experience, preferences
+                    FROM users
+                    WHERE id = %(user_id)s AND deleted_at IS NULL
+                ), history AS (
+                    SELECT week_start_date, plan_data, created_at
+                    FROM schedules
+                    WHERE user_id = %(user_id)s
+                    ORDER BY week_start_date DESC
+                    LIMIT %(limit)s
+                )
+                SELECT
+                    (SELECT row_to_json(profile) FROM profile) AS profile,
+                    COALESCE(
+                        (SELECT json_agg(history ORDER BY history.week_start_date DESC) FROM history), '[]'
+                    ) AS previous_schedules
+            """, {"user_id": user_id, "limit": previous_limit})
+            row = cursor.fetchone()
+
+    return {
+        "profile": row["profile"],
+        "workouts": workout_catalog.all(),
+        "previous_schedules": row["previous_schedules"],
+    }
+
+
+# Model turns the tool-driven prompt takes: profile, workouts, history, save, final answer
+TOOL_MODE_TURNS = 5
+
+
+def summarize_agent_usage(messages: list, mode: str, context_chars: int = 0) -> dict:
+    """
+    Count model turns and tokens from an agent run.
+
+    For prefetched runs, tokens_saved is a lower-bound estimate: each turn the
+    tool-driven flow would have added resends at least the system prompt, tool
+    schemas and instructions (the first turn's input minus the inlined context).
+
+    input_tokens includes the prompt-cache reads and writes, which are also
+    reported on their own as cache_read_tokens and cache_creation_tokens.
+    """
+    ai_messages = [m for m in messages if isinstance(m, AIMessage)]
+    usage = [m.usage_metadata or {} for m in ai_messages]
+    cache = [u.get("input_token_details") or {} for u in usage]
+    summary = {
+        "mode": mode,
+        "model_turns": len(ai_messages),
+        "input_tokens": sum(u.get("input_tokens", 0) for u in usage),
+        "output_tokens": sum(u.get("output_tokens", 0) for u in usage),
+        "cache_read_tokens": sum(c.get("cache_read", 0) for c in cache),
+        "cache_creation_tokens": sum(c.get("cache_creation", 0) for c in cache),
+    }
+    if mode == "prefetched":
+        turns_saved = max(TOOL_MODE_TURNS - len(ai_messages), 0)
+        first_turn_input = usage[0].get("input_tokens", 0) if usage else 0
+        fixed_prefix = max(first_turn_input - context_chars // 4, 0)  # ~4 chars per token
+        summary["turns_saved"] = turns_saved
+        summary["tokens_saved"] = turns_saved * fixed_prefix
+    return summary
+
+
+# Provider errors; these count against the governor's circuit breaker
+PROVIDER_ERRORS = (
+    anthropic.APIConnectionError,  # includes APITimeoutError
+    anthropic.RateLimitError,
+    anthropic.InternalServerError,  # includes 529 overloaded
 )
+# Errors meaning "the model is slow or unavailable right now"; these trigger the rule-based fallback
+LLM_UNAVAILABLE_ERRORS = (*PROVIDER_ERRORS, CircuitOpenError, GovernorTimeoutError)
+# The provider is shedding load; batch.py pauses every worker on these
+RATE_LIMIT_ERRORS = (anthropic.RateLimitError, anthropic.InternalServerError)
+
+MAX_OUTPUT_TOKENS = 2048
+
+PROMPT_CACHE = os.getenv("AGENT_PROMPT_CACHE", "true").lower() != "false"
+PROMPT_CACHE_TTL = os.getenv("AGENT_PROMPT_CACHE_TTL", "5m")
+# Shorter prefixes are not cached by the provider; longer ones cost more to read than the shortlist
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("AGENT_PROMPT_CACHE_MIN_TOKENS", "1024"))
+PROMPT_CACHE_MAX_TOKENS = int(os.getenv("AGENT_PROMPT_CACHE_MAX_TOKENS", "2000"))
+
+# Built on first use by build_agent(), not at import (see agent_loader.py)
+model = None
+Workout_Planner_agent = None
+plan_model = None
+structured_model = None
+days_model = None
+_build_lock = threading.Lock()
 
 
-def generate_weekly_schedule(user_id: int, week_start_date: str | None = None) -> dict:
+def build_agent():
+    """
+    Build the chat model, the tool-driven agent and the structured-output models.
+
+    Anything already set is kept, so a model installed beforehand (e.g.
+    fake_chat_model.install_fake_model) is what the agent is built on.
+    """
+    global model, Workout_Planner_agent, plan_model, structured_model, days_model
+    with _build_lock:
+        if model is None:
+            model = ChatAnthropic(
+                model="claude-sonnet-4-20250514",
+                max_tokens=MAX_OUTPUT_TOKENS,
+                default_request_timeout=float(os.getenv("AGENT_LLM_TIMEOUT", "60")),
+                max_retries=int(os.getenv("AGENT_LLM_MAX_RETRIES", "2")),
+            )  # type: ignore
+        if Workout_Planner_agent is None:
+            # The agent looks the user up with tools and answers with a WeeklyPlan.
+            # The middleware caches tools + system prompt; other models ignore it
+            middleware = [
+                AnthropicPromptCachingMiddleware(ttl=PROMPT_CACHE_TTL, unsupported_model_behavior="ignore")
+            ] if PROMPT_CACHE else []
+            Workout_Planner_agent = create_agent(
+                model=model,
+                system_prompt=SYSTEM_PROMPT,
+                tools=[
+                    get_user_profile,
+                    get_available_workouts,
+                    get_previous_schedules,
+                ],
+                response_format=WeeklyPlan,
+                middleware=middleware,
+            )
+        if plan_model is None:
+            # Structured output as a forced WeeklyPlan tool call, streamed so finished days can be sent early
+            plan_model = model.bind_tools([WeeklyPlan], tool_choice=WeeklyPlan.__name__)
+        if structured_model is None:
+            # Same schema without streaming, for the repair pass
+            structured_model = model.with_structured_output(WeeklyPlan, include_raw=True)
+        if days_model is None:
+            # A few replacement days, for schedule_patch.py
+            days_model = model.with_structured_output(PlanDays, include_raw=True)
+
+
+def estimate_tokens(messages: list, turns: int = 1) -> int:
+    """Tokens to reserve with the LLM governor: ~4 chars per input token, plus max output, per turn."""
+    chars = sum(len(str(message.content)) for message in messages)
+    return turns * (chars // 4 + MAX_OUTPUT_TOKENS)
+
+
+def _drain(events):
+    """Run an event generator to the end and return its return value."""
+    while True:
+        try:
+            next(events)
+        except StopIteration as stop:
+            return stop.value
+
+
+def _check_structured(result: dict, workout_ids: set) -> tuple[dict | None, str | None]:
+    """(plan_data, None) for a valid structured-output result, else (None, problems)."""
+    if result.get("parsing_error") or result.get("parsed") is None:
+        return None, f"could not parse the schedule: {result.get('parsing_error') or 'no schedule returned'}"
+    try:
+        return validate_plan(result["parsed"], workout_ids).model_dump(), None
+    except ValidationError as e:
+        return None, describe_errors(e)
+
+
+def _repair_plan(messages: list, raw: AIMessage | None, error: str,
+                 workout_ids: set, trace: RequestTrace) -> tuple[dict, AIMessage]:
+    """
+    One repair pass: send the problems back and ask for a corrected plan.
+
+    Much cheaper than regenerating, since the conversation so far is reused.
+    Raises InvalidPlanError if the second answer is still invalid.
+    """
+    plan_output_stats.count("repairs")
+    feedback = f"The schedule is invalid: {error}\nReturn a corrected schedule."
+    if raw is not None and raw.tool_calls:
+        # Structured output arrives as a tool call, which must be answered by a tool result
+        messages = messages + [raw] + [
+            ToolMessage(content=feedback, tool_call_id=call["id"]) for call in raw.tool_calls
+        ]
+    else:
+        messages = messages + ([raw] if raw is not None else []) + [HumanMessage(content=feedback)]
+
+    build_agent()
+    started = time.perf_counter()
+    with llm_governor.slot(estimate_tokens(messages), failures=PROVIDER_ERRORS) as slot:
+        result = structured_model.invoke(messages)
+        usage = result["raw"].usage_metadata if result.get("raw") is not None else None
+        slot.record(usage)
+    record_model_call("repair", time.perf_counter() - started, usage, trace)
+    plan, error = _check_structured(result, workout_ids)
+    if plan is None:
+        plan_output_stats.count("failed")
+        raise InvalidPlanError(f"Model returned an invalid schedule: {error}")
+    plan_output_stats.count("repaired")
+    return plan, result["raw"]
+
+
+def _partial_days(message: AIMessage) -> list:
+    """Days parsed so far from a streamed WeeklyPlan tool call."""
+    if not message.tool_calls:
+        return []
+    workouts = message.tool_calls[0]["args"].get("workouts")
+    return workouts if isinstance(workouts, list) else []
+
+
+def stream_plan(messages: list, workout_ids: set, trace: RequestTrace):
+    """
+    Ask the model for a WeeklyPlan and validate it against workout_ids.
+
+    Generator: yields ("plan_day", day) as each day of the answer is
+    complete and returns (plan_data, AI responses). An invalid answer gets
+    one repair pass, announced by a "plan_reset" event because days already
+    sent may change; raises InvalidPlanError if that fails too.
+    """
+    build_agent()
+    plan_output_stats.count("requests")
+    started = time.perf_counter()
+    gathered, sent = None, 0
+    with llm_governor.slot(estimate_tokens(messages), failures=PROVIDER_ERRORS) as slot:
+        for chunk in plan_model.stream(messages):
+            gathered = chunk if gathered is None else gathered + chunk
+            days = _partial_days(gathered)
+            # The last day may still be streaming; it is complete once the next one starts
+            while sent < len(days) - 1:
+                yield "plan_day", days[sent]
+                sent += 1
+
+        raw = message_chunk_to_message(gathered) if gathered is not None else None
+        slot.record(raw.usage_metadata if raw else None)
+    record_model_call("plan", time.perf_counter() - started, raw.usage_metadata if raw else None, trace)
+    parsed = raw.tool_calls[0]["args"] if raw is not None and raw.tool_calls else None
+    plan, error = _check_structured({"parsed": parsed}, workout_ids)
+    responses = [raw] if raw is not None else []
+    if plan is None:
+        plan_output_stats.count("parse_failures")
+        if sent:
+            yield "plan_reset", {"reason": error}
+            sent = 0
+        plan, repaired = _repair_plan(messages, raw, error, workout_ids, trace)
+        responses.append(repaired)
+
+    for day in plan["workouts"][sent:]:
+        yield "plan_day", day
+    return plan, responses
+
+
+def generate_weekly_schedule(user_id: int, week_start_date: str | None = None,
+                             prefetch_context: bool = True, mode: str = "llm",
+                             fallback: bool | None = None) -> dict:
     """
     Main function to generate a weekly workout schedule.
     This is called by the FastAPI endpoints.
+
+    With prefetch_context (the default) the profile, catalog and recent
+    schedules are fetched in one query and put in the prompt, so planning
+    takes one model turn. Pass False to let the model fetch them through its
+    tools instead.
+
+    Either way the model answers with a WeeklyPlan (structured output), which
+    is validated against the catalog, repaired once if needed, and saved;
+    "plan_data" holds it as a dict and "schedule" as JSON text.
+
+    mode="fast" skips the model and uses the rule-based scheduler. In "llm"
+    mode, a model timeout, rate limit or unrepairable schedule falls back to
+    the rule-based scheduler unless fallback is False (default: AGENT_FALLBACK, true).
+    """
+    result = None
+    for event, data in stream_weekly_schedule(user_id, week_start_date, prefetch_context, mode, fallback):
+        if event in ("schedule", "error"):
+            result = data
+    return result
+
+
+def stream_weekly_schedule(user_id: int, week_start_date: str | None = None,
+                           prefetch_context: bool = True, mode: str = "llm",
+                           fallback: bool | None = None):
+    """
+    generate_weekly_schedule as a stream of (event, data) pairs (POST /ai/schedule/stream).
+
+    Progress events come first: "progress" (stage changes), "tool_start" /
+    "tool_end" (tool mode), "plan_day" as each day is generated,
+    "plan_reset" before a repaired plan and "fallback". The last event is
+    always "schedule" with the generate_weekly_schedule result, or "error".
     """
     # Calculate week start date if not provided
-    calculated_date: str
-    if not week_start_date:
-        today = datetime.now()
-        days_ahead = 0 - today.weekday()
-        if days_ahead <= 0:
-            days_ahead += 7
-        calculated_date = (today + timedelta(days=days_ahead)).strftime("%Y-%m-%d")
-    else:
-        calculated_date = week_start_date
+    calculated_date: str = week_start_date or next_week_start()
     
+    if fallback is None:
+        fallback = os.getenv("AGENT_FALLBACK", "true").lower() != "false"
+
+    trace = RequestTrace("generate_weekly_schedule", user_id=user_id, mode=mode)
     try:
-        # Create prompt for the agent
-        prompt = f"""
-Generate a personalized weekly workout schedule for user ID {user_id} starting on {calculated_date}.
+        if mode == "fast":
+            yield "progress", {"stage": "planning", "mode": "fast"}
+            with trace.stage("fast_plan"):
+                result = generate_fast_schedule(user_id, calculated_date)
+        elif prefetch_context:
+            result = yield from _stream_with_prefetched_context(user_id, calculated_date, trace)
+        else:
+            result = yield from _stream_with_tools(user_id, calculated_date, trace)
+    except (*LLM_UNAVAILABLE_ERRORS, InvalidPlanError) as e:
+        if not fallback:
+            result = {
+                "success": False,
+                "error": str(e),
+                "user_id": user_id,
+                "week_start_date": calculated_date
+            }
+        else:
+            print(f"Model unavailable or invalid for user {user_id}, using rule-based schedule: {e}")
+            yield "fallback", {"reason": f"{type(e).__name__}: {e}"}
+            with trace.stage("fast_plan"):
+                result = generate_fast_schedule(user_id, calculated_date)
+            result["fallback_reason"] = f"{type(e).__name__}: {e}"
+    except Exception as e:
+        result = {
+            "success": False,
+            "error": str(e),
+            "user_id": user_id,
+            "week_start_date": calculated_date
+        }
+    
+    if not result.get("success"):
+        outcome = "error"
+    else:
+        outcome = "fallback" if result.get("fallback_reason") else "success"
+    result["timings"] = trace.finish(mode, outcome)
+    yield ("schedule" if result.get("success") else "error"), result
+
+
+def _stream_with_tools(user_id: int, week_start_date: str, trace: RequestTrace):
+    """Tool-driven flow: the agent looks the user up itself, then answers with a WeeklyPlan."""
+    # Create prompt for the agent
+    prompt = f"""
+Generate a personalized weekly workout schedule for user ID {user_id} starting on {week_start_date}.
 
 Steps:
 1. Use get_user_profile to fetch their goals, experience, and preferences
 2. Use get_available_workouts to see what exercises are available
 3. Use get_previous_schedules to check what they've done recently
-4. Create a balanced weekly schedule
-5. Use save_workout_schedule to save it with user_id={user_id} and week_start_date="{calculated_date}"
-
-Return the complete schedule as JSON.
+4. Create a balanced weekly schedule and return it as the WeeklyPlan
 """
-        
-        # Invoke the agent
-        response = Workout_Planner_agent.invoke({
-            "messages": [HumanMessage(content=prompt)]
-        })
-        
+    yield "progress", {"stage": "planning"}
+    
+    # Stream the agent's steps so tool calls are reported as they happen
+    build_agent()
+    messages, structured = [], None
+    last_update = time.perf_counter()
+    first_turn = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt)]
+    # One slot covers the whole agent loop, so it is charged a request per possible model turn
+    with llm_governor.slot(estimate_tokens(first_turn, TOOL_MODE_TURNS), failures=PROVIDER_ERRORS,
+                           requests=TOOL_MODE_TURNS) as slot:
+        for update in trace.traced(Workout_Planner_agent.stream(
+            {"messages": [HumanMessage(content=prompt)]}, stream_mode="updates"
+        )):
+            # Each update arrives when its node (a model turn or a round of tools) finishes
+            elapsed, last_update = time.perf_counter() - last_update, time.perf_counter()
+            for node_update in update.values():
+                if not isinstance(node_update, dict):
+                    continue
+                new_messages = node_update.get("messages", [])
+                ai_messages = [m for m in new_messages if isinstance(m, AIMessage)]
+                if ai_messages:
+                    record_model_call("agent", elapsed, ai_messages[-1].usage_metadata, trace)
+                    slot.record(ai_messages[-1].usage_metadata)
+                elif any(isinstance(m, ToolMessage) for m in new_messages):
+                    trace.record("tools", elapsed)
+                for message in new_messages:
+                    messages.append(message)
+                    if isinstance(message, AIMessage):
+                        for call in message.tool_calls:
+                            if call["name"] != WeeklyPlan.__name__:
+                                yield "tool_start", {"tool": call["name"], "args": call["args"]}
+                    elif isinstance(message, ToolMessage) and message.name != WeeklyPlan.__name__:
+                        yield "tool_end", {"tool": message.name, "status": message.status}
+                if node_update.get("structured_response") is not None:
+                    structured = node_update["structured_response"]
+    
+    # Validate the structured answer; an invalid one gets a single repair pass
+    plan_output_stats.count("requests")
+    workout_ids = {w["id"] for w in workout_catalog.all()}
+    plan, error = _check_structured({"parsed": structured}, workout_ids)
+    if plan is None:
+        plan_output_stats.count("parse_failures")
+        plan, repaired = _repair_plan(
+            [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt)] + messages,
+            None, error, workout_ids, trace
+        )
+        messages = messages + [repaired]
+    for day in plan["workouts"]:
+        yield "plan_day", day
+    
+    yield "progress", {"stage": "saving"}
+    with trace.stage("save"):
+        schedule_id = store_schedule(user_id, week_start_date, plan)
+    agent_usage = summarize_agent_usage(messages, "tools")
+    AGENT_TURNS.observe(agent_usage["model_turns"], flow="tools")
+    
+    return {
+        "success": True,
+        "user_id": user_id,
+        "week_start_date": week_start_date,
+        "schedule": json.dumps(plan),
+        "plan_data": plan,
+        "schedule_id": schedule_id,
+        "agent_usage": agent_usage
+    }
+
+
+def generate_fast_schedule(user_id: int, week_start_date: str) -> dict:
+    """Build and save a schedule with the rule-based scheduler (no model call)."""
+    try:
+        context = fetch_agent_context(user_id)
+        if not context["profile"]:
+            return {
+                "success": False,
+                "error": "User not found",
+                "user_id": user_id,
+                "week_start_date": week_start_date
+            }
+
+        plan_data = generate_rule_based_plan(
+            context["profile"], context["workouts"], context["previous_schedules"]
+        )
+        schedule_id = store_schedule(user_id, week_start_date, plan_data)
+
         return {
             "success": True,
             "user_id": user_id,
-            "week_start_date": calculated_date,
-            "schedule": response["messages"][-1].content
+            "week_start_date": week_start_date,
+            "schedule": json.dumps(plan_data),
+            "plan_data": plan_data,
+            "schedule_id": schedule_id,
+            "mode": "fast"
         }
     except Exception as e:
         return {
             "success": False,
             "error": str(e),
             "user_id": user_id,
-            "week_start_date": calculated_date
+            "week_start_date": week_start_date
         }
 
+
+_system_lock = threading.Lock()
+_system_message = (None, None)  # (catalog digest, SystemMessage or None)
+
+
+def planner_system_message(workouts: list, digest: str) -> SystemMessage | None:
+    """
+    SYSTEM_PROMPT plus a snapshot of the whole catalog, ending in the cache breakpoint.
+
+    Identical for every user while the catalog digest is unchanged, so the
+    provider caches tools + system prompt + catalog once and every request
+    reads it back. None when that prefix (~4 chars per token) is under
+    PROMPT_CACHE_MIN_TOKENS or over PROMPT_CACHE_MAX_TOKENS. Rebuilt only
+    when the digest (catalog_digest of workouts) changes.
+    """
+    global _system_message
+    with _system_lock:
+        cached_digest, message = _system_message
+        if cached_digest == digest:
+            return message
+    snapshot = f"Workout catalog {digest}:\n{compact_catalog(sorted(workouts, key=lambda w: w['id']))}"
+    tool_schema = json.dumps(WeeklyPlan.model_json_schema())
+    prefix_tokens = (len(tool_schema) + len(SYSTEM_PROMPT) + len(snapshot)) // 4
+    if PROMPT_CACHE_MIN_TOKENS <= prefix_tokens <= PROMPT_CACHE_MAX_TOKENS:
+        cache_control = {"type": "ephemeral", "ttl": PROMPT_CACHE_TTL}
+        message = SystemMessage(content=[
+            {"type": "text", "text": SYSTEM_PROMPT},
+            {"type": "text", "text": snapshot, "cache_control": cache_control},
+        ])
+    else:
+        message = None
+    with _system_lock:
+        _system_message = (digest, message)
+    return message
+
+
+def _prefetched_prompt(user_id: int, week_start_date: str, context: dict,
+                       cached_catalog: bool = False) -> tuple[str, str, set]:
+    """
+    Build the prefetched-context prompt; returns (prompt, inlined context, offered workout ids).
+
+    With cached_catalog the system message already holds the whole catalog
+    (planner_system_message), so only the shortlist's ids are sent.
+    """
+    # The best-matching workouts: suggested ids with a cached catalog, else the only rows sent
+    shortlist = select_relevant_workouts(context["workouts"], context["profile"])
+    user_json = json.dumps({
+        "profile": context["profile"],
+        "previous_schedules": context["previous_schedules"],
+    }, default=str)
+
+    if cached_catalog:
+        # The rows are already in the cached catalog snapshot; only their ids are per user
+        suggested = ", ".join(str(w["id"]) for w in shortlist)
+        context_json = f"{user_json}\n\nSuggested workout ids: {suggested}"
+        prompt = f"""
+The user's data is below, so you do not need to look anything up:
+- "profile": their goals, experience, and preferences
+- "previous_schedules": what they've done recently (newest first)
+- Suggested workout ids: the catalog workouts that best match them
+
+{context_json}
+
+Generate a personalized weekly workout schedule for user ID {user_id} starting on {week_start_date}.
+Create a balanced weekly schedule using workout ids from the workout catalog, preferring the suggested ones.
+"""
+        if workout_location(context["profile"]) == "home":
+            prompt += "The user trains at home: use only home (h) workouts.\n"
+            return prompt, context_json, {w["id"] for w in context["workouts"] if w["type"] == "home"}
+        return prompt, context_json, {w["id"] for w in context["workouts"]}
+
+    context_json = f"{user_json}\n\nWorkouts:\n{compact_catalog(shortlist)}"
+    prompt = f"""
+Generate a personalized weekly workout schedule for user ID {user_id} starting on {week_start_date}.
+
+The user's data is below, so you do not need to look anything up:
+- "profile": their goals, experience, and preferences
+- "previous_schedules": what they've done recently (newest first)
+- Workouts: the exercises available to them, one per line
+
+{context_json}
+
+Create a balanced weekly schedule using only workout ids from the Workouts list.
+"""
+    return prompt, context_json, {w["id"] for w in shortlist}
+
+
+def _prefetched_messages(user_id: int, week_start_date: str, context: dict,
+                         digest: str) -> tuple[list, str, set]:
+    """Messages for a prefetched-context plan; returns (messages, inlined context, offered workout ids)."""
+    system = planner_system_message(context["workouts"], digest) if PROMPT_CACHE else None
+    prompt, context_json, workout_ids = _prefetched_prompt(
+        user_id, week_start_date, context, cached_catalog=system is not None
+    )
+    if system is None:
+        system = SystemMessage(content=SYSTEM_PROMPT)
+    return [system, HumanMessage(content=prompt)], context_json, workout_ids
+
+
+def _stream_with_prefetched_context(user_id: int, week_start_date: str, trace: RequestTrace):
+    yield "progress", {"stage": "loading_context"}
+    with trace.stage("context"):
+        context = fetch_agent_context(user_id)
+    if not context["profile"]:
+        return {
+            "success": False,
+            "error": "User not found",
+            "user_id": user_id,
+            "week_start_date": week_start_date
+        }
+
+    plan, agent_usage = yield from _plan_for_context(user_id, week_start_date, context, trace)
+    # Saved here rather than by a tool call, so planning takes one model turn
+    yield "progress", {"stage": "saving"}
+    with trace.stage("save"):
+        schedule_id = store_schedule(user_id, week_start_date, plan)
+
+    return {
+        "success": True,
+        "user_id": user_id,
+        "week_start_date": week_start_date,
+        "schedule": json.dumps(plan),
+        "plan_data": plan,
+        "schedule_id": schedule_id,
+        "plan_cache": "miss" if agent_usage else "hit",
+        "agent_usage": agent_usage
+    }
+
+
+def _plan_for_context(user_id: int, week_start_date: str, context: dict, trace: RequestTrace):
+    """
+    Plan from the LLM plan cache, or with one structured model call on a miss.
+
+    Generator yielding the plan events; returns (plan_data, agent_usage),
+    where agent_usage is None for a cache hit.
+    """
+    # Digest of the workouts actually in the prompt, even if the catalog reloaded since
+    digest = catalog_digest(context["workouts"])
+    inputs = cache_inputs(context["profile"], digest, context["previous_schedules"])
+    with trace.stage("plan_cache"):
+        plan = plan_cache.get(inputs)
+    if plan is not None:
+        if plan_cache.perturb:
+            plan = perturb_plan(plan, context["workouts"], f"{user_id}:{week_start_date}")
+        yield "progress", {"stage": "plan_cache_hit"}
+        for day in plan["workouts"]:
+            yield "plan_day", day
+        return plan, None
+
+    yield "progress", {"stage": "planning"}
+    messages, context_json, workout_ids = _prefetched_messages(user_id, week_start_date, context, digest)
+    plan, responses = yield from stream_plan(messages, workout_ids, trace)
+    with trace.stage("plan_cache"):
+        plan_cache.put(inputs, plan)
+    agent_usage = summarize_agent_usage(responses, "prefetched", len(context_json))
+    AGENT_TURNS.observe(agent_usage["model_turns"], flow="prefetched")
+    return plan, agent_usage
+
+
+def plan_schedule(user_id: int, week_start_date: str, mode: str = "llm") -> dict | None:
+    """
+    Generate plan_data for one user without saving it (used by batch.py).
+
+    Makes a single model call with the prefetched context (none in "fast"
+    mode or on a plan cache hit). Returns None if the user does not exist; model errors and
+    InvalidPlanError are raised so the caller can back off, retry or fall back.
+    """
+    trace = RequestTrace("plan_schedule", user_id=user_id, mode=mode)
+    outcome = "error"
+    try:
+        with trace.stage("context"):
+            context = fetch_agent_context(user_id)
+        if not context["profile"]:
+            outcome = "not_found"
+            return None
+
+        if mode == "fast":
+            with trace.stage("fast_plan"):
+                plan = generate_rule_based_plan(
+                    context["profile"], context["workouts"], context["previous_schedules"]
+                )
+        else:
+            plan, _ = _drain(_plan_for_context(user_id, week_start_date, context, trace))
+        outcome = "success"
+        return plan
+    finally:
+        trace.finish(mode, outcome)
+
+
+PATCH_PROMPT = """You fill in days of an existing weekly workout schedule after the user changed their profile.
+Return exactly the requested days, with the requested duration and intensity, using only workout ids
+from the Workouts list. Choose workouts for the user's goal and each day's focus, and avoid the kept
+days' workouts where there is an alternative."""
+
+
+def plan_days(profile: dict, slots: list, kept: list, workouts: list) -> list:
+    """
+    Ask the model for just some days of a schedule (used by schedule_patch.py).
+
+    `slots` are the days to fill ({"day", "focus", "duration_minutes",
+    "intensity"}), `kept` the days that stay as they are. The prompt holds
+    only the profile fields that matter, one line per day and the workout
+    shortlist, so the call is far smaller than a full plan. Returns the new
+    day dicts; raises InvalidPlanError if the answer doesn't cover exactly
+    the requested days with offered workouts.
+    """
+    build_agent()
+    shortlist = select_relevant_workouts(workouts, profile)
+    workout_ids = {w["id"] for w in shortlist}
+    kept_lines = "\n".join(
+        f"- {day['day']}: {', '.join(str(i) for i in day['workout_ids'])} ({day.get('notes', '')})"
+        for day in kept
+    ) or "- none"
+    slot_lines = "\n".join(
+        f"- {slot['day']}: {slot['focus']} focus, {slot['duration_minutes']} min, {slot['intensity']}"
+        for slot in slots
+    )
+    profile_json = json.dumps({
+        key: profile.get(key) for key in ("goal", "goals", "experience_level", "experience", "workout_location")
+        if profile.get(key)
+    }, default=str)
+    prompt = f"""Profile: {profile_json}
+
+Kept days:
+{kept_lines}
+
+Days to fill:
+{slot_lines}
+
+Workouts:
+{compact_catalog(shortlist)}
+"""
+    messages = [SystemMessage(content=PATCH_PROMPT), HumanMessage(content=prompt)]
+
+    started = time.perf_counter()
+    with llm_governor.slot(estimate_tokens(messages), failures=PROVIDER_ERRORS) as slot:
+        result = days_model.invoke(messages)
+        usage = result["raw"].usage_metadata if result.get("raw") is not None else None
+        slot.record(usage)
+    record_model_call("patch", time.perf_counter() - started, usage)
+
+    if result.get("parsing_error") or result.get("parsed") is None:
+        raise InvalidPlanError(f"Model returned no days: {result.get('parsing_error') or 'empty answer'}")
+    try:
+        parsed = PlanDays.model_validate(result["parsed"].model_dump(), context={"workout_ids": workout_ids})
+    except ValidationError as e:
+        raise InvalidPlanError(f"Model returned invalid days: {describe_errors(e)}")
+    days = {day.day: day.model_dump() for day in parsed.workouts}
+    wanted = [slot["day"] for slot in slots]
+    if sorted(days) != sorted(wanted):
+        raise InvalidPlanError(f"Model returned days {sorted(days)}, expected {sorted(wanted)}")
+    return [days[day] for day in wanted]
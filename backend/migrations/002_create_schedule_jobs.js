@@ -0,0 +1,68 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 002_create_schedule_jobs.js
+ * Stores background schedule-generation jobs for the Python API (backend/agent/jobs.py)
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    await client.query(`
+      CREATE TABLE IF NOT EXISTS schedule_jobs (
+        id UUID PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        week_start_date DATE NOT NULL,
+        status VARCHAR(20) NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        result JSONB,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP,
+        CHECK (status IN ('queued', 'running', 'succeeded', 'failed'))
+      );
+    `);
+
+    // At most one active job per user and week (dedup across API workers)
+    await client.query(`
+      CREATE UNIQUE INDEX IF NOT EXISTS idx_schedule_jobs_active_user_week
+      ON schedule_jobs(user_id, week_start_date)
+      WHERE status IN ('queued', 'running');
+    `);
+    await client.query(`
+      CREATE INDEX IF NOT EXISTS idx_schedule_jobs_pending
+      ON schedule_jobs(created_at)
+      WHERE status IN ('queued', 'running');
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 002_create_schedule_jobs completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 002_create_schedule_jobs failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('DROP TABLE IF EXISTS schedule_jobs CASCADE;');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 002_create_schedule_jobs completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 002_create_schedule_jobs failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
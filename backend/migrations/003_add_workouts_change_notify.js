@@ -0,0 +1,58 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 003_add_workouts_change_notify.js
+ * Sends NOTIFY workouts_changed whenever the workouts table changes, so the
+ * Python API's in-memory catalog (backend/agent/catalog.py) can reload
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    await client.query(`
+      CREATE OR REPLACE FUNCTION notify_workouts_changed() RETURNS trigger AS $$
+      BEGIN
+        PERFORM pg_notify('workouts_changed', TG_OP);
+        RETURN NULL;
+      END;
+      $$ LANGUAGE plpgsql;
+    `);
+
+    await client.query('DROP TRIGGER IF EXISTS workouts_changed ON workouts;');
+    await client.query(`
+      CREATE TRIGGER workouts_changed
+      AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON workouts
+      FOR EACH STATEMENT EXECUTE FUNCTION notify_workouts_changed();
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 003_add_workouts_change_notify completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 003_add_workouts_change_notify failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('DROP TRIGGER IF EXISTS workouts_changed ON workouts;');
+    await client.query('DROP FUNCTION IF EXISTS notify_workouts_changed();');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 003_add_workouts_change_notify completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 003_add_workouts_change_notify failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
@@ -0,0 +1,59 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 004_create_schedule_batch_runs.js
+ * Tracks weekly batch schedule generation runs so they can resume after a crash
+ * (backend/agent/batch.py)
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    await client.query(`
+      CREATE TABLE IF NOT EXISTS schedule_batch_runs (
+        id UUID PRIMARY KEY,
+        week_start_date DATE NOT NULL,
+        mode VARCHAR(20) NOT NULL DEFAULT 'llm',
+        status VARCHAR(20) NOT NULL DEFAULT 'running',
+        last_user_id INTEGER NOT NULL DEFAULT 0,
+        processed INTEGER NOT NULL DEFAULT 0,
+        succeeded INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        CHECK (status IN ('running', 'completed', 'failed'))
+      );
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 004_create_schedule_batch_runs completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 004_create_schedule_batch_runs failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('DROP TABLE IF EXISTS schedule_batch_runs CASCADE;');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 004_create_schedule_batch_runs completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 004_create_schedule_batch_runs failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
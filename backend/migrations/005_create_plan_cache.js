@@ -0,0 +1,59 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 005_create_plan_cache.js
+ * LLM plan cache shared by all API workers and batch runs, keyed by the
+ * normalized planning inputs (backend/agent/plan_cache.py)
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    await client.query(`
+      CREATE TABLE IF NOT EXISTS plan_cache (
+        cache_key VARCHAR(64) PRIMARY KEY,
+        inputs JSONB NOT NULL,
+        plan_data JSONB NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        expires_at TIMESTAMP NOT NULL
+      );
+    `);
+
+    // LRU pruning deletes the least recently used rows first
+    await client.query(`
+      CREATE INDEX IF NOT EXISTS idx_plan_cache_last_used_at
+      ON plan_cache(last_used_at);
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 005_create_plan_cache completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 005_create_plan_cache failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('DROP TABLE IF EXISTS plan_cache CASCADE;');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 005_create_plan_cache completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 005_create_plan_cache failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
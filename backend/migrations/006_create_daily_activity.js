@@ -0,0 +1,236 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 006_create_daily_activity.js
+ * Per-user, per-day totals of the water, steps and calories logs
+ * (backend/agent/activity_rollup.py). Statement triggers on the log tables
+ * apply every insert, update and delete in the writer's transaction, whichever
+ * backend wrote it; the table is backfilled from the existing logs.
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    await client.query(`
+      CREATE TABLE IF NOT EXISTS daily_activity (
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        activity_date DATE NOT NULL,
+        water_ml DECIMAL(12, 2) NOT NULL DEFAULT 0,
+        water_logs INTEGER NOT NULL DEFAULT 0,
+        steps INTEGER NOT NULL DEFAULT 0,
+        steps_logs INTEGER NOT NULL DEFAULT 0,
+        calories INTEGER NOT NULL DEFAULT 0,
+        protein DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        carbs DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        fat DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        fiber DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        sugar DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        food_items INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, activity_date)
+      );
+    `);
+
+    // Reconciliation deletes stale days across all users by date
+    await client.query(`
+      CREATE INDEX IF NOT EXISTS idx_daily_activity_activity_date
+      ON daily_activity(activity_date);
+    `);
+
+    // Applies one statement on a log table from its transition tables: old rows
+    // are subtracted and new rows added. Only additions create a day, so logs
+    // deleted along with their user (ON DELETE CASCADE) never insert a row.
+    await client.query(`
+      CREATE OR REPLACE FUNCTION apply_daily_activity() RETURNS trigger AS $$
+      DECLARE
+        changes JSONB := '[]';
+      BEGIN
+        -- Set by log_partitions.py while it moves rows between partitions
+        IF current_setting('daily_activity.skip_triggers', true) = 'on' THEN
+          RETURN NULL;
+        END IF;
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+          changes := changes || (
+            SELECT COALESCE(jsonb_agg(to_jsonb(r) || '{"sign": -1}'::jsonb), '[]') FROM old_rows r
+          );
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+          changes := changes || (
+            SELECT COALESCE(jsonb_agg(to_jsonb(r) || '{"sign": 1}'::jsonb), '[]') FROM new_rows r
+          );
+        END IF;
+
+        WITH logs AS (
+          SELECT (change->>'user_id')::int AS user_id,
+                 (change->>'logged_at')::timestamp::date AS activity_date,
+                 (change->>'sign')::int AS sign,
+                 change AS log
+          FROM jsonb_array_elements(changes) AS change
+          WHERE change->>'logged_at' IS NOT NULL
+        ),
+        totals AS (
+          SELECT user_id, activity_date,
+                 SUM(sign * COALESCE((log->>'amount')::numeric, 0)) AS water_ml,
+                 CASE WHEN TG_TABLE_NAME = 'water_logs' THEN SUM(sign) ELSE 0 END AS water_logs,
+                 SUM(sign * COALESCE((log->>'steps')::int, 0)) AS steps,
+                 CASE WHEN TG_TABLE_NAME = 'steps_logs' THEN SUM(sign) ELSE 0 END AS steps_logs,
+                 SUM(sign * COALESCE((log->>'calories')::int, 0)) AS calories,
+                 SUM(sign * COALESCE((log->>'protein')::numeric, 0)) AS protein,
+                 SUM(sign * COALESCE((log->>'carbs')::numeric, 0)) AS carbs,
+                 SUM(sign * COALESCE((log->>'fat')::numeric, 0)) AS fat,
+                 SUM(sign * COALESCE((log->>'fiber')::numeric, 0)) AS fiber,
+                 SUM(sign * COALESCE((log->>'sugar')::numeric, 0)) AS sugar,
+                 CASE WHEN TG_TABLE_NAME = 'calories_logs' THEN SUM(sign) ELSE 0 END AS food_items
+          FROM logs
+          GROUP BY user_id, activity_date
+        ),
+        updated AS (
+          UPDATE daily_activity d SET
+            water_ml = d.water_ml + t.water_ml,
+            water_logs = d.water_logs + t.water_logs,
+            steps = d.steps + t.steps,
+            steps_logs = d.steps_logs + t.steps_logs,
+            calories = d.calories + t.calories,
+            protein = d.protein + t.protein,
+            carbs = d.carbs + t.carbs,
+            fat = d.fat + t.fat,
+            fiber = d.fiber + t.fiber,
+            sugar = d.sugar + t.sugar,
+            food_items = d.food_items + t.food_items,
+            updated_at = NOW()
+          FROM totals t
+          WHERE d.user_id = t.user_id AND d.activity_date = t.activity_date
+          RETURNING d.user_id, d.activity_date
+        )
+        INSERT INTO daily_activity (user_id, activity_date, water_ml, water_logs, steps, steps_logs,
+                                    calories, protein, carbs, fat, fiber, sugar, food_items, updated_at)
+        SELECT t.*, NOW() FROM totals t
+        WHERE t.water_logs + t.steps_logs + t.food_items > 0
+          AND NOT EXISTS (
+            SELECT 1 FROM updated u WHERE u.user_id = t.user_id AND u.activity_date = t.activity_date
+          )
+        ON CONFLICT (user_id, activity_date) DO UPDATE SET
+          water_ml = daily_activity.water_ml + EXCLUDED.water_ml,
+          water_logs = daily_activity.water_logs + EXCLUDED.water_logs,
+          steps = daily_activity.steps + EXCLUDED.steps,
+          steps_logs = daily_activity.steps_logs + EXCLUDED.steps_logs,
+          calories = daily_activity.calories + EXCLUDED.calories,
+          protein = daily_activity.protein + EXCLUDED.protein,
+          carbs = daily_activity.carbs + EXCLUDED.carbs,
+          fat = daily_activity.fat + EXCLUDED.fat,
+          fiber = daily_activity.fiber + EXCLUDED.fiber,
+          sugar = daily_activity.sugar + EXCLUDED.sugar,
+          food_items = daily_activity.food_items + EXCLUDED.food_items,
+          updated_at = NOW();
+
+        -- Days whose last log went
+        DELETE FROM daily_activity d
+        USING jsonb_array_elements(changes) AS change
+        WHERE (change->>'sign')::int < 0
+          AND d.user_id = (change->>'user_id')::int
+          AND d.activity_date = (change->>'logged_at')::timestamp::date
+          AND d.water_logs <= 0 AND d.steps_logs <= 0 AND d.food_items <= 0;
+
+        RETURN NULL;
+      END;
+      $$ LANGUAGE plpgsql;
+    `);
+
+    // Migration 010 calls this again for the partitioned log tables
+    await client.query(`
+      CREATE OR REPLACE FUNCTION create_daily_activity_triggers(log_table TEXT) RETURNS void AS $$
+      BEGIN
+        EXECUTE format('CREATE TRIGGER daily_activity_insert AFTER INSERT ON %I
+          REFERENCING NEW TABLE AS new_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_activity()', log_table);
+        EXECUTE format('CREATE TRIGGER daily_activity_update AFTER UPDATE ON %I
+          REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_activity()', log_table);
+        EXECUTE format('CREATE TRIGGER daily_activity_delete AFTER DELETE ON %I
+          REFERENCING OLD TABLE AS old_rows
+          FOR EACH STATEMENT EXECUTE FUNCTION apply_daily_activity()', log_table);
+      END;
+      $$ LANGUAGE plpgsql;
+    `);
+
+    // Triggers first: they lock the log tables, so no log lands between the backfill and them
+    await client.query(`SELECT create_daily_activity_triggers('water_logs');`);
+    await client.query(`SELECT create_daily_activity_triggers('steps_logs');`);
+    await client.query(`SELECT create_daily_activity_triggers('calories_logs');`);
+
+    await client.query(`
+      INSERT INTO daily_activity (user_id, activity_date, water_ml, water_logs, steps, steps_logs,
+                                  calories, protein, carbs, fat, fiber, sugar, food_items, updated_at)
+      SELECT user_id, activity_date, SUM(water_ml), SUM(water_logs), SUM(steps), SUM(steps_logs),
+             SUM(calories), SUM(protein), SUM(carbs), SUM(fat), SUM(fiber), SUM(sugar), SUM(food_items),
+             NOW()
+      FROM (
+        SELECT user_id, logged_at::date AS activity_date,
+               SUM(amount) AS water_ml, COUNT(*) AS water_logs,
+               0 AS steps, 0 AS steps_logs, 0 AS calories,
+               0 AS protein, 0 AS carbs, 0 AS fat, 0 AS fiber, 0 AS sugar, 0 AS food_items
+        FROM water_logs
+        WHERE logged_at IS NOT NULL
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT user_id, logged_at::date, 0, 0, SUM(steps), COUNT(*), 0, 0, 0, 0, 0, 0, 0
+        FROM steps_logs
+        WHERE logged_at IS NOT NULL
+        GROUP BY 1, 2
+        UNION ALL
+        SELECT user_id, logged_at::date, 0, 0, 0, 0, SUM(calories),
+               COALESCE(SUM(protein), 0), COALESCE(SUM(carbs), 0), COALESCE(SUM(fat), 0),
+               COALESCE(SUM(fiber), 0), COALESCE(SUM(sugar), 0), COUNT(*)
+        FROM calories_logs
+        WHERE logged_at IS NOT NULL
+        GROUP BY 1, 2
+      ) activity
+      GROUP BY user_id, activity_date
+      ON CONFLICT (user_id, activity_date) DO UPDATE SET
+        water_ml = EXCLUDED.water_ml,
+        water_logs = EXCLUDED.water_logs,
+        steps = EXCLUDED.steps,
+        steps_logs = EXCLUDED.steps_logs,
+        calories = EXCLUDED.calories,
+        protein = EXCLUDED.protein,
+        carbs = EXCLUDED.carbs,
+        fat = EXCLUDED.fat,
+        fiber = EXCLUDED.fiber,
+        sugar = EXCLUDED.sugar,
+        food_items = EXCLUDED.food_items,
+        updated_at = NOW();
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 006_create_daily_activity completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 006_create_daily_activity failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    // Dropping the function drops the triggers on the log tables with it
+    await client.query('DROP FUNCTION IF EXISTS apply_daily_activity() CASCADE;');
+    await client.query('DROP FUNCTION IF EXISTS create_daily_activity_triggers(TEXT);');
+    await client.query('DROP TABLE IF EXISTS daily_activity CASCADE;');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 006_create_daily_activity completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 006_create_daily_activity failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
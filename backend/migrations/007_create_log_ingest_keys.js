@@ -0,0 +1,56 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 007_create_log_ingest_keys.js
+ * Idempotency keys of ingested activity logs, so a device that uploads the
+ * same readings twice doesn't double count them (backend/agent/log_ingest.py)
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    await client.query(`
+      CREATE TABLE IF NOT EXISTS log_ingest_keys (
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        idempotency_key VARCHAR(255) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, idempotency_key)
+      );
+    `);
+
+    // Keys are pruned after LOG_IDEMPOTENCY_TTL
+    await client.query(`
+      CREATE INDEX IF NOT EXISTS idx_log_ingest_keys_created_at
+      ON log_ingest_keys(created_at);
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 007_create_log_ingest_keys completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 007_create_log_ingest_keys failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('DROP TABLE IF EXISTS log_ingest_keys CASCADE;');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 007_create_log_ingest_keys completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 007_create_log_ingest_keys failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
@@ -0,0 +1,78 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 008_add_friends_change_notify.js
+ * Sends NOTIFY friends_changed for every friendship row change, so the Python
+ * API's in-memory friends graph (backend/agent/friends_graph.py) can update
+ * the affected pair without reloading
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    // Payload: {"old": [user_id, friend_id] or null, "new": [...] or null};
+    // "new" is only set for accepted rows
+    await client.query(`
+      CREATE OR REPLACE FUNCTION notify_friends_changed() RETURNS trigger AS $$
+      BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+          PERFORM pg_notify('friends_changed', 'reload');
+          RETURN NULL;
+        END IF;
+        PERFORM pg_notify('friends_changed', json_build_object(
+          'old', CASE WHEN TG_OP IN ('UPDATE', 'DELETE')
+                      THEN json_build_array(OLD.user_id, OLD.friend_id) END,
+          'new', CASE WHEN TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'accepted'
+                      THEN json_build_array(NEW.user_id, NEW.friend_id) END
+        )::text);
+        RETURN NULL;
+      END;
+      $$ LANGUAGE plpgsql;
+    `);
+
+    await client.query('DROP TRIGGER IF EXISTS friends_changed ON friends;');
+    await client.query(`
+      CREATE TRIGGER friends_changed
+      AFTER INSERT OR UPDATE OR DELETE ON friends
+      FOR EACH ROW EXECUTE FUNCTION notify_friends_changed();
+    `);
+
+    await client.query('DROP TRIGGER IF EXISTS friends_truncated ON friends;');
+    await client.query(`
+      CREATE TRIGGER friends_truncated
+      AFTER TRUNCATE ON friends
+      FOR EACH STATEMENT EXECUTE FUNCTION notify_friends_changed();
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 008_add_friends_change_notify completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 008_add_friends_change_notify failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('DROP TRIGGER IF EXISTS friends_truncated ON friends;');
+    await client.query('DROP TRIGGER IF EXISTS friends_changed ON friends;');
+    await client.query('DROP FUNCTION IF EXISTS notify_friends_changed();');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 008_add_friends_change_notify completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 008_add_friends_change_notify failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
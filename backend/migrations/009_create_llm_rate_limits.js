@@ -0,0 +1,52 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 009_create_llm_rate_limits.js
+ * Token buckets shared by every Python API worker and the batch CLI, so
+ * together they stay under the model provider's rate limits
+ * (backend/agent/llm_governor.py)
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    // One row per bucket; refilled from updated_at on every take
+    await client.query(`
+      CREATE TABLE IF NOT EXISTS llm_rate_limits (
+        name VARCHAR(50) PRIMARY KEY,
+        requests DOUBLE PRECISION NOT NULL,
+        tokens DOUBLE PRECISION NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT clock_timestamp()
+      );
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 009_create_llm_rate_limits completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 009_create_llm_rate_limits failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('DROP TABLE IF EXISTS llm_rate_limits;');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 009_create_llm_rate_limits completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 009_create_llm_rate_limits failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
@@ -0,0 +1,180 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 010_partition_activity_logs.js
+ * Turns water_logs, steps_logs and calories_logs into tables range-partitioned
+ * by month on logged_at, with a composite (user_id, logged_at) index and a
+ * BRIN index on logged_at instead of the two single-column indexes.
+ * Future months are created and old months archived to Parquet by the
+ * Python API (backend/agent/log_partitions.py); log_archives records where
+ * each archived month went.
+ */
+
+// Columns of each log table between user_id and logged_at; `id` keeps its existing sequence
+const LOG_TABLES = {
+  water_logs: {
+    columns: ['amount', 'unit'],
+    definition: `
+          amount DECIMAL(10, 2) NOT NULL,
+          unit VARCHAR(50) DEFAULT 'ml',`,
+  },
+  steps_logs: {
+    columns: ['steps'],
+    definition: `
+          steps INTEGER NOT NULL,`,
+  },
+  calories_logs: {
+    columns: ['food_name', 'calories', 'protein', 'carbs', 'fat', 'fiber', 'sugar', 'serving_size'],
+    definition: `
+          food_name VARCHAR(255) NOT NULL,
+          calories INTEGER NOT NULL,
+          protein DECIMAL(8, 2),
+          carbs DECIMAL(8, 2),
+          fat DECIMAL(8, 2),
+          fiber DECIMAL(8, 2),
+          sugar DECIMAL(8, 2),
+          serving_size VARCHAR(100),`,
+  },
+};
+
+// Months created past the current one; keep in line with LOG_PARTITION_MONTHS_AHEAD
+const MONTHS_AHEAD = 3;
+
+function monthName(month) {
+  return `${month.getUTCFullYear()}_${String(month.getUTCMonth() + 1).padStart(2, '0')}`;
+}
+
+function isoDate(month) {
+  return month.toISOString().slice(0, 10);
+}
+
+function addMonths(month, count) {
+  return new Date(Date.UTC(month.getUTCFullYear(), month.getUTCMonth() + count, 1));
+}
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    const now = new Date();
+    const lastMonth = addMonths(new Date(Date.UTC(now.getUTCFullYear(), now.getUTCMonth(), 1)), MONTHS_AHEAD);
+
+    for (const [table, { columns, definition }] of Object.entries(LOG_TABLES)) {
+      await client.query(`ALTER TABLE ${table} RENAME TO ${table}_unpartitioned;`);
+      await client.query(`ALTER INDEX ${table}_pkey RENAME TO ${table}_unpartitioned_pkey;`);
+      await client.query(`ALTER SEQUENCE ${table}_id_seq OWNED BY NONE;`);
+
+      // The partition key has to be part of the primary key, and can't be NULL
+      await client.query(`
+        CREATE TABLE ${table} (
+          id INTEGER NOT NULL DEFAULT nextval('${table}_id_seq'),
+          user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,${definition}
+          logged_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          PRIMARY KEY (id, logged_at)
+        ) PARTITION BY RANGE (logged_at);
+      `);
+      await client.query(`ALTER SEQUENCE ${table}_id_seq OWNED BY ${table}.id;`);
+
+      // One partition per month from the oldest log through MONTHS_AHEAD months from now
+      const { rows } = await client.query(`
+        SELECT date_trunc('month', LEAST(
+          COALESCE(MIN(COALESCE(logged_at, created_at)), CURRENT_TIMESTAMP), CURRENT_TIMESTAMP
+        ))::date::text AS first_month
+        FROM ${table}_unpartitioned;
+      `);
+      const [year, month] = rows[0].first_month.split('-').map(Number);
+      for (let start = new Date(Date.UTC(year, month - 1, 1)); start <= lastMonth; start = addMonths(start, 1)) {
+        await client.query(`
+          CREATE TABLE ${table}_${monthName(start)} PARTITION OF ${table}
+          FOR VALUES FROM ('${isoDate(start)}') TO ('${isoDate(addMonths(start, 1))}');
+        `);
+      }
+      // Catches rows outside the created months until log_partitions.py moves them
+      await client.query(`CREATE TABLE ${table}_default PARTITION OF ${table} DEFAULT;`);
+
+      await client.query(`
+        INSERT INTO ${table}
+        SELECT id, user_id, ${columns.join(', ')},
+               COALESCE(logged_at, created_at, CURRENT_TIMESTAMP), created_at, updated_at
+        FROM ${table}_unpartitioned;
+      `);
+      await client.query(`DROP TABLE ${table}_unpartitioned;`);
+      // After the copy, which daily_activity already counts (migration 006)
+      await client.query(`SELECT create_daily_activity_triggers('${table}');`);
+
+      // Indexes on the parent cascade to every partition, including later ones
+      await client.query(`
+        CREATE INDEX idx_${table}_user_id_logged_at ON ${table}(user_id, logged_at);
+      `);
+      await client.query(`
+        CREATE INDEX idx_${table}_logged_at_brin ON ${table} USING BRIN (logged_at);
+      `);
+    }
+
+    // Months moved out of Postgres, for the archive read path
+    await client.query(`
+      CREATE TABLE IF NOT EXISTS log_archives (
+        table_name VARCHAR(63) NOT NULL,
+        month DATE NOT NULL,
+        path TEXT NOT NULL,
+        rows BIGINT NOT NULL,
+        bytes BIGINT NOT NULL,
+        archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (table_name, month)
+      );
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 010_partition_activity_logs completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 010_partition_activity_logs failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    // Archived months stay in their Parquet files
+    for (const [table, { definition }] of Object.entries(LOG_TABLES)) {
+      await client.query(`ALTER TABLE ${table} RENAME TO ${table}_partitioned;`);
+      await client.query(`ALTER INDEX ${table}_pkey RENAME TO ${table}_partitioned_pkey;`);
+      await client.query(`ALTER SEQUENCE ${table}_id_seq OWNED BY NONE;`);
+      await client.query(`
+        CREATE TABLE ${table} (
+          id INTEGER PRIMARY KEY DEFAULT nextval('${table}_id_seq'),
+          user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,${definition}
+          logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+          updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+      `);
+      await client.query(`ALTER SEQUENCE ${table}_id_seq OWNED BY ${table}.id;`);
+      await client.query(`INSERT INTO ${table} SELECT * FROM ${table}_partitioned;`);
+      await client.query(`DROP TABLE ${table}_partitioned CASCADE;`);
+      await client.query(`SELECT create_daily_activity_triggers('${table}');`);
+      await client.query(`CREATE INDEX IF NOT EXISTS idx_${table}_user_id ON ${table}(user_id);`);
+      await client.query(`CREATE INDEX IF NOT EXISTS idx_${table}_logged_at ON ${table}(logged_at);`);
+    }
+    await client.query('DROP TABLE IF EXISTS log_archives;');
+
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 010_partition_activity_logs completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 010_partition_activity_logs failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
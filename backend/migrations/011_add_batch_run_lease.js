@@ -0,0 +1,46 @@
+const pool = require('../db/connection');
+
+/**
+ * Migration: 011_add_batch_run_lease.js
+ * Adds the lease owner to schedule_batch_runs, so only one process works on a
+ * run at a time; a resume only takes over once the owner's heartbeat
+ * (updated_at) is stale (backend/agent/batch.py)
+ */
+
+async function up() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+
+    await client.query(`
+      ALTER TABLE schedule_batch_runs ADD COLUMN IF NOT EXISTS lease_owner UUID;
+    `);
+
+    await client.query('COMMIT');
+    console.log('✓ Migration 011_add_batch_run_lease completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Migration 011_add_batch_run_lease failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+async function down() {
+  const client = await pool.connect();
+  try {
+    await client.query('BEGIN');
+    await client.query('ALTER TABLE schedule_batch_runs DROP COLUMN IF EXISTS lease_owner;');
+    await client.query('COMMIT');
+    console.log('✓ Rollback of migration 011_add_batch_run_lease completed successfully');
+  } catch (error) {
+    await client.query('ROLLBACK');
+    console.error('✗ Rollback of migration 011_add_batch_run_lease failed:', error);
+    throw error;
+  } finally {
+    client.release();
+  }
+}
+
+module.exports = { up, down };
@@ -0,0 +1,72 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from typing import Literal
+import asyncpg
+import psycopg2
+from database import get_async_connection
+from friends_graph import friends_graph
+
+router = APIRouter(prefix="/friends", tags=["friends"])
+
+
+async def fetch_names(user_ids: list) -> dict:
+    """id -> name for the given users (primary key lookups only)."""
+    if not user_ids:
+        return {}
+    async with get_async_connection() as conn:
+        rows = await conn.fetch("SELECT id, name FROM users WHERE id = ANY($1::int[])", user_ids)
+    return {row["id"]: row["name"] for row in rows}
+
+
+# GET /friends/stats - Friends graph size, freshness and lookup counters
+@router.get("/stats", response_model=dict)
+def get_friends_graph_stats():
+    return friends_graph.stats()
+
+
+# GET /friends/{user_id}/leaderboard - The user and their friends ranked over the last week
+@router.get("/{user_id}/leaderboard", response_model=dict)
+async def get_leaderboard(user_id: int, metric: Literal['steps', 'calories', 'active_days'] = Query(default='steps')):
+    """
+    Ranked from the in-memory friends graph (friends_graph.py); the only
+    query is the name lookup for the ranked users.
+    """
+    try:
+        entries = friends_graph.leaderboard(user_id, metric)
+        names = await fetch_names([entry["user_id"] for entry in entries])
+    except (asyncpg.PostgresError, psycopg2.Error, OSError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database error: {str(e)}"
+        )
+
+    if user_id not in names:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User with id {user_id} not found")
+    for entry in entries:
+        entry["name"] = names.get(entry["user_id"])
+    return {
+        "user_id": user_id,
+        "metric": metric,
+        "days": friends_graph.window_days,
+        "friend_count": len(entries) - 1,
+        "leaderboard": entries
+    }
+
+
+# GET /friends/{user_id}/mutual/{other_id} - Friends two users have in common
+@router.get("/{user_id}/mutual/{other_id}", response_model=dict)
+async def get_mutual_friends(user_id: int, other_id: int):
+    try:
+        mutual = friends_graph.mutual_friends(user_id, other_id)
+        names = await fetch_names(mutual)
+    except (asyncpg.PostgresError, psycopg2.Error, OSError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database error: {str(e)}"
+        )
+
+    return {
+        "user_id": user_id,
+        "other_id": other_id,
+        "count": len(mutual),
+        "mutual_friends": [{"id": friend_id, "name": names.get(friend_id)} for friend_id in mutual]
+    }
@@ -0,0 +1,134 @@
+from fastapi import APIRouter, HTTPException, Query, status
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Literal, Optional, Union
+from datetime import datetime, timedelta
+from decimal import Decimal
+import asyncpg
+from database import get_async_connection
+from log_ingest import log_ingest, BufferFullError
+from log_partitions import log_partitions, read_logs, ArchiveUnavailableError
+
+router = APIRouter(prefix="/logs", tags=["logs"])
+
+MAX_RECORDS_PER_BATCH = 5000
+
+
+class LogRecordBase(BaseModel):
+    user_id: int
+    logged_at: Optional[datetime] = Field(default=None, description="Defaults to the time the batch is received")
+    idempotency_key: Optional[str] = Field(
+        default=None, min_length=1, max_length=255,
+        description="Stable id of the reading (e.g. device id + sample id); repeats are dropped"
+    )
+
+
+class WaterLogRecord(LogRecordBase):
+    type: Literal['water']
+    amount: Decimal = Field(..., gt=0, le=20000)
+    unit: str = Field(default='ml', max_length=50)
+
+
+class StepsLogRecord(LogRecordBase):
+    type: Literal['steps']
+    steps: int = Field(..., ge=0, le=200000)
+
+
+class CaloriesLogRecord(LogRecordBase):
+    type: Literal['calories']
+    food_name: str = Field(..., min_length=1, max_length=255)
+    calories: int = Field(..., ge=0, le=20000)
+    protein: Optional[Decimal] = Field(default=None, ge=0, lt=1000000)
+    carbs: Optional[Decimal] = Field(default=None, ge=0, lt=1000000)
+    fat: Optional[Decimal] = Field(default=None, ge=0, lt=1000000)
+    fiber: Optional[Decimal] = Field(default=None, ge=0, lt=1000000)
+    sugar: Optional[Decimal] = Field(default=None, ge=0, lt=1000000)
+    serving_size: Optional[str] = Field(default=None, max_length=100)
+
+
+LogRecord = Annotated[Union[WaterLogRecord, StepsLogRecord, CaloriesLogRecord], Field(discriminator="type")]
+
+
+class LogBatch(BaseModel):
+    records: List[LogRecord] = Field(..., min_length=1, max_length=MAX_RECORDS_PER_BATCH)
+
+
+# POST /logs/batch - Ingest water, steps and calories logs for many users
+@router.post("/batch", response_model=dict, status_code=status.HTTP_201_CREATED)
+async def ingest_logs(batch: LogBatch):
+    """
+    Mixed log records, e.g. a wearable sync:
+    {"records": [
+        {"type": "steps", "user_id": 1, "steps": 812, "logged_at": "2025-12-02T08:00:00Z",
+         "idempotency_key": "watch-42:1733126400"},
+        {"type": "water", "user_id": 2, "amount": 250}
+    ]}
+
+    Returns once the records are committed. The ack counts records inserted,
+    dropped as duplicates (idempotency_key seen before) and rejected (unknown
+    user). Records from concurrent requests are written together (log_ingest.py).
+    """
+    try:
+        ack = await log_ingest.submit([record.model_dump() for record in batch.records])
+    except BufferFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": "1"}
+        )
+    except asyncpg.PostgresError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database error: {str(e)}"
+        )
+
+    return {"success": True, **ack}
+
+
+# GET /logs/stats - Ingestion throughput and batching
+@router.get("/stats", response_model=dict)
+async def get_ingest_stats():
+    return log_ingest.stats()
+
+
+# GET /logs/partitions/stats - Partition maintenance and archive counters
+@router.get("/partitions/stats", response_model=dict)
+def get_partition_stats():
+    return log_partitions.stats()
+
+
+def _local_time(value: datetime) -> datetime:
+    """logged_at columns are TIMESTAMP (local time), as in log_ingest.py."""
+    return value.astimezone().replace(tzinfo=None) if value.tzinfo else value
+
+
+# GET /logs/{user_id} - A user's raw logs of one type, including archived months
+@router.get("/{user_id}", response_model=dict)
+async def get_user_logs(
+    user_id: int,
+    log_type: Literal['water', 'steps', 'calories'] = Query(..., alias="type"),
+    start: Optional[datetime] = Query(default=None, description="Defaults to 30 days before end"),
+    end: Optional[datetime] = Query(default=None, description="Exclusive; defaults to now"),
+    limit: int = Query(default=1000, ge=1, le=10000)
+):
+    """
+    Oldest first. Months older than LOG_RETAIN_MONTHS are read from their
+    Parquet archive (log_partitions.py); daily totals are cheaper from
+    GET /activity/{user_id}/trend.
+    """
+    end = _local_time(end) if end else datetime.now()
+    start = _local_time(start) if start else end - timedelta(days=30)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start must be before end")
+
+    try:
+        async with get_async_connection() as conn:
+            result = await read_logs(conn, log_type, user_id, start, end, limit)
+    except ArchiveUnavailableError as e:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    except (asyncpg.PostgresError, OSError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Database error: {str(e)}"
+        )
+
+    return {"user_id": user_id, "type": log_type, "start": start, "end": end, **result}
@@ -2,9 +2,9 @@ from fastapi import APIRouter, HTTPException, status
 from pydantic import BaseModel, Field
 from typing import Optional, Literal
 from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from database import get_db_connection
+import asyncpg
+from database import get_async_connection
+from schedule_patch import schedule_patcher
 
 router = APIRouter(prefix="/api", tags=["users"])
 
@@ -35,30 +35,35 @@ class UserResponse(BaseModel):
     updated_at: datetime
 
     class Config:
-        orm_mode = True
+        from_attributes = True
 
 # POST /api/users - Create or update user profile
 @router.post("/users", response_model=dict, status_code=status.HTTP_201_CREATED)
 async def create_or_update_user(user: UserCreate, user_id: Optional[int] = None):
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
         if user_id:
-            # UPDATE existing user
-            cursor.execute("""
-                UPDATE users 
-                SET name = %s, age = %s, height = %s, weight = %s, goal = %s,
-                    experience_level = %s, days_per_week = %s, workout_location = %s, diet_preference = %s, updated_at = NOW()
-                WHERE id = %s
-                RETURNING *
-            """, (
-                user.name, user.age, user.height, user.weight, user.goal,
-                user.experienceLevel,user.daysPerWeek, user.workout_location,
-                user.diet_preference, user_id
-            ))
-            
-            result = cursor.fetchone()
+            async with get_async_connection() as conn:
+                # UPDATE existing user; the previous values decide which schedule days to patch.
+                # The legacy columns are read too: the profile normalizers fall back to them
+                async with conn.transaction():
+                    previous = await conn.fetchrow("""
+                        SELECT goal, experience_level, days_per_week, workout_location,
+                               goals, experience, preferences
+                        FROM users
+                        WHERE id = $1
+                        FOR UPDATE
+                    """, user_id)
+                    result = await conn.fetchrow("""
+                        UPDATE users 
+                        SET name = $1, age = $2, height = $3, weight = $4, goal = $5,
+                            experience_level = $6, days_per_week = $7, workout_location = $8, diet_preference = $9, updated_at = NOW()
+                        WHERE id = $10
+                        RETURNING *
+                    """,
+                        user.name, user.age, user.height, user.weight, user.goal,
+                        user.experienceLevel, user.daysPerWeek, user.workout_location,
+                        user.diet_preference, user_id
+                    )
             
             if not result:
                 raise HTTPException(
@@ -66,52 +71,45 @@ async def create_or_update_user(user: UserCreate, user_id: Optional[int] = None)
                     detail="User not found"
                 )
             
-            conn.commit()
+            # Regenerates only the invalidated days of this and next weeks' schedules. Runs after
+            # the async connection is back in the pool, since patching takes one from the sync pool
+            schedule_update = await schedule_patcher.apply(user_id, dict(previous), dict(result))
             return {
                 "message": "Profile updated successfully",
-                "user": dict(result)
+                "user": dict(result),
+                "schedule_update": schedule_update
             }
-        else:
+
+        async with get_async_connection() as conn:
             # CREATE new user
-            cursor.execute("""
+            result = await conn.fetchrow("""
                 INSERT INTO users 
                 (name, age, height, weight, goal, experience_level, days_per_week, workout_location,
                 diet_preference, created_at, updated_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, NOW(), NOW())
                 RETURNING *
-            """, (
+            """,
                 user.name, user.age, user.height, user.weight, user.goal,
                 user.experienceLevel, user.daysPerWeek, user.workout_location, user.diet_preference
-                
-            ))
-            
-            result = cursor.fetchone()
-            conn.commit()
-            
-            return {
-                "message": "Profile created successfully",
-                "user": dict(result)
-            }
+            )
+        
+        return {
+            "message": "Profile created successfully",
+            "user": dict(result)
+        }
             
-    except psycopg2.Error as e:
-        conn.rollback()
+    except asyncpg.PostgresError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Database error: {str(e)}"
         )
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
 
 # GET /api/users/:id - Fetch user profile
 @router.get("/users/{user_id}", response_model=dict)
 async def get_user(user_id: int):
-    conn = get_db_connection()
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
-        result = cursor.fetchone()
+        async with get_async_connection() as conn:
+            result = await conn.fetchrow("SELECT * FROM users WHERE id = $1", user_id)
         
         if not result:
             raise HTTPException(
@@ -121,12 +119,8 @@ async def get_user(user_id: int):
         
         return {"user": dict(result)}
         
-    except psycopg2.Error as e:
+    except asyncpg.PostgresError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Database error: {str(e)}"
-        )
-    finally:
-        if cursor:
-            cursor.close()
-        conn.close()
\ No newline at end of file
+        )
\ No newline at end of file